@@ -1,14 +1,27 @@
 from flask import Flask
 from .views import bp as main_bp
+from common.logs import configure_logging
+from common.metrics import instrument_app
+from common.tracing import instrument_tracing
 import os
 
 def create_app():
+    # Journal JSON asynchrone (thread d'écriture), jetons masqués
+    configure_logging("front")
+
     app = Flask(__name__)
     app.secret_key = os.environ.get("FLASK_SECRET_KEY", "change-me")
 
     # Enregistre le blueprint
     app.register_blueprint(main_bp)
 
+    # Latences par route, rendu des templates et GET /metrics (format Prometheus) ;
+    # le front est exposé publiquement : /metrics et /debug/traces exigent FRONT_OPS_TOKEN
+    ops_token = os.environ.get("FRONT_OPS_TOKEN", "")
+    instrument_app(app, "front", token=ops_token)
+    # Request id transmis aux services, spans échantillonnés (GET /debug/traces)
+    instrument_tracing(app, "front", token=ops_token)
+
     # S’assure que le dossier data existe (pour la base)
     data_dir = os.path.join(os.path.dirname(__file__), "data")
     os.makedirs(data_dir, exist_ok=True)
@@ -1,62 +1,194 @@
 from flask import Flask, request, jsonify
 import jwt
 import datetime
+import hmac
+import logging
+import os
+import sys
+import uuid
+
+from password_hasher import PasswordHasher, PasswordHasherBusy
+from rate_limiter import TokenBucketLimiter
+from signing_keys import SigningKeyRing
+from token_store import RefreshReused, TokenStateStore
+from user_store import UserStore
+
+# Le package `common` est à la racine du dépôt : on le rend importable quand le service est lancé comme script
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.logs import configure_logging
+from common.metrics import instrument_app
+from common.tracing import instrument_tracing, span
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Clé secrète pour signer les JWT (à NE PAS exposer en prod)
-SECRET_KEY = "change-me-super-secret"
+# Clés RSA pour signer les JWT (RS256) : la clé privée reste dans ce service,
+# les clés publiques sont publiées sur /.well-known/jwks.json pour que le
+# front puisse vérifier les tokens localement.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+KEYS_PATH = os.environ.get("AUTH_KEYS_PATH", os.path.join(DATA_DIR, "jwt_keys.json"))
+KEY_ROTATION_SECONDS = int(os.environ.get("AUTH_KEY_ROTATION_SECONDS", 24 * 3600))
+
+# Rotation des refresh tokens et révocations (SQLite partagé entre les workers)
+TOKENS_DB_PATH = os.environ.get("AUTH_TOKENS_DB_PATH", os.path.join(DATA_DIR, "auth_tokens.db"))
+
+# /revocations : réservé au front, "Authorization: Bearer <INTERNAL_SERVICE_TOKEN>"
+SERVICE_TOKEN = os.environ.get("INTERNAL_SERVICE_TOKEN", "")
 
-# Pour le TP : un "vrai-faux" user en dur
-# Tu pourras plus tard le remplacer par une vraie base ou un appel au User Service.
-DUMMY_USER = {
-    "id": 1,
-    "username": "baptiste",
-    "password": "password123",  # en vrai : hashé !
-    "email": "baptiste@example.com",
-}
+ACCESS_TOKEN_TTL = datetime.timedelta(minutes=5)
+REFRESH_TOKEN_TTL = datetime.timedelta(hours=1)
 
+# Utilisateurs : table `users` de app/data/database.db (hash scrypt)
+USERS_DB_PATH = os.environ.get("AUTH_DB_PATH", os.path.join(DATA_DIR, "database.db"))
 
-def generate_access_token(user_id: int, username: str) -> str:
+# Trousseau, bases et pool de hachage : créés par create_app(), pas à l'import.
+# Lancé directement, ce script est réimporté sous le nom __mp_main__ par les
+# processus « spawn » du pool, qui n'ont besoin que de password_hasher.
+KEYRING = None
+TOKENS = None
+USERS = None
+HASHER = None
+
+# Limitation des tentatives de login, avant tout calcul de hash :
+# par nom d'utilisateur (5 essais puis 1 toutes les 12 s) et par IP (20 puis 1 par seconde)
+LOGIN_LIMIT_PER_USER = TokenBucketLimiter(
+    rate=float(os.environ.get("AUTH_LOGIN_USER_RATE", 1 / 12)),
+    burst=int(os.environ.get("AUTH_LOGIN_USER_BURST", 5)),
+)
+LOGIN_LIMIT_PER_IP = TokenBucketLimiter(
+    rate=float(os.environ.get("AUTH_LOGIN_IP_RATE", 1.0)),
+    burst=int(os.environ.get("AUTH_LOGIN_IP_BURST", 20)),
+)
+
+
+def create_app() -> Flask:
+    """
+    Prépare le service (journal, métriques, trousseau, bases, pool de hachage)
+    et retourne l'application. gunicorn l'appelle dans chaque worker
+    (`auth_service:create_app()`) ; les appels suivants ne refont rien.
+    """
+    global KEYRING, TOKENS, USERS, HASHER
+    if KEYRING is not None:
+        return app
+
+    configure_logging("auth_service")
+    instrument_app(app, "auth_service")
+    instrument_tracing(app, "auth_service")
+
+    KEYRING = SigningKeyRing(KEYS_PATH, rotation_seconds=KEY_ROTATION_SECONDS)
+    TOKENS = TokenStateStore(TOKENS_DB_PATH)
+    USERS = UserStore(USERS_DB_PATH)
+
+    # Vérification des mots de passe hors des threads de requête
+    HASHER = PasswordHasher(
+        workers=int(os.environ.get("AUTH_HASH_WORKERS", 2)),
+        max_queue=int(os.environ.get("AUTH_HASH_QUEUE", 16)),
+    )
+    HASHER.warm_up()
+    return app
+
+
+def _sign(payload: dict) -> str:
+    """
+    Signe un payload avec la clé courante du trousseau (header `kid`).
+    """
+    kid, private_key = KEYRING.current()
+    token = jwt.encode(payload, private_key, algorithm="RS256", headers={"kid": kid})
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+    return token
+
+
+def _decode(token: str) -> dict:
+    """
+    Vérifie la signature d'un token avec la clé désignée par son `kid`.
+    Lève jwt.InvalidTokenError (ou ExpiredSignatureError) si invalide.
+    """
+    kid = jwt.get_unverified_header(token).get("kid")
+    public_key = KEYRING.public_key(kid) if kid else None
+    if public_key is None:
+        raise jwt.InvalidTokenError("Clé de signature inconnue")
+    return jwt.decode(
+        token,
+        public_key,
+        algorithms=["RS256"],
+        options={"require": ["exp"]}
+    )
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def generate_access_token(user_id: int, username: str, family: str = None) -> str:
     """
     Génère un access token valable 5 minutes.
+    `family` : famille du refresh token dont il est issu (révoquée au logout).
     """
     payload = {
         "sub": str(user_id),
         "username": username,
         "type": "access",
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
-        "iat": datetime.datetime.utcnow(),
+        "jti": uuid.uuid4().hex,
+        "exp": _now() + ACCESS_TOKEN_TTL,
+        "iat": _now(),
     }
-    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
-    return token
+    if family:
+        payload["fam"] = family
+    return _sign(payload)
 
 
-def generate_refresh_token(user_id: int, username: str) -> str:
+def generate_refresh_token(user_id: int, username: str, family: str, jti: str,
+                           expires_at: datetime.datetime) -> str:
     """
-    Génère un refresh token valable 1 heure.
+    Génère un refresh token (valable 1 heure à l'émission).
     """
     payload = {
         "sub": str(user_id),
         "username": username,
         "type": "refresh",
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-        "iat": datetime.datetime.utcnow(),
+        "jti": jti,
+        "fam": family,
+        "exp": expires_at,
+        "iat": _now(),
     }
-    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
-    return token
+    return _sign(payload)
+
+
+def issue_refresh_token(user_id: int, username: str) -> tuple:
+    """
+    Ouvre une nouvelle famille de refresh tokens (au login).
+    Retourne (refresh token, famille).
+    """
+    family, jti = uuid.uuid4().hex, uuid.uuid4().hex
+    expires_at = _now() + REFRESH_TOKEN_TTL
+    TOKENS.register(jti, family, str(user_id), expires_at.timestamp())
+    return generate_refresh_token(user_id, username, family, jti, expires_at), family
+
+
+def _client_ip() -> str:
+    """
+    IP de l'utilisateur final : le front la transmet dans X-Forwarded-For
+    (les services n'écoutent que sur 127.0.0.1).
+    """
+    forwarded = request.headers.get("X-Forwarded-For", "")
+    return forwarded.split(",")[0].strip() or request.remote_addr or "inconnue"
+
+
+def _too_many_attempts(retry_after: float):
+    resp = jsonify({"error": f"Trop de tentatives, réessayez dans {int(retry_after) + 1} s"})
+    resp.headers["Retry-After"] = str(int(retry_after) + 1)
+    return resp, 429
 
 
 @app.route("/login", methods=["POST"])
 def login():
     """
-    Authentification basique :
+    Authentification :
     - Reçoit { "username": "...", "password": "..." }
-    - Vérifie par rapport à DUMMY_USER
+    - Limite les tentatives par IP et par nom d'utilisateur (429 avant tout calcul)
+    - Vérifie le hash scrypt de la table users (pool de processus)
     - Retourne un JWT si OK
     """
     data = request.get_json(silent=True) or {}
@@ -66,20 +198,30 @@ def login():
     if not username or not password:
         return jsonify({"error": "Identifiants manquants"}), 400
 
-    # Vérification ultra simplifiée : un seul user en dur
-    if username != DUMMY_USER["username"] or password != DUMMY_USER["password"]:
+    retry_after = LOGIN_LIMIT_PER_IP.acquire(_client_ip())
+    if not retry_after:
+        retry_after = LOGIN_LIMIT_PER_USER.acquire(username.lower())
+    if retry_after:
+        return _too_many_attempts(retry_after)
+
+    user = USERS.get_by_username(username)
+    try:
+        with span("password verify"):
+            valid = HASHER.verify(user["password_hash"] if user else None, password)
+    except (PasswordHasherBusy, TimeoutError):
+        return jsonify({"error": "Service surchargé, réessayez dans un instant"}), 503
+    if not valid:
         return jsonify({"error": "Identifiants invalides"}), 401
 
-    access_token = generate_access_token(DUMMY_USER["id"], DUMMY_USER["username"])
-    refresh_token = generate_refresh_token(DUMMY_USER["id"], DUMMY_USER["username"])
+    refresh_token, family = issue_refresh_token(user["id"], user["username"])
+    access_token = generate_access_token(user["id"], user["username"], family)
 
     return jsonify({
         "access_token": access_token,
         "refresh_token": refresh_token,
         "token_type": "Bearer",
-        "user_id": DUMMY_USER["id"],
-        "username": DUMMY_USER["username"],
-        "email": DUMMY_USER["email"],
+        "user_id": user["id"],
+        "username": user["username"],
     }), 200
 
 
@@ -92,31 +234,32 @@ def verify():
     """
     data = request.get_json(silent=True) or {}
     token = data.get("token")
-    print("DEBUG /verify received token:", token)
 
     if not token:
         return jsonify({"error": "Token manquant"}), 400
 
     try:
-        decoded = jwt.decode(
-            token,
-            SECRET_KEY,
-            algorithms=["HS256"],
-            options={"require": ["exp"]}
-        )
+        decoded = _decode(token)
     except jwt.ExpiredSignatureError:
         return jsonify({"valid": False, "error": "Token expiré"}), 401
     except jwt.InvalidTokenError as e:
-        print("DEBUG /verify invalid token:", repr(e))
+        logger.debug("/verify : token invalide (%s)", e)
         return jsonify({"valid": False, "error": "Token invalide"}), 401
 
     if decoded.get("type") != "access":
         return jsonify({"valid": False, "error": "Mauvais type de token"}), 401
 
+    # Lookup en mémoire (dict), sans requête SQL
+    if TOKENS.is_revoked(decoded.get("jti"), decoded.get("fam")):
+        return jsonify({"valid": False, "error": "Token révoqué"}), 401
+
     # decoded contient le payload du token (sub, username, exp, etc.)
     user_info = {
         "sub": decoded.get("sub"),
         "username": decoded.get("username"),
+        "exp": decoded.get("exp"),
+        "jti": decoded.get("jti"),
+        "fam": decoded.get("fam"),
     }
 
     return jsonify({"valid": True, "user": user_info}), 200
@@ -125,7 +268,9 @@ def verify():
 @app.route("/refresh", methods=["POST"])
 def refresh():
     """
-    Renvoie un nouvel access token à partir d'un refresh token valide.
+    Renvoie un nouvel access token et un nouveau refresh token (rotation) à
+    partir d'un refresh token valide. Le refresh token présenté est consommé :
+    le réutiliser plus tard révoque toute sa famille.
     """
     data = request.get_json(silent=True) or {}
     refresh_token = data.get("refresh_token")
@@ -134,30 +279,115 @@ def refresh():
         return jsonify({"error": "Refresh token manquant"}), 400
 
     try:
-        decoded = jwt.decode(
-            refresh_token,
-            SECRET_KEY,
-            algorithms=["HS256"],
-            options={"require": ["exp"]}
-        )
+        decoded = _decode(refresh_token)
     except jwt.ExpiredSignatureError:
         return jsonify({"error": "Refresh token expiré"}), 401
     except jwt.InvalidTokenError as e:
-        print("DEBUG /refresh invalid token:", repr(e))
+        logger.debug("/refresh : token invalide (%s)", e)
         return jsonify({"error": "Refresh token invalide"}), 401
 
     if decoded.get("type") != "refresh":
         return jsonify({"error": "Mauvais type de token"}), 401
 
-    new_access = generate_access_token(decoded["sub"], decoded["username"])
+    # Les refresh tokens émis avant la rotation n'ont ni jti ni famille : reconnexion
+    jti, family = decoded.get("jti"), decoded.get("fam")
+    if not jti or not family:
+        return jsonify({"error": "Refresh token invalide"}), 401
+    if TOKENS.is_revoked(jti, family):
+        return jsonify({"error": "Refresh token révoqué"}), 401
+
+    try:
+        next_jti, next_expires_at = TOKENS.rotate(
+            jti, uuid.uuid4().hex, (_now() + REFRESH_TOKEN_TTL).timestamp(),
+            family_ttl=REFRESH_TOKEN_TTL.total_seconds(),
+        )
+    except RefreshReused:
+        return jsonify({"error": "Refresh token déjà utilisé"}), 401
+    except KeyError:
+        return jsonify({"error": "Refresh token invalide"}), 401
+
+    new_refresh = generate_refresh_token(
+        decoded["sub"], decoded["username"], family, next_jti,
+        datetime.datetime.fromtimestamp(next_expires_at, datetime.timezone.utc),
+    )
+    new_access = generate_access_token(decoded["sub"], decoded["username"], family)
 
     return jsonify({
         "access_token": new_access,
+        "expires_in": int(ACCESS_TOKEN_TTL.total_seconds()),
+        "refresh_token": new_refresh,
         "user_id": decoded["sub"],
         "username": decoded["username"],
     }), 200
 
 
+@app.route("/logout", methods=["POST"])
+def logout():
+    """
+    Révoque une session :
+    - Reçoit { "refresh_token": "...", "access_token": "..." } (l'un ou l'autre)
+    - La famille du token est révoquée : refresh tokens et access tokens qui en sont issus
+    """
+    data = request.get_json(silent=True) or {}
+    tokens = [t for t in (data.get("refresh_token"), data.get("access_token")) if t]
+    if not tokens:
+        return jsonify({"error": "Token manquant"}), 400
+
+    # Tous les tokens sont validés avant la première révocation : un token
+    # invalide fait échouer la requête sans l'avoir appliquée à moitié
+    valid = []
+    for token in tokens:
+        try:
+            valid.append(_decode(token))
+        except jwt.ExpiredSignatureError:
+            # Déjà expiré : plus rien à révoquer
+            continue
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Token invalide"}), 401
+
+    for decoded in valid:
+        if decoded.get("fam"):
+            # Tout token de la famille expire au plus tard dans REFRESH_TOKEN_TTL
+            TOKENS.revoke(decoded["fam"], (_now() + REFRESH_TOKEN_TTL).timestamp())
+        if decoded.get("jti"):
+            TOKENS.revoke(decoded["jti"], decoded["exp"])
+
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/revocations", methods=["GET"])
+def revocations():
+    """
+    Révocations en cours écrites après ?since=<seq>, pour le front qui vérifie
+    les tokens localement : { "revocations": [{"seq", "id", "exp"}], "last_seq": N, "more": bool }.
+    Réservé aux appels avec "Authorization: Bearer <INTERNAL_SERVICE_TOKEN>".
+    """
+    if not SERVICE_TOKEN:
+        return jsonify({"error": "Endpoint désactivé (INTERNAL_SERVICE_TOKEN non défini)."}), 403
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {SERVICE_TOKEN}".encode()):
+        return jsonify({"error": "Jeton de service invalide."}), 401
+    since = request.args.get("since", 0, type=int)
+    limit = 1000
+    rows = TOKENS.revocations_since(since, limit)
+    return jsonify({
+        "revocations": rows,
+        "last_seq": rows[-1]["seq"] if rows else since,
+        "more": len(rows) == limit,
+    }), 200
+
+
+@app.route("/.well-known/jwks.json", methods=["GET"])
+def jwks():
+    """
+    Publie les clés publiques de signature (format JWKS).
+    Le front les met en cache et ne les recharge qu'en cas de rotation.
+    """
+    resp = jsonify(KEYRING.jwks())
+    resp.headers["Cache-Control"] = "public, max-age=300"
+    return resp, 200
+
+
 @app.route("/health", methods=["GET"])
 def health():
     """
@@ -168,4 +398,4 @@ def health():
 
 if __name__ == "__main__":
     # Lance le service d'auth sur le port 5001
-    app.run(host="127.0.0.1", port=5001, debug=True)
\ No newline at end of file
+    create_app().run(host="127.0.0.1", port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+def _ready() -> int:
+    """Tâche vide : démarre un processus du pool (et l'import de werkzeug)."""
+    return os.getpid()
+
+
+class PasswordHasherBusy(Exception):
+    """Trop de vérifications de mot de passe en cours ou en attente."""
+
+
+class PasswordHasher:
+    """
+    Vérifie les mots de passe (scrypt, volontairement lent) dans un pool de processus borné.
+
+    - Le calcul ne tient pas le GIL des threads de requête : /verify et
+      /refresh restent rapides pendant une vague de logins.
+    - Au plus `workers` calculs simultanés et `max_queue` en attente ;
+      au-delà, PasswordHasherBusy est levée immédiatement.
+    - Le pool est créé au premier usage dans chaque processus (après le fork
+      des workers gunicorn), avec des processus « spawn » : pas de fork d'un
+      processus qui a déjà des threads.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, timeout: float = 5.0):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # Hash de référence : un utilisateur inconnu coûte le même temps qu'un mauvais mot de passe
+        self._dummy_hash = generate_password_hash(os.urandom(16).hex())
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def warm_up(self):
+        """
+        Démarre les processus du pool sans attendre : le premier login ne paie
+        pas leur lancement (plusieurs secondes en « spawn »).
+        À n'appeler que dans le processus principal, jamais dans un processus du pool.
+        """
+        pool = self._pool()
+        for _ in range(self.workers):
+            pool.submit(_ready)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Trop de vérifications de mot de passe en cours")
+        try:
+            return self._pool().submit(fn, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """
+        Vrai si `password` correspond à `password_hash` (None : utilisateur inconnu).
+        """
+        if password_hash is None:
+            self._run(check_password_hash, self._dummy_hash, password)
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password)
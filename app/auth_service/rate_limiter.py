@@ -0,0 +1,46 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Limiteur à seau de jetons par clé (nom d'utilisateur, IP...).
+
+    - Chaque clé dispose de `burst` jetons, regagnés au rythme de `rate` par seconde ;
+      une tentative consomme un jeton.
+    - Au plus `max_keys` seaux sont gardés (LRU) : une attaque sur des milliers
+      de noms différents ne fait pas grossir la mémoire. Un seau évincé
+      repart plein, ce qui ne favorise que des clés inactives depuis longtemps.
+    - Limite par processus : avec N workers, la limite effective est N fois plus haute.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()     # clé -> [jetons, dernier remplissage]
+        self._lock = threading.Lock()
+
+    def acquire(self, key) -> float:
+        """
+        Consomme un jeton pour `key`. Retourne 0 si la tentative est autorisée,
+        sinon le nombre de secondes avant le prochain jeton.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [float(self.burst), now]
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
@@ -0,0 +1,173 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+
+class SigningKeyRing:
+    """
+    Trousseau de clés RSA utilisées pour signer les JWT (RS256).
+
+    - La clé la plus récente signe les nouveaux tokens.
+    - Les clés précédentes restent publiées (JWKS) tant que des tokens
+      signés avec elles peuvent encore être valides.
+    - Le trousseau est persisté dans un fichier JSON partagé entre les
+      processus du service : chaque worker recharge le fichier s'il a changé.
+    - Une rotation se fait sous un verrou de fichier (`<path>.lock`), après
+      relecture du trousseau : deux workers ne perdent jamais la clé l'un de l'autre.
+    """
+
+    def __init__(self, path: str, rotation_seconds: int = 24 * 3600, max_keys: int = 3):
+        self.path = path
+        self.rotation_seconds = rotation_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._keys = []          # [{"kid", "created", "private_key"}], du plus ancien au plus récent
+        self._mtime = None
+        self._load_or_create()
+
+    # ---------- Persistance ----------
+
+    def _load_or_create(self):
+        if not os.path.exists(self.path):
+            tmp_path = self._write_tmp([self._new_key()])
+            try:
+                # Le fichier n'apparaît que complet, et os.link échoue s'il existe déjà :
+                # si plusieurs workers démarrent en même temps, un seul le crée
+                os.link(tmp_path, self.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp_path)
+        self._reload()
+
+    def _reload(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self._keys = [self._deserialize(k) for k in data.get("keys", [])]
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _write_tmp(self, keys: list) -> str:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"keys": [self._serialize(k) for k in keys]}, f)
+        return tmp_path
+
+    def _save(self):
+        os.replace(self._write_tmp(self._keys), self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    @contextmanager
+    def _file_lock(self):
+        """Verrou exclusif entre processus, libéré à la fermeture du descripteur."""
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _refresh_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            self._reload()
+
+    @staticmethod
+    def _new_key() -> dict:
+        return {
+            "kid": uuid.uuid4().hex,
+            "created": time.time(),
+            "private_key": rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        }
+
+    @staticmethod
+    def _serialize(entry: dict) -> dict:
+        pem = entry["private_key"].private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+        return {"kid": entry["kid"], "created": entry["created"], "private_pem": pem.decode("ascii")}
+
+    @staticmethod
+    def _deserialize(raw: dict) -> dict:
+        return {
+            "kid": raw["kid"],
+            "created": raw["created"],
+            "private_key": serialization.load_pem_private_key(raw["private_pem"].encode("ascii"), password=None),
+        }
+
+    # ---------- API ----------
+
+    def rotate(self):
+        """
+        Ajoute une nouvelle clé de signature et oublie les plus anciennes.
+        """
+        with self._lock, self._file_lock():
+            self._reload()
+            self._rotate_locked()
+
+    def _rotate_locked(self):
+        """Appelé sous les deux verrous, juste après relecture du fichier."""
+        self._keys.append(self._new_key())
+        self._keys = self._keys[-self.max_keys:]
+        self._save()
+
+    def _expired(self) -> bool:
+        return time.time() - self._keys[-1]["created"] > self.rotation_seconds
+
+    def current(self) -> tuple:
+        """
+        Retourne (kid, clé privée) de la clé de signature courante,
+        en effectuant la rotation si elle est trop ancienne.
+        """
+        with self._lock:
+            self._refresh_if_changed()
+            if self._expired():
+                with self._file_lock():
+                    # Un autre worker a peut-être déjà fait la rotation
+                    self._reload()
+                    if self._expired():
+                        self._rotate_locked()
+            newest = self._keys[-1]
+        return newest["kid"], newest["private_key"]
+
+    def public_key(self, kid: str):
+        """
+        Retourne la clé publique associée à `kid`, ou None si elle est inconnue.
+        """
+        with self._lock:
+            for entry in self._keys:
+                if entry["kid"] == kid:
+                    return entry["private_key"].public_key()
+            # Clé inconnue : un autre worker a peut-être effectué une rotation
+            self._refresh_if_changed()
+            for entry in self._keys:
+                if entry["kid"] == kid:
+                    return entry["private_key"].public_key()
+        return None
+
+    def jwks(self) -> dict:
+        """
+        Jeu de clés publiques au format JWKS.
+        """
+        with self._lock:
+            self._refresh_if_changed()
+            entries = list(self._keys)
+        keys = []
+        for entry in entries:
+            jwk = RSAAlgorithm.to_jwk(entry["private_key"].public_key(), as_dict=True)
+            jwk.update({"kid": entry["kid"], "alg": "RS256", "use": "sig"})
+            keys.append(jwk)
+        return {"keys": keys}
@@ -0,0 +1,215 @@
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+-- Refresh tokens émis : un token n'est échangé qu'une fois (rotation)
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    jti TEXT PRIMARY KEY,
+    family TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL,
+    replaced_by TEXT,
+    replaced_expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires_at ON refresh_tokens(expires_at);
+-- Révocations (jti d'un token ou identifiant de famille), lues par tous les processus via seq
+CREATE TABLE IF NOT EXISTS revocations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revocations_expires_at ON revocations(expires_at);
+"""
+
+
+class RefreshReused(Exception):
+    """Un refresh token déjà échangé est présenté à nouveau : sa famille est révoquée."""
+
+
+class TokenStateStore:
+    """
+    État des tokens : rotation des refresh tokens et liste de révocation.
+
+    - Chaque refresh token a un `jti` et appartient à une famille (`fam`,
+      partagée avec les access tokens émis à partir d'elle). Un refresh token
+      ne s'échange qu'une fois ; le présenter à nouveau (vol probable) révoque
+      toute la famille.
+    - Les révocations sont gardées en mémoire dans un dict id -> expiration :
+      `is_revoked` est un simple accès dict, sans requête SQL.
+    - Une roue d'expiration (buckets de `bucket_seconds`) retire les entrées
+      dont le token aurait de toute façon expiré : la mémoire reste bornée.
+    - SQLite (WAL) est la source de vérité partagée entre processus : chaque
+      processus relit les nouvelles révocations au plus toutes les `sync_interval` s.
+    """
+
+    def __init__(self, path: str, sync_interval: float = 1.0, bucket_seconds: int = 30,
+                 reuse_grace_seconds: float = 10.0, purge_interval: float = 300.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.bucket_seconds = bucket_seconds
+        self.reuse_grace_seconds = reuse_grace_seconds
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._revoked = {}         # token_id -> expires_at (epoch)
+        self._wheel = {}           # index de bucket -> [token_id]
+        self._expired_bucket = int(time.time() // bucket_seconds)
+        self._last_seq = 0
+        self._last_sync = 0.0
+        self._last_purge = time.monotonic()
+        self._connect().executescript(SCHEMA)
+        self._sync()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- Révocations en mémoire ----------
+
+    def _remember(self, token_id: str, expires_at: float):
+        """Ajoute une révocation au dict et à la roue (appelé sous self._lock)."""
+        if expires_at <= self._revoked.get(token_id, 0):
+            return
+        self._revoked[token_id] = expires_at
+        self._wheel.setdefault(int(expires_at // self.bucket_seconds), []).append(token_id)
+
+    def _expire(self, now: float):
+        """Vide les buckets échus de la roue (appelé sous self._lock)."""
+        current = int(now // self.bucket_seconds)
+        if current <= self._expired_bucket:
+            return
+        for bucket in [b for b in self._wheel if b < current]:
+            for token_id in self._wheel.pop(bucket):
+                # Une entrée révoquée à nouveau plus tard a une expiration plus lointaine
+                if self._revoked.get(token_id, now) < now:
+                    del self._revoked[token_id]
+        self._expired_bucket = current
+
+    def _sync(self):
+        """Charge les révocations écrites par les autres processus depuis la dernière lecture."""
+        rows = self._connect().execute(
+            "SELECT seq, token_id, expires_at FROM revocations WHERE seq > ? AND expires_at > ? ORDER BY seq",
+            (self._last_seq, time.time()),
+        ).fetchall()
+        with self._lock:
+            for row in rows:
+                self._remember(row["token_id"], row["expires_at"])
+                self._last_seq = max(self._last_seq, row["seq"])
+            self._last_sync = time.monotonic()
+
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            self._purge()
+
+    def _purge(self):
+        """Supprime en base les lignes dont le token a expiré."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("DELETE FROM revocations WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM refresh_tokens WHERE expires_at <= ?", (now,))
+
+    def is_revoked(self, *token_ids) -> bool:
+        """
+        Vrai si l'un des identifiants (jti, famille) est révoqué. Les None sont ignorés.
+        """
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self._sync()
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            return any(
+                token_id is not None and self._revoked.get(token_id, 0) > now
+                for token_id in token_ids
+            )
+
+    def revocations_since(self, seq: int, limit: int = 1000) -> list:
+        """
+        Révocations encore en cours écrites après `seq`, dans l'ordre :
+        [{"seq", "id", "exp"}] (au plus `limit`).
+        """
+        rows = self._connect().execute(
+            "SELECT seq, token_id, expires_at FROM revocations WHERE seq > ? AND expires_at > ? ORDER BY seq LIMIT ?",
+            (seq, time.time(), limit),
+        ).fetchall()
+        return [{"seq": row["seq"], "id": row["token_id"], "exp": row["expires_at"]} for row in rows]
+
+    def revoke(self, token_id: str, expires_at: float):
+        """
+        Révoque un jti ou une famille jusqu'à `expires_at` (epoch), date après
+        laquelle les tokens concernés sont de toute façon expirés.
+        """
+        cur = self._connect().execute(
+            "INSERT INTO revocations (token_id, expires_at) VALUES (?, ?)", (token_id, expires_at)
+        )
+        with self._lock:
+            self._remember(token_id, expires_at)
+            self._last_seq = max(self._last_seq, cur.lastrowid)
+
+    # ---------- Refresh tokens ----------
+
+    def register(self, jti: str, family: str, user_id: str, expires_at: float):
+        """Enregistre un refresh token émis au login."""
+        self._connect().execute(
+            "INSERT INTO refresh_tokens (jti, family, user_id, expires_at) VALUES (?, ?, ?, ?)",
+            (jti, family, user_id, expires_at),
+        )
+
+    def rotate(self, jti: str, new_jti: str, new_expires_at: float, family_ttl: float) -> tuple:
+        """
+        Échange le refresh token `jti` contre `new_jti` (même famille).
+
+        Retourne (jti, expiration) du successeur : `new_jti` en temps normal,
+        ou le successeur déjà émis si le même token est présenté deux fois en
+        moins de `reuse_grace_seconds` (requêtes concurrentes d'un même client).
+        Lève RefreshReused (et révoque la famille) pour une réutilisation plus tardive,
+        KeyError si le jti est inconnu.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT family, user_id, used_at, replaced_by, replaced_expires_at FROM refresh_tokens WHERE jti = ?",
+                (jti,),
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                raise KeyError(jti)
+
+            if row["used_at"] is not None:
+                if now - row["used_at"] <= self.reuse_grace_seconds and row["replaced_by"]:
+                    conn.execute("ROLLBACK")
+                    return row["replaced_by"], row["replaced_expires_at"]
+                cur = conn.execute(
+                    "INSERT INTO revocations (token_id, expires_at) VALUES (?, ?)", (row["family"], now + family_ttl)
+                )
+                conn.execute("COMMIT")
+                with self._lock:
+                    self._remember(row["family"], now + family_ttl)
+                    self._last_seq = max(self._last_seq, cur.lastrowid)
+                raise RefreshReused(row["family"])
+
+            conn.execute(
+                "UPDATE refresh_tokens SET used_at = ?, replaced_by = ?, replaced_expires_at = ? WHERE jti = ?",
+                (now, new_jti, new_expires_at, jti),
+            )
+            conn.execute(
+                "INSERT INTO refresh_tokens (jti, family, user_id, expires_at) VALUES (?, ?, ?, ?)",
+                (new_jti, row["family"], row["user_id"], new_expires_at),
+            )
+            conn.execute("COMMIT")
+        except (KeyError, RefreshReused):
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return new_jti, new_expires_at
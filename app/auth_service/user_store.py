@@ -0,0 +1,88 @@
+import argparse
+import getpass
+import os
+import sqlite3
+import threading
+
+from werkzeug.security import generate_password_hash
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL
+);
+-- Login insensible à la casse (« Baptiste » / « baptiste ») sans parcourir la table
+CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE);
+"""
+
+
+class UserStore:
+    """
+    Utilisateurs de la table `users` (SQLite, mode WAL), une connexion par thread.
+    Les mots de passe sont des hash werkzeug (scrypt), jamais en clair.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get_by_username(self, username: str) -> dict:
+        row = self._connect().execute(
+            "SELECT id, username, password_hash FROM users WHERE username = ? COLLATE NOCASE LIMIT 1",
+            (username,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def set_password(self, username: str, password_hash: str) -> int:
+        """
+        Crée l'utilisateur ou remplace son mot de passe. Retourne son id.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM users WHERE username = ? COLLATE NOCASE LIMIT 1", (username,)
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, row["id"]))
+                user_id = row["id"]
+            else:
+                user_id = conn.execute(
+                    "INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash)
+                ).lastrowid
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return user_id
+
+
+if __name__ == "__main__":
+    # Création d'un compte ou changement de mot de passe :
+    #   python app/auth_service/user_store.py baptiste
+    default_db = os.environ.get(
+        "AUTH_DB_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "database.db"),
+    )
+    parser = argparse.ArgumentParser(description="Crée un utilisateur ou change son mot de passe.")
+    parser.add_argument("username")
+    parser.add_argument("--db", default=default_db, help="Base SQLite (défaut : app/data/database.db).")
+    args = parser.parse_args()
+
+    password = getpass.getpass("Mot de passe : ")
+    if not password or password != getpass.getpass("Confirmation : "):
+        raise SystemExit("Mots de passe vides ou différents.")
+    user_id = UserStore(args.db).set_password(args.username, generate_password_hash(password))
+    print(f"Utilisateur {args.username} enregistré (id {user_id}).")
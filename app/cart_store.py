@@ -0,0 +1,266 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class CartStore(ABC):
+    """
+    Stockage des paniers côté serveur : {article_id: qty} par identifiant de panier.
+    Le cookie de session ne contient plus que cet identifiant.
+
+    Un panier expire `ttl_seconds` après son dernier accès, lecture comprise :
+    `get` et `count` prolongent sa durée de vie comme `add` et `remove`.
+    """
+
+    @abstractmethod
+    def add(self, cart_id: str, article_id: int, qty: int = 1):
+        ...
+
+    @abstractmethod
+    def remove(self, cart_id: str, article_id: int, qty: int = 1):
+        ...
+
+    @abstractmethod
+    def clear(self, cart_id: str):
+        ...
+
+    @abstractmethod
+    def get(self, cart_id: str) -> dict:
+        ...
+
+    @abstractmethod
+    def count(self, cart_id: str) -> int:
+        ...
+
+
+class MemoryCartStore(CartStore):
+    """
+    Paniers en mémoire du processus (un seul worker front).
+
+    Les paniers sont rangés par date de dernier accès : l'éviction des paniers
+    abandonnés ne regarde que le début de la file (coût amorti O(1)).
+    """
+
+    def __init__(self, ttl_seconds: float = 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self._carts = OrderedDict()   # cart_id -> [ {article_id: qty}, nombre d'articles, dernier accès ]
+        self._lock = threading.Lock()
+
+    def _touch(self, cart_id: str, create: bool = False):
+        now = time.monotonic()
+        while self._carts:
+            oldest_id, oldest = next(iter(self._carts.items()))
+            if now - oldest[2] < self.ttl_seconds:
+                break
+            del self._carts[oldest_id]
+
+        entry = self._carts.get(cart_id)
+        if entry is None:
+            if not create:
+                return None
+            entry = [{}, 0, now]
+            self._carts[cart_id] = entry
+        else:
+            entry[2] = now
+            self._carts.move_to_end(cart_id)
+        return entry
+
+    def add(self, cart_id, article_id, qty=1):
+        with self._lock:
+            entry = self._touch(cart_id, create=True)
+            entry[0][article_id] = entry[0].get(article_id, 0) + qty
+            entry[1] += qty
+
+    def remove(self, cart_id, article_id, qty=1):
+        with self._lock:
+            entry = self._touch(cart_id)
+            if entry is None or article_id not in entry[0]:
+                return
+            current = entry[0][article_id]
+            removed = min(qty, current)
+            if removed == current:
+                del entry[0][article_id]
+            else:
+                entry[0][article_id] = current - removed
+            entry[1] -= removed
+
+    def clear(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def get(self, cart_id):
+        with self._lock:
+            entry = self._touch(cart_id)
+            return dict(entry[0]) if entry else {}
+
+    def count(self, cart_id):
+        with self._lock:
+            entry = self._touch(cart_id)
+            return entry[1] if entry else 0
+
+
+CART_SCHEMA = """
+CREATE TABLE IF NOT EXISTS carts (
+    cart_id TEXT PRIMARY KEY,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_carts_updated_at ON carts(updated_at);
+CREATE TABLE IF NOT EXISTS cart_items (
+    cart_id TEXT NOT NULL,
+    article_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL,
+    PRIMARY KEY (cart_id, article_id)
+) WITHOUT ROWID;
+"""
+
+
+class SQLiteCartStore(CartStore):
+    """
+    Paniers dans SQLite (WAL), partagés entre plusieurs processus front.
+
+    Le nombre d'articles est maintenu dans `carts.item_count` : l'affichage
+    du compteur est une simple lecture par clé. Une lecture ne réécrit
+    `updated_at` que s'il date de plus de `touch_interval` secondes (au plus
+    une écriture par panier et par intervalle). Les paniers non consultés
+    depuis `ttl_seconds` sont purgés au plus une fois par `sweep_interval`.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 24 * 3600, sweep_interval: float = 60,
+                 touch_interval: float = 60):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._connect().executescript(CART_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            if now - self._last_sweep > self.sweep_interval:
+                self._last_sweep = now
+                expired = now - self.ttl_seconds
+                conn.execute(
+                    "DELETE FROM cart_items WHERE cart_id IN (SELECT cart_id FROM carts WHERE updated_at < ?)",
+                    (expired,),
+                )
+                conn.execute("DELETE FROM carts WHERE updated_at < ?", (expired,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _drop_if_expired(self, conn: sqlite3.Connection, cart_id: str):
+        """
+        Un panier expiré mais pas encore purgé repart de zéro : ses anciennes
+        lignes ne doivent pas réapparaître quand updated_at est rafraîchi.
+        """
+        expired = time.time() - self.ttl_seconds
+        if conn.execute("SELECT 1 FROM carts WHERE cart_id = ? AND updated_at < ?", (cart_id, expired)).fetchone():
+            conn.execute("DELETE FROM cart_items WHERE cart_id = ?", (cart_id,))
+            conn.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+
+    def add(self, cart_id, article_id, qty=1):
+        with self._transaction() as conn:
+            self._drop_if_expired(conn, cart_id)
+            conn.execute(
+                "INSERT INTO cart_items (cart_id, article_id, qty) VALUES (?, ?, ?) "
+                "ON CONFLICT(cart_id, article_id) DO UPDATE SET qty = qty + excluded.qty",
+                (cart_id, article_id, qty),
+            )
+            conn.execute(
+                "INSERT INTO carts (cart_id, item_count, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(cart_id) DO UPDATE SET item_count = item_count + excluded.item_count, "
+                "updated_at = excluded.updated_at",
+                (cart_id, qty, time.time()),
+            )
+
+    def remove(self, cart_id, article_id, qty=1):
+        with self._transaction() as conn:
+            self._drop_if_expired(conn, cart_id)
+            row = conn.execute(
+                "SELECT qty FROM cart_items WHERE cart_id = ? AND article_id = ?", (cart_id, article_id)
+            ).fetchone()
+            if row is None:
+                return
+            if qty >= row[0]:
+                removed = row[0]
+                conn.execute("DELETE FROM cart_items WHERE cart_id = ? AND article_id = ?", (cart_id, article_id))
+            else:
+                removed = qty
+                conn.execute(
+                    "UPDATE cart_items SET qty = qty - ? WHERE cart_id = ? AND article_id = ?",
+                    (removed, cart_id, article_id),
+                )
+            conn.execute(
+                "UPDATE carts SET item_count = item_count - ?, updated_at = ? WHERE cart_id = ?",
+                (removed, time.time(), cart_id),
+            )
+
+    def clear(self, cart_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cart_items WHERE cart_id = ?", (cart_id,))
+            conn.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+
+    def _touch(self, conn: sqlite3.Connection, cart_id: str, updated_at: float, now: float):
+        """
+        Prolonge un panier lu, sauf s'il a été modifié entre-temps (ou s'il
+        l'a été il y a moins de `touch_interval` secondes).
+        """
+        if now - updated_at >= self.touch_interval:
+            conn.execute(
+                "UPDATE carts SET updated_at = ? WHERE cart_id = ? AND updated_at = ?", (now, cart_id, updated_at)
+            )
+
+    def get(self, cart_id):
+        conn = self._connect()
+        now = time.time()
+        cart = conn.execute(
+            "SELECT updated_at FROM carts WHERE cart_id = ? AND updated_at >= ?", (cart_id, now - self.ttl_seconds)
+        ).fetchone()
+        if cart is None:
+            return {}
+        rows = conn.execute("SELECT article_id, qty FROM cart_items WHERE cart_id = ?", (cart_id,)).fetchall()
+        self._touch(conn, cart_id, cart[0], now)
+        return {article_id: qty for article_id, qty in rows}
+
+    def count(self, cart_id):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT item_count, updated_at FROM carts WHERE cart_id = ? AND updated_at >= ?",
+            (cart_id, now - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            return 0
+        self._touch(conn, cart_id, row[1], now)
+        return row[0]
+
+
+def create_cart_store(backend: str, path: str = None, ttl_seconds: float = 24 * 3600) -> CartStore:
+    """
+    "memory" : un seul processus front ; "sqlite" : plusieurs workers partagent les paniers.
+    """
+    if backend == "sqlite":
+        return SQLiteCartStore(path, ttl_seconds=ttl_seconds)
+    if backend == "memory":
+        return MemoryCartStore(ttl_seconds=ttl_seconds)
+    raise ValueError(f"Backend de panier inconnu : {backend}")
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import sqlite3
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """
+    Minuscules sans accents : « Écran » et « ecran » doivent correspondre.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+class Catalog:
+    """
+    Catalogue en lecture seule, stocké en colonnes.
+
+    - ids / prix dans des `array` compacts, titres dans une liste ;
+      `get(id)` passe par un dict id -> ligne (O(1)).
+    - Index des mots des titres : vocabulaire trié (recherche par préfixe
+      avec bisect) et index de trigrammes (recherche de sous-chaîne).
+    - Lignes triées par prix : un filtre min/max est une tranche obtenue par bisect.
+    """
+
+    def __init__(self, articles):
+        self.ids = array("q")
+        self.prices = array("d")
+        self.titles = []
+        self._row_by_id = {}
+        for a in articles:
+            self._row_by_id[a["id"]] = len(self.ids)
+            self.ids.append(a["id"])
+            self.prices.append(float(a["prix"]))
+            self.titles.append(a["titre"])
+
+        # Version du catalogue : empreinte du contenu, identique dans tous les processus
+        digest = hashlib.sha1()
+        digest.update(self.ids.tobytes())
+        digest.update(self.prices.tobytes())
+        digest.update("\x00".join(self.titles).encode("utf-8"))
+        self.version = digest.hexdigest()[:16]
+
+        # Tri par prix (puis id pour un ordre stable)
+        order = sorted(range(len(self.ids)), key=lambda r: (self.prices[r], self.ids[r]))
+        self._price_order = array("I", order)
+        self._sorted_prices = array("d", (self.prices[r] for r in order))
+
+        # Index des mots : mot -> lignes
+        postings = {}
+        for row, title in enumerate(self.titles):
+            for token in set(tokenize(title)):
+                postings.setdefault(token, array("I")).append(row)
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+
+        # Index de trigrammes sur le vocabulaire : trigramme -> mots qui le contiennent
+        trigrams = {}
+        for token in self._vocabulary:
+            for i in range(len(token) - 2):
+                trigrams.setdefault(token[i:i + 3], set()).add(token)
+        self._trigrams = trigrams
+
+    # ---------- Chargement ----------
+
+    @classmethod
+    def from_json(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["articles"])
+
+    @classmethod
+    def from_sqlite(cls, path: str):
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT id, titre, prix FROM articles ORDER BY id")
+            return cls({"id": r[0], "titre": r[1], "prix": r[2]} for r in rows)
+        finally:
+            conn.close()
+
+    @classmethod
+    def load(cls, path: str):
+        if path.endswith((".db", ".sqlite", ".sqlite3")):
+            return cls.from_sqlite(path)
+        return cls.from_json(path)
+
+    # ---------- Accès ----------
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, article_id):
+        return article_id in self._row_by_id
+
+    def _article(self, row: int) -> dict:
+        return {"id": self.ids[row], "titre": self.titles[row], "prix": self.prices[row]}
+
+    def get(self, article_id) -> dict:
+        row = self._row_by_id.get(article_id)
+        return None if row is None else self._article(row)
+
+    # ---------- Recherche ----------
+
+    def _rows_for_token(self, term: str) -> set:
+        """
+        Lignes dont un mot du titre commence par `term` ou, si `term` fait au
+        moins 3 caractères, le contient.
+        """
+        start = bisect_left(self._vocabulary, term)
+        end = bisect_left(self._vocabulary, term + "\uffff", start)
+        tokens = set(self._vocabulary[start:end])
+
+        if len(term) >= 3:
+            candidates = None
+            for i in range(len(term) - 2):
+                words = self._trigrams.get(term[i:i + 3])
+                if not words:
+                    candidates = set()
+                    break
+                candidates = set(words) if candidates is None else candidates & words
+            tokens.update(t for t in candidates if term in t)
+
+        rows = set()
+        for token in tokens:
+            rows.update(self._postings[token])
+        return rows
+
+    def search(self, q: str = "", min_price: float = None, max_price: float = None,
+               page: int = 1, per_page: int = 20, descending: bool = False) -> tuple:
+        """
+        Articles correspondant à tous les mots de `q` et à la fourchette de prix,
+        triés par prix. Retourne (articles de la page, nombre total de résultats).
+        """
+        lo = 0 if min_price is None else bisect_left(self._sorted_prices, min_price)
+        hi = len(self._sorted_prices) if max_price is None else bisect_right(self._sorted_prices, max_price)
+        if lo >= hi:
+            return [], 0
+
+        matching = None
+        for term in tokenize(q or ""):
+            rows = self._rows_for_token(term)
+            matching = rows if matching is None else matching & rows
+            if not matching:
+                return [], 0
+
+        if matching is None:
+            # Pas de texte : la tranche de prix est déjà triée
+            total = hi - lo
+            offset = (page - 1) * per_page
+            if descending:
+                start, stop = max(hi - offset - per_page, lo), hi - offset
+                rows = reversed(self._price_order[start:stop]) if stop > start else []
+            else:
+                start = lo + offset
+                rows = self._price_order[start:min(start + per_page, hi)]
+            return [self._article(r) for r in rows], total
+
+        # Avec texte : on trie les lignes trouvées plutôt que de parcourir la tranche
+        selected = [
+            r for r in matching
+            if (min_price is None or self.prices[r] >= min_price)
+            and (max_price is None or self.prices[r] <= max_price)
+        ]
+        selected.sort(key=lambda r: (self.prices[r], self.ids[r]), reverse=descending)
+        offset = (page - 1) * per_page
+        return [self._article(r) for r in selected[offset:offset + per_page]], len(selected)
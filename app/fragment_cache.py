@@ -0,0 +1,37 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """
+    Cache LRU borné de fragments HTML déjà rendus.
+
+    Chaque fragment est associé à une version (celle du catalogue) : dès que
+    la version change, tout le cache est vidé et les fragments sont rendus à nouveau.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_render(self, version, key, render):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+
+        # Rendu hors verrou : deux requêtes simultanées peuvent rendre le même fragment, sans gravité
+        html = render()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = html
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return html
@@ -0,0 +1,315 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+-- Stock suivi par article ; disponible = on_hand - reserved
+CREATE TABLE IF NOT EXISTS inventory (
+    article_id INTEGER PRIMARY KEY,
+    on_hand INTEGER NOT NULL,
+    reserved INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,          -- 'held' | 'committed' | 'released'
+    expires_at REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_expiry ON reservations(status, expires_at);
+CREATE TABLE IF NOT EXISTS reservation_items (
+    reservation_id TEXT NOT NULL,
+    article_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL,
+    PRIMARY KEY (reservation_id, article_id)
+);
+"""
+
+
+class OutOfStock(Exception):
+    """Stock insuffisant pour au moins un article ; `shortages` : [{id, requested, available}]."""
+
+    def __init__(self, shortages: list):
+        super().__init__("Stock insuffisant")
+        self.shortages = shortages
+
+
+class UnknownReservation(KeyError):
+    """Aucune réservation avec cet identifiant."""
+
+
+class InventoryStore:
+    """
+    Stock par article et réservations de paniers (SQLite, mode WAL, partagé
+    entre les workers du service).
+
+    - Un article sans ligne dans `inventory` n'est pas suivi : stock illimité.
+    - Une réservation prend tout le panier ou rien. Chaque ligne est un
+      UPDATE conditionnel (disponible >= qty) : pas de survente, même entre processus.
+    - Les écritures passent par un thread unique par processus qui les regroupe :
+      une transaction (un seul fsync) pour toutes les opérations arrivées pendant
+      la précédente, chacune dans son SAVEPOINT. Des milliers de paniers sur le
+      même article ne prennent pas le verrou d'écriture SQLite un par un.
+    - Une réservation non confirmée après `ttl` secondes est libérée par ce même thread.
+    """
+
+    def __init__(self, path: str, batch_max: int = 256, sweep_interval: float = 5.0, timeout: float = 10.0):
+        self.path = path
+        self.batch_max = batch_max
+        self.sweep_interval = sweep_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ops = queue.SimpleQueue()
+        self._start_lock = threading.Lock()
+        self._writer_pid = None
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- API ----------
+
+    def get(self, article_id: int) -> dict:
+        row = self._connect().execute(
+            "SELECT article_id, on_hand, reserved FROM inventory WHERE article_id = ?", (article_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(row, available=row["on_hand"] - row["reserved"])
+
+    def set_stock(self, article_id: int, on_hand: int) -> dict:
+        """Fixe le stock physique d'un article (les réservations en cours sont conservées)."""
+        self._call(self._set_stock, article_id, on_hand)
+        return self.get(article_id)
+
+    def seed(self, stock: dict) -> int:
+        """
+        Stock initial {article_id: on_hand} des articles pas encore suivis
+        (un stock déjà fixé n'est jamais écrasé). Retourne le nombre d'articles ajoutés.
+        """
+        return self._call(self._seed, stock)
+
+    def reserve(self, reservation_id: str, items: dict, ttl: float) -> dict:
+        """
+        Réserve {article_id: qty} pendant `ttl` secondes. Lève OutOfStock.
+        Rejouer le même identifiant renvoie la réservation existante ; une
+        réservation libérée (paiement échoué, expiration) est refaite.
+        """
+        return self._call(self._reserve, reservation_id, items, ttl)
+
+    def commit(self, reservation_id: str) -> dict:
+        """Le paiement est passé : le stock réservé est définitivement retiré. Idempotent."""
+        return self._call(self._commit, reservation_id)
+
+    def commit_many(self, reservation_ids: list) -> list:
+        """Plusieurs confirmations, regroupées dans la même transaction (None pour une réservation inconnue)."""
+        futures = [self._submit(self._commit, rid) for rid in reservation_ids]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=self.timeout))
+            except UnknownReservation:
+                results.append(None)
+        return results
+
+    def release(self, reservation_id: str) -> dict:
+        """Rend le stock d'une réservation non confirmée. Idempotent."""
+        return self._call(self._release, reservation_id)
+
+    # ---------- Thread d'écriture ----------
+
+    def _submit(self, fn, *args) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._ops.put((fn, args, future))
+        return future
+
+    def _call(self, fn, *args):
+        return self._submit(fn, *args).result(timeout=self.timeout)
+
+    def _ensure_started(self):
+        """
+        Démarre le thread d'écriture dans le processus courant (il ne survit pas à un fork).
+        """
+        if self._writer_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._writer_pid == os.getpid():
+                return
+            if self._writer_pid is not None:
+                self._local = threading.local()
+                self._ops = queue.SimpleQueue()
+            threading.Thread(target=self._run, name="inventory-writer", daemon=True).start()
+            self._writer_pid = os.getpid()
+
+    def _run(self):
+        last_sweep = 0.0
+        while True:
+            batch = []
+            try:
+                batch.append(self._ops.get(timeout=self.sweep_interval))
+                while len(batch) < self.batch_max:
+                    batch.append(self._ops.get_nowait())
+            except queue.Empty:
+                pass
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                batch.append((self._sweep, (), None))
+            if batch:
+                self._apply(batch)
+
+    def _apply(self, batch: list):
+        conn = self._connect()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    outcomes.append((future, fn(conn, *args), None))
+                    conn.execute("RELEASE op")
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, None, exc))
+            conn.execute("COMMIT")
+        except Exception as exc:
+            logger.exception("Inventaire : échec de la transaction groupée")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(future, None, exc) for _, _, future in batch]
+
+        for future, result, exc in outcomes:
+            if future is None:
+                continue
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    # ---------- Opérations (dans la transaction du thread d'écriture) ----------
+
+    @staticmethod
+    def _set_stock(conn, article_id, on_hand):
+        conn.execute(
+            "INSERT INTO inventory (article_id, on_hand) VALUES (?, ?) "
+            "ON CONFLICT(article_id) DO UPDATE SET on_hand = excluded.on_hand",
+            (article_id, on_hand),
+        )
+
+    @staticmethod
+    def _seed(conn, stock):
+        return conn.executemany(
+            "INSERT OR IGNORE INTO inventory (article_id, on_hand) VALUES (?, ?)", sorted(stock.items()),
+        ).rowcount
+
+    @staticmethod
+    def _items(conn, reservation_id) -> list:
+        return conn.execute(
+            "SELECT article_id, qty FROM reservation_items WHERE reservation_id = ?", (reservation_id,)
+        ).fetchall()
+
+    def _reserve(self, conn, reservation_id, items, ttl):
+        row = conn.execute("SELECT status, expires_at FROM reservations WHERE id = ?", (reservation_id,)).fetchone()
+        if row is not None and row["status"] != "released":
+            return {"reservation_id": reservation_id, "status": row["status"], "expires_at": row["expires_at"]}
+        conn.execute("DELETE FROM reservation_items WHERE reservation_id = ?", (reservation_id,))
+
+        tracked, shortages = [], []
+        for article_id, qty in sorted(items.items()):
+            cur = conn.execute(
+                "UPDATE inventory SET reserved = reserved + ? WHERE article_id = ? AND on_hand - reserved >= ?",
+                (qty, article_id, qty),
+            )
+            if cur.rowcount:
+                tracked.append((reservation_id, article_id, qty))
+                continue
+            stock = conn.execute(
+                "SELECT on_hand - reserved AS available FROM inventory WHERE article_id = ?", (article_id,)
+            ).fetchone()
+            if stock is not None:
+                shortages.append({"id": article_id, "requested": qty, "available": max(stock["available"], 0)})
+        if shortages:
+            # Le SAVEPOINT de l'opération annule les lignes déjà réservées
+            raise OutOfStock(shortages)
+
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO reservations (id, status, expires_at, created_at) VALUES (?, 'held', ?, ?)",
+            (reservation_id, now + ttl, now),
+        )
+        conn.executemany(
+            "INSERT INTO reservation_items (reservation_id, article_id, qty) VALUES (?, ?, ?)", tracked,
+        )
+        return {"reservation_id": reservation_id, "status": "held", "expires_at": now + ttl}
+
+    def _commit(self, conn, reservation_id):
+        row = conn.execute("SELECT status FROM reservations WHERE id = ?", (reservation_id,)).fetchone()
+        if row is None:
+            raise UnknownReservation(reservation_id)
+        if row["status"] == "committed":
+            return {"reservation_id": reservation_id, "status": "committed", "oversold": []}
+
+        items = self._items(conn, reservation_id)
+        oversold = []
+        if row["status"] == "held":
+            conn.executemany(
+                "UPDATE inventory SET on_hand = on_hand - ?, reserved = reserved - ? WHERE article_id = ?",
+                [(it["qty"], it["qty"], it["article_id"]) for it in items],
+            )
+        else:
+            # Expirée avant la confirmation alors que le client a payé : la vente
+            # est enregistrée quand même, au besoin en survente (à traiter à la main)
+            for it in items:
+                conn.execute(
+                    "UPDATE inventory SET on_hand = on_hand - ? WHERE article_id = ?", (it["qty"], it["article_id"])
+                )
+                stock = conn.execute(
+                    "SELECT on_hand - reserved AS available FROM inventory WHERE article_id = ?", (it["article_id"],)
+                ).fetchone()
+                if stock is not None and stock["available"] < 0:
+                    oversold.append(it["article_id"])
+            if oversold:
+                logger.warning("Réservation %s confirmée après expiration : survente sur %s", reservation_id, oversold)
+        conn.execute("UPDATE reservations SET status = 'committed' WHERE id = ?", (reservation_id,))
+        return {"reservation_id": reservation_id, "status": "committed", "oversold": oversold}
+
+    def _release(self, conn, reservation_id):
+        row = conn.execute("SELECT status FROM reservations WHERE id = ?", (reservation_id,)).fetchone()
+        if row is None:
+            raise UnknownReservation(reservation_id)
+        if row["status"] == "held":
+            conn.executemany(
+                "UPDATE inventory SET reserved = reserved - ? WHERE article_id = ?",
+                [(it["qty"], it["article_id"]) for it in self._items(conn, reservation_id)],
+            )
+            conn.execute("UPDATE reservations SET status = 'released' WHERE id = ?", (reservation_id,))
+        return {"reservation_id": reservation_id, "status": "released" if row["status"] == "held" else row["status"]}
+
+    def _sweep(self, conn):
+        """Libère les réservations expirées et oublie les anciennes réservations terminées."""
+        now = time.time()
+        expired = conn.execute(
+            "SELECT id FROM reservations WHERE status = 'held' AND expires_at < ? LIMIT 500", (now,)
+        ).fetchall()
+        for row in expired:
+            self._release(conn, row["id"])
+        old = now - 7 * 24 * 3600
+        conn.execute(
+            "DELETE FROM reservation_items WHERE reservation_id IN "
+            "(SELECT id FROM reservations WHERE status <> 'held' AND expires_at < ?)",
+            (old,),
+        )
+        conn.execute("DELETE FROM reservations WHERE status <> 'held' AND expires_at < ?", (old,))
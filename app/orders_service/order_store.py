@@ -0,0 +1,498 @@
+import heapq
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    transaction_id TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    total REAL NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+);
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    article_id INTEGER NOT NULL,
+    titre TEXT NOT NULL,
+    prix REAL NOT NULL,
+    qty INTEGER NOT NULL,
+    subtotal REAL NOT NULL,
+    FOREIGN KEY(order_id) REFERENCES orders(id)
+);
+-- Index secondaire user_id -> commandes : l'historique ne parcourt que les commandes de l'utilisateur
+CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id);
+-- Clé d'idempotence : une transaction de paiement ne produit qu'une commande
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_transaction_id ON orders(transaction_id) WHERE transaction_id <> '';
+-- Agrégats par utilisateur, tenus à jour à chaque commande (reconstructibles depuis orders/order_items)
+CREATE TABLE IF NOT EXISTS user_order_stats (
+    user_id INTEGER PRIMARY KEY,
+    order_count INTEGER NOT NULL,
+    total_spent REAL NOT NULL,
+    last_order_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_article_stats (
+    user_id INTEGER NOT NULL,
+    article_id INTEGER NOT NULL,
+    titre TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    PRIMARY KEY (user_id, article_id)
+);
+CREATE INDEX IF NOT EXISTS idx_user_article_stats_qty ON user_article_stats(user_id, qty DESC);
+-- En-têtes Idempotency-Key déjà traités : clé -> commande créée, empreinte de la requête
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    order_id INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at);
+"""
+
+# Durée pendant laquelle une Idempotency-Key est reconnue
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+
+class IdempotencyKeyConflict(Exception):
+    """La clé d'idempotence a déjà servi pour une requête différente."""
+
+# Recalcul complet des agrégats (une instruction par élément)
+REBUILD_AGGREGATES = (
+    "DELETE FROM user_order_stats",
+    "DELETE FROM user_article_stats",
+    "INSERT INTO user_order_stats (user_id, order_count, total_spent, last_order_at) "
+    "SELECT user_id, COUNT(*), SUM(total), MAX(datetime) FROM orders GROUP BY user_id",
+    "INSERT INTO user_article_stats (user_id, article_id, titre, qty) "
+    "SELECT o.user_id, i.article_id, MAX(i.titre), SUM(i.qty) "
+    "FROM order_items i JOIN orders o ON o.id = i.order_id GROUP BY o.user_id, i.article_id",
+)
+
+
+class OrderStore:
+    """
+    Stockage persistant des commandes dans SQLite (mode WAL).
+
+    - Une connexion par thread (les serveurs WSGI multi-threads ne partagent pas de curseur).
+    - L'id de commande est alloué par SQLite (AUTOINCREMENT) dans la même
+      transaction que l'insertion : pas de course entre requêtes concurrentes.
+    - synchronous=FULL : une commande acquittée (201) survit à un redémarrage.
+    """
+
+    def __init__(self, path: str, id_stride: int = 1, id_offset: int = 0):
+        self.path = path
+        # Avec plusieurs shards, chaque shard n'attribue que les ids tels que
+        # (id - 1) % id_stride == id_offset : les ids restent uniques globalement
+        self.id_stride = id_stride
+        self.id_offset = id_offset
+        self._local = threading.local()
+        self._last_key_purge = 0.0
+        self._connect().executescript(SCHEMA)
+        self._rebuild_aggregates(only_if_missing=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, user_id: int, items: list, total: float, transaction_id, dt_iso,
+               idempotency_key: str = None, fingerprint: str = "") -> tuple:
+        """
+        Enregistre une commande et ses lignes dans une seule transaction.
+        Retourne (commande, créée) : si une commande existe déjà pour ce
+        transaction_id, ou pour cette `idempotency_key` (reconnue pendant
+        IDEMPOTENCY_KEY_TTL), elle est renvoyée telle quelle avec créée=False.
+        Lève IdempotencyKeyConflict si la clé a servi avec une autre `fingerprint`.
+        """
+        order = {
+            "user_id": user_id,
+            "transaction_id": transaction_id,
+            "datetime": dt_iso,
+            "total": total,
+            "items": items,
+        }
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known = None
+            if idempotency_key:
+                known = conn.execute(
+                    "SELECT order_id, fingerprint FROM idempotency_keys WHERE key = ? AND created_at > ?",
+                    (idempotency_key, time.time() - IDEMPOTENCY_KEY_TTL),
+                ).fetchone()
+            if known is None:
+                order_id, created = self._insert_many(conn, [order])[0]
+                if idempotency_key:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys (key, order_id, fingerprint, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (idempotency_key, order_id, fingerprint, time.time()),
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if known is not None:
+            if known["fingerprint"] != fingerprint:
+                raise IdempotencyKeyConflict(idempotency_key)
+            return self.get(known["order_id"]), False
+        if idempotency_key:
+            self._purge_idempotency_keys()
+        if not created:
+            return self.get(order_id), False
+        return dict(order, id=order_id), True
+
+    def _purge_idempotency_keys(self):
+        """Supprime les clés expirées, au plus une fois par heure et par processus."""
+        if time.monotonic() - self._last_key_purge < 3600:
+            return
+        self._last_key_purge = time.monotonic()
+        self._connect().execute(
+            "DELETE FROM idempotency_keys WHERE created_at <= ?", (time.time() - IDEMPOTENCY_KEY_TTL,)
+        )
+
+    def create_many(self, orders: list) -> list:
+        """
+        Enregistre un lot de commandes (déjà validées) dans une seule transaction.
+
+        Les ids sont réservés en une fois à partir de la séquence AUTOINCREMENT,
+        puis lignes et commandes sont insérées par executemany.
+        Retourne [(order_id, créée), ...] dans l'ordre du lot ; une commande dont
+        le transaction_id existe déjà (en base ou plus tôt dans le lot) n'est
+        pas réinsérée.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            results = self._insert_many(conn, orders)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    def _insert_many(self, conn: sqlite3.Connection, orders: list) -> list:
+        """
+        Corps de create_many, dans la transaction ouverte par l'appelant.
+        """
+        tx_ids = [o["transaction_id"] for o in orders if o.get("transaction_id")]
+        known = {}
+        for start in range(0, len(tx_ids), 500):
+            chunk = tx_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in conn.execute(
+                f"SELECT id, transaction_id FROM orders WHERE transaction_id IN ({placeholders})", chunk
+            ):
+                known[row["transaction_id"]] = row["id"]
+
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'orders'").fetchone()
+        next_id = (row["seq"] if row else 0) + 1
+        next_id += (self.id_offset - (next_id - 1)) % self.id_stride
+
+        results = []
+        order_rows = []
+        item_rows = []
+        for o in orders:
+            tx = o.get("transaction_id")
+            if tx and tx in known:
+                results.append((known[tx], False))
+                continue
+            order_id = next_id
+            next_id += self.id_stride
+            if tx:
+                known[tx] = order_id
+            results.append((order_id, True))
+            order_rows.append((order_id, o["user_id"], tx or "", o.get("datetime") or "", o["total"]))
+            item_rows.extend(
+                (order_id, it.get("id"), it.get("titre") or "", it.get("prix") or 0,
+                 it.get("qty") or 1, it.get("subtotal") or 0)
+                for it in o["items"]
+            )
+
+        conn.executemany(
+            "INSERT INTO orders (id, user_id, transaction_id, datetime, total) VALUES (?, ?, ?, ?, ?)",
+            order_rows,
+        )
+        conn.executemany(
+            "INSERT INTO order_items (order_id, article_id, titre, prix, qty, subtotal) VALUES (?, ?, ?, ?, ?, ?)",
+            item_rows,
+        )
+        self._update_aggregates(conn, order_rows, item_rows)
+        return results
+
+    # ---------- Agrégats par utilisateur ----------
+
+    @staticmethod
+    def _update_aggregates(conn: sqlite3.Connection, order_rows: list, item_rows: list):
+        """
+        Ajoute les commandes insérées aux agrégats (dans la transaction d'insertion).
+        Le lot est d'abord cumulé par utilisateur : une ligne écrite par
+        utilisateur et par article, pas par commande.
+        """
+        users = {}
+        user_of_order = {}
+        for order_id, user_id, _tx, dt_iso, total in order_rows:
+            user_of_order[order_id] = user_id
+            count, spent, last = users.get(user_id, (0, 0.0, ""))
+            users[user_id] = (count + 1, spent + total, max(last, dt_iso))
+        articles = {}
+        for order_id, article_id, titre, _prix, qty, _subtotal in item_rows:
+            key = (user_of_order[order_id], article_id)
+            articles[key] = (titre, articles.get(key, ("", 0))[1] + qty)
+
+        conn.executemany(
+            "INSERT INTO user_order_stats (user_id, order_count, total_spent, last_order_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "order_count = order_count + excluded.order_count, "
+            "total_spent = total_spent + excluded.total_spent, "
+            "last_order_at = max(last_order_at, excluded.last_order_at)",
+            [(user_id, *values) for user_id, values in users.items()],
+        )
+        conn.executemany(
+            "INSERT INTO user_article_stats (user_id, article_id, titre, qty) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, article_id) DO UPDATE SET qty = qty + excluded.qty, titre = excluded.titre",
+            [(user_id, article_id, titre, qty) for (user_id, article_id), (titre, qty) in articles.items()],
+        )
+
+    def _rebuild_aggregates(self, only_if_missing: bool = False):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Base existante ouverte pour la première fois : vérifié sous verrou
+            # d'écriture, un seul worker fait le calcul
+            missing = (
+                conn.execute("SELECT 1 FROM user_order_stats LIMIT 1").fetchone() is None
+                and conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone() is not None
+            )
+            if missing or not only_if_missing:
+                for statement in REBUILD_AGGREGATES:
+                    conn.execute(statement)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rebuild_aggregates(self):
+        """
+        Recalcule tous les agrégats depuis orders / order_items, dans une transaction.
+        """
+        self._rebuild_aggregates()
+
+    def summary(self, user_id: int, top: int = 5) -> dict:
+        """
+        Résumé d'un utilisateur lu dans les agrégats : une ligne par clé primaire,
+        plus les `top` articles les plus commandés via l'index (user_id, qty).
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT order_count, total_spent, last_order_at FROM user_order_stats WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        top_articles = [
+            {"id": r["article_id"], "titre": r["titre"], "qty": r["qty"]}
+            for r in conn.execute(
+                "SELECT article_id, titre, qty FROM user_article_stats WHERE user_id = ? "
+                "ORDER BY qty DESC, article_id LIMIT ?",
+                (user_id, top),
+            )
+        ]
+        return {
+            "user_id": user_id,
+            "order_count": row["order_count"] if row else 0,
+            "total_spent": round(row["total_spent"], 2) if row else 0.0,
+            "last_order_at": row["last_order_at"] if row else None,
+            "top_articles": top_articles,
+        }
+
+    def get(self, order_id: int) -> dict:
+        """
+        Une commande complète (avec ses lignes), ou None.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT id, user_id, transaction_id, datetime, total FROM orders WHERE id = ?", (order_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        order = dict(row)
+        order["items"] = [
+            {"id": it["article_id"], "titre": it["titre"], "prix": it["prix"], "qty": it["qty"], "subtotal": it["subtotal"]}
+            for it in conn.execute(
+                "SELECT article_id, titre, prix, qty, subtotal FROM order_items WHERE order_id = ? ORDER BY id",
+                (order_id,),
+            )
+        ]
+        return order
+
+    def list_for_user(self, user_id: int, limit: int = None, after_id: int = None,
+                      descending: bool = False, with_items: bool = True) -> list:
+        """
+        Commandes d'un utilisateur, via l'index (user_id, id).
+
+        Pagination par clé (keyset) : `after_id` est l'id de la dernière commande
+        de la page précédente ; seules les commandes situées après lui dans
+        l'ordre demandé sont renvoyées. Sans `with_items`, les lignes de
+        commande ne sont pas lues du tout.
+        """
+        conn = self._connect()
+        sql = "SELECT id, transaction_id, datetime, total FROM orders WHERE user_id = ?"
+        params = [user_id]
+        if after_id is not None:
+            sql += " AND id < ?" if descending else " AND id > ?"
+            params.append(after_id)
+        sql += " ORDER BY id DESC" if descending else " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = conn.execute(sql, params).fetchall()
+        if not rows:
+            return []
+
+        orders = {
+            r["id"]: {
+                "id": r["id"],
+                "transaction_id": r["transaction_id"],
+                "datetime": r["datetime"],
+                "total": r["total"],
+            }
+            for r in rows
+        }
+        if with_items:
+            self._attach_items(conn, orders)
+        return list(orders.values())
+
+    @staticmethod
+    def _attach_items(conn: sqlite3.Connection, orders: dict):
+        """
+        Ajoute leurs lignes à des commandes {id: commande}, en une requête.
+        """
+        for order in orders.values():
+            order["items"] = []
+        placeholders = ",".join("?" * len(orders))
+        item_rows = conn.execute(
+            "SELECT order_id, article_id, titre, prix, qty, subtotal FROM order_items "
+            f"WHERE order_id IN ({placeholders}) ORDER BY id",
+            list(orders),
+        ).fetchall()
+        for it in item_rows:
+            orders[it["order_id"]]["items"].append({
+                "id": it["article_id"],
+                "titre": it["titre"],
+                "prix": it["prix"],
+                "qty": it["qty"],
+                "subtotal": it["subtotal"],
+            })
+
+    def iter_orders(self, user_id: int = None, since: str = None, batch_size: int = 500):
+        """
+        Générateur de commandes complètes par id croissant, d'un utilisateur
+        ou de tous (`user_id` None), éventuellement à partir de la date `since`
+        (chaîne ISO comparée à la colonne datetime).
+
+        Lecture par lots de `batch_size` (keyset sur l'id) : la mémoire reste
+        constante quelle que soit la taille de l'historique. Chaque lot est
+        lu entièrement avant d'être rendu, aucun curseur ne reste ouvert entre deux yield.
+        """
+        conn = self._connect()
+        sql = "SELECT id, user_id, transaction_id, datetime, total FROM orders WHERE id > ?"
+        filters = []
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            filters.append(user_id)
+        if since:
+            sql += " AND datetime >= ?"
+            filters.append(since)
+        sql += " ORDER BY id LIMIT ?"
+
+        last_id = 0
+        while True:
+            rows = conn.execute(sql, [last_id, *filters, batch_size]).fetchall()
+            if not rows:
+                return
+            orders = {r["id"]: dict(r) for r in rows}
+            self._attach_items(conn, orders)
+            yield from orders.values()
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]["id"]
+
+
+class ShardedOrderStore:
+    """
+    Commandes réparties par user_id sur N fichiers SQLite (un OrderStore par shard).
+
+    - Toutes les commandes d'un utilisateur sont dans le shard user_id % N :
+      création, historique et pagination ne touchent qu'un seul fichier.
+    - Le shard i n'attribue que les ids tels que (id - 1) % N == i : un id
+      de commande désigne donc aussi son shard.
+    - Les écritures sur des shards différents ne se bloquent pas entre elles.
+    - user_id doit être un entier (validé par le service avant l'appel).
+    - La déduplication par transaction_id et par Idempotency-Key n'est
+      garantie qu'à l'intérieur d'un shard : la même transaction envoyée
+      avec deux user_id différents donnerait deux commandes.
+    Ne pas changer N sur des données existantes sans les redistribuer.
+    """
+
+    def __init__(self, directory: str, shard_count: int):
+        os.makedirs(directory, exist_ok=True)
+        self.shards = [
+            OrderStore(os.path.join(directory, f"orders-{i}.db"), id_stride=shard_count, id_offset=i)
+            for i in range(shard_count)
+        ]
+
+    def shard_for_user(self, user_id) -> OrderStore:
+        return self.shards[int(user_id) % len(self.shards)]
+
+    def shard_for_order(self, order_id: int) -> OrderStore:
+        return self.shards[(order_id - 1) % len(self.shards)]
+
+    def create(self, user_id, items, total, transaction_id, dt_iso, **kwargs) -> tuple:
+        return self.shard_for_user(user_id).create(user_id, items, total, transaction_id, dt_iso, **kwargs)
+
+    def create_many(self, orders: list) -> list:
+        """
+        Un lot par shard, chacun dans sa propre transaction ; résultats dans l'ordre d'origine.
+        """
+        by_shard = {}
+        for index, order in enumerate(orders):
+            by_shard.setdefault(int(order["user_id"]) % len(self.shards), []).append(index)
+
+        results = [None] * len(orders)
+        for shard_index, indexes in by_shard.items():
+            shard_results = self.shards[shard_index].create_many([orders[i] for i in indexes])
+            for i, result in zip(indexes, shard_results):
+                results[i] = result
+        return results
+
+    def get(self, order_id: int) -> dict:
+        return self.shard_for_order(order_id).get(order_id)
+
+    def list_for_user(self, user_id, **kwargs) -> list:
+        return self.shard_for_user(user_id).list_for_user(user_id, **kwargs)
+
+    def summary(self, user_id, top: int = 5) -> dict:
+        return self.shard_for_user(user_id).summary(user_id, top)
+
+    def rebuild_aggregates(self):
+        for shard in self.shards:
+            shard.rebuild_aggregates()
+
+    def iter_orders(self, user_id: int = None, since: str = None, batch_size: int = 500):
+        """
+        Un utilisateur : son seul shard. Tous : fusion des shards par id croissant
+        (un lot en mémoire par shard).
+        """
+        if user_id is not None:
+            return self.shard_for_user(user_id).iter_orders(user_id, since, batch_size)
+        return heapq.merge(
+            *(shard.iter_orders(None, since, batch_size) for shard in self.shards), key=lambda o: o["id"],
+        )
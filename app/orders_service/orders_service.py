@@ -1,11 +1,66 @@
 
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import csv
+import datetime
+import hashlib
+import hmac
+import io
+import json
+import math
+import os
+import sys
+
+from inventory import InventoryStore, OutOfStock, UnknownReservation
+from order_store import IdempotencyKeyConflict, OrderStore, ShardedOrderStore
+
+# Le package `common` est à la racine du dépôt : on le rend importable quand le service est lancé comme script
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.logs import configure_logging
+from common.metrics import instrument_app
+from common.tracing import instrument_tracing, span
+
+configure_logging("orders_service")
 
 app = Flask(__name__)
+instrument_app(app, "orders_service")
+instrument_tracing(app, "orders_service")
+
+# Stockage persistant : SQLite (WAL) dans app/data/database.db,
+# ou ORDERS_SHARDS fichiers (un par shard, répartition par user_id)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+DB_PATH = os.environ.get("ORDERS_DB_PATH", os.path.join(DATA_DIR, "database.db"))
+ORDERS_SHARDS = int(os.environ.get("ORDERS_SHARDS", 1))
+SHARD_DIR = os.environ.get("ORDERS_SHARD_DIR", os.path.join(DATA_DIR, "orders_shards"))
+if ORDERS_SHARDS > 1:
+    STORE = ShardedOrderStore(SHARD_DIR, ORDERS_SHARDS)
+else:
+    STORE = OrderStore(DB_PATH)
+
+# Stock et réservations de paniers : un seul fichier, quel que soit le nombre de shards
+INVENTORY = InventoryStore(os.environ.get("INVENTORY_DB_PATH", os.path.join(DATA_DIR, "inventory.db")))
+RESERVATION_TTL = float(os.environ.get("INVENTORY_RESERVATION_TTL", 120))
+MAX_RESERVATION_TTL = 900
+
+# Stock initial : champ `stock` des articles du catalogue, chargé pour les articles
+# pas encore suivis (vide : pas de stock initial, articles illimités)
+INVENTORY_SEED_PATH = os.environ.get("INVENTORY_SEED_PATH", os.path.join(DATA_DIR, "articles.json"))
+
+
+def seed_inventory(path: str):
+    if not path or not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        articles = json.load(f).get("articles", [])
+    stock = {a["id"]: a["stock"] for a in articles if _is_int(a.get("id")) and _is_int(a.get("stock"))}
+    if stock:
+        added = INVENTORY.seed(stock)
+        if added:
+            app.logger.info("Stock initial chargé pour %d article(s) depuis %s", added, path)
 
-# Pour le TP : stockage en mémoire (disparaît à chaque redémarrage)
-ORDERS = []
+
+# Export de toutes les commandes : réservé aux appels avec "Authorization: Bearer <ORDERS_ADMIN_TOKEN>"
+ADMIN_TOKEN = os.environ.get("ORDERS_ADMIN_TOKEN", "")
 
 
 @app.route("/orders", methods=["POST"])
@@ -18,32 +73,154 @@ def create_order():
         "items": [ { "id": ..., "titre": ..., "prix": ..., "qty": ..., "subtotal": ... }, ... ],
         "total": 123.45,
         "transaction_id": "tx-...",
-        "datetime": "2025-11-13T10:15:00Z"
+        "datetime": "2025-11-13T10:15:00Z",
+        "reservation_id": "pay-..."          (optionnel)
     }
+    Le transaction_id sert de clé d'idempotence : renvoyer la même commande
+    ne la duplique pas (réponse 200 avec la commande existante).
+    L'en-tête optionnel Idempotency-Key joue le même rôle pendant 24 h ; la
+    réutiliser avec un contenu différent est refusé (422).
     """
     data = request.get_json(silent=True) or {}
 
-    user_id = data.get("user_id")
-    items = data.get("items") or []
-    total = data.get("total")
-    transaction_id = data.get("transaction_id")
-    dt_iso = data.get("datetime")
-
-    if not user_id or not items or total is None:
-        return jsonify({"error": "Champs manquants (user_id, items, total)."}), 400
-
-    order_id = len(ORDERS) + 1
-    order = {
-        "id": order_id,
-        "user_id": user_id,
-        "transaction_id": transaction_id,
-        "datetime": dt_iso,
-        "total": total,
-        "items": items,
-    }
-    ORDERS.append(order)
+    error = validate_order(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    idempotency_key = request.headers.get("Idempotency-Key", "").strip() or None
+    if idempotency_key and len(idempotency_key) > 255:
+        return jsonify({"error": "En-tête Idempotency-Key trop long (255 caractères max)."}), 400
+    fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    try:
+        with span("store create"):
+            order, created = STORE.create(
+                data["user_id"], data["items"], data["total"], data.get("transaction_id"), data.get("datetime"),
+                idempotency_key=idempotency_key, fingerprint=fingerprint,
+            )
+    except IdempotencyKeyConflict:
+        return jsonify({"error": "Idempotency-Key déjà utilisée pour une autre commande."}), 422
+    _commit_reservations([data])
+
+    # Commande déjà enregistrée pour ce transaction_id (renvoi) : on retourne l'existante
+    return jsonify(order), 201 if created else 200
+
+
+@app.route("/orders/batch", methods=["POST"])
+def create_orders_batch():
+    """
+    Crée un lot de commandes en une seule transaction.
+    Corps : tableau JSON de commandes (même structure que POST /orders),
+    ou flux NDJSON (Content-Type: application/x-ndjson, une commande par ligne).
+
+    Retourne un résultat par commande, dans l'ordre du lot :
+    { "results": [ {"status": 201, "id": 12}, {"status": 200, "id": 3}, {"status": 400, "error": "..."} ] }
+    (201 = créée, 200 = déjà enregistrée pour ce transaction_id, 400 = rejetée)
+    """
+    if request.mimetype == "application/x-ndjson":
+        orders = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                orders.append(json.loads(line))
+            except ValueError:
+                orders.append(None)
+    else:
+        orders = request.get_json(silent=True)
+        if not isinstance(orders, list):
+            return jsonify({"error": "Tableau JSON ou flux NDJSON attendu."}), 400
+
+    results = [None] * len(orders)
+    valid = []
+    valid_indexes = []
+    for i, order in enumerate(orders):
+        error = validate_order(order)
+        if error:
+            results[i] = {"status": 400, "error": error}
+        else:
+            valid.append(order)
+            valid_indexes.append(i)
+
+    if valid:
+        for i, (order_id, created) in zip(valid_indexes, STORE.create_many(valid)):
+            results[i] = {"status": 201 if created else 200, "id": order_id}
+        _commit_reservations(valid)
+
+    return jsonify({"results": results}), 200
+
+
+# Bornes d'un INTEGER SQLite (au-delà, sqlite3 lève OverflowError)
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and _INT64_MIN <= value <= _INT64_MAX
+
+
+def _is_number(value) -> bool:
+    return (isinstance(value, int) and not isinstance(value, bool) and _INT64_MIN <= value <= _INT64_MAX) or (
+        isinstance(value, float) and math.isfinite(value)
+    )
+
+
+def _is_optional_str(value) -> bool:
+    return value is None or isinstance(value, str)
 
-    return jsonify(order), 201
+
+def _valid_item(it) -> bool:
+    return (
+        isinstance(it, dict)
+        and _is_int(it.get("id"))
+        and _is_int(it.get("qty"))
+        and _is_number(it.get("prix"))
+        and _is_optional_str(it.get("titre"))
+        and (it.get("subtotal") is None or _is_number(it.get("subtotal")))
+    )
+
+
+def validate_order(data) -> str:
+    """
+    Retourne un message d'erreur si la commande est incomplète ou mal typée, sinon None.
+    user_id : entier ; total : nombre ; transaction_id, datetime : chaîne ou null ;
+    items : [{"id": entier, "qty": entier, "prix": nombre, "titre": chaîne, "subtotal": nombre}].
+    Entiers dans les bornes d'un INTEGER SQLite : une commande mal formée est
+    refusée (400) au lieu de faire échouer l'écriture (500) et tout son lot.
+    """
+    if not isinstance(data, dict):
+        return "Commande invalide (objet JSON attendu)."
+    if not data.get("user_id") or not data.get("items") or data.get("total") is None:
+        return "Champs manquants (user_id, items, total)."
+    if not _is_int(data["user_id"]):
+        return "Champ user_id invalide (entier attendu)."
+    if not _is_number(data["total"]):
+        return "Champ total invalide (nombre attendu)."
+    for field in ("transaction_id", "datetime"):
+        if not _is_optional_str(data.get(field)):
+            return f"Champ {field} invalide (chaîne attendue)."
+    if not isinstance(data["items"], list) or not all(_valid_item(it) for it in data["items"]):
+        return "Champ items invalide (id et qty entiers, prix et subtotal numériques, titre texte)."
+    return None
+
+
+def _commit_reservations(orders):
+    """
+    Confirme la réservation de stock portée par les commandes enregistrées.
+    Le front la confirme déjà après le paiement ; ce second passage (idempotent)
+    couvre le cas où cet appel a échoué, puisque l'outbox renvoie la commande
+    jusqu'à succès. Une erreur ici fait échouer la requête : la commande est
+    déjà enregistrée, le renvoi ne la duplique pas.
+    """
+    reservation_ids = [o["reservation_id"] for o in orders if isinstance(o.get("reservation_id"), str)]
+    if reservation_ids:
+        INVENTORY.commit_many(reservation_ids)
+
+
+# Champs renvoyés par GET /orders/<user_id> ; "summary" = tout sauf les lignes
+ORDER_FIELDS = ("id", "transaction_id", "datetime", "total", "items")
+SUMMARY_FIELDS = ("id", "transaction_id", "datetime", "total")
+MAX_PAGE_SIZE = 100
 
 
 @app.route("/orders/<int:user_id>", methods=["GET"])
@@ -51,19 +228,288 @@ def list_orders_for_user(user_id: int):
     """
     Liste les commandes pour un utilisateur donné.
     Retourne un tableau de commandes avec la même structure que ci-dessus.
+
+    Paramètres optionnels :
+    - limit=N      : taille de page (max 100) ; sans limit, tout l'historique est renvoyé
+    - cursor=ID    : id de la dernière commande reçue (valeur de l'en-tête X-Next-Cursor)
+    - order=desc   : plus récentes d'abord (défaut : asc)
+    - fields=...   : "summary" ou liste séparée par des virgules parmi ORDER_FIELDS
+    """
+    # type= renvoie None si la conversion échoue : on distingue "absent" de "invalide"
+    limit = request.args.get("limit", type=_positive_int)
+    cursor = request.args.get("cursor", type=_positive_int)
+    if ("limit" in request.args and limit is None) or ("cursor" in request.args and cursor is None):
+        return jsonify({"error": "Paramètres limit/cursor invalides."}), 400
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    order = request.args.get("order", "asc")
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "Paramètre order invalide (asc ou desc)."}), 400
+
+    fields_arg = request.args.get("fields")
+    if not fields_arg:
+        fields = ORDER_FIELDS
+    elif fields_arg == "summary":
+        fields = SUMMARY_FIELDS
+    else:
+        fields = tuple(f.strip() for f in fields_arg.split(",") if f.strip())
+        if not fields or any(f not in ORDER_FIELDS for f in fields):
+            return jsonify({"error": "Paramètre fields invalide."}), 400
+
+    user_orders = STORE.list_for_user(
+        user_id,
+        limit=limit,
+        after_id=cursor,
+        descending=(order == "desc"),
+        with_items=("items" in fields),
+    )
+
+    next_cursor = None
+    if limit is not None and len(user_orders) == limit:
+        next_cursor = user_orders[-1]["id"]
+
+    if fields != ORDER_FIELDS:
+        user_orders = [{f: o[f] for f in fields} for o in user_orders]
+
+    resp = jsonify(user_orders)
+    if next_cursor is not None:
+        resp.headers["X-Next-Cursor"] = str(next_cursor)
+    return resp, 200
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return number
+
+
+# Colonnes de l'export CSV : une ligne par article commandé
+EXPORT_CSV_COLUMNS = (
+    "order_id", "user_id", "transaction_id", "datetime", "total",
+    "article_id", "titre", "prix", "qty", "subtotal",
+)
+
+
+def _parse_since(value: str) -> str:
+    """
+    since=2025-11-04 ou 2025-11-04T10:00:00[Z|+01:00] -> chaîne UTC comparable
+    à la colonne datetime (ISO « 2025-11-04T10:36:24.191762Z »).
+    """
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def _ndjson_lines(orders):
+    for order in orders:
+        yield json.dumps(order, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _csv_lines(orders):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    yield flush()
+    for order in orders:
+        head = (order["id"], order["user_id"], order["transaction_id"], order["datetime"], order["total"])
+        for it in order["items"] or [{}]:
+            writer.writerow(head + (
+                it.get("id", ""), it.get("titre", ""), it.get("prix", ""), it.get("qty", ""), it.get("subtotal", ""),
+            ))
+        yield flush()
+
+
+def _export(user_id=None):
+    """
+    Réponse en streaming : les commandes sont lues par lots et écrites au fil
+    de l'eau, sans construire la liste complète.
+    """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "Paramètre format invalide (ndjson ou csv)."}), 400
+    since = request.args.get("since")
+    if since:
+        try:
+            since = _parse_since(since)
+        except ValueError:
+            return jsonify({"error": "Paramètre since invalide (date ISO 8601)."}), 400
+
+    orders = STORE.iter_orders(user_id, since=since)
+    name = f"orders-{user_id if user_id is not None else 'all'}"
+    if fmt == "csv":
+        resp = Response(_csv_lines(orders), mimetype="text/csv")
+    else:
+        resp = Response(_ndjson_lines(orders), mimetype="application/x-ndjson")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{name}.{fmt}"'
+    return resp
+
+
+@app.route("/orders/<int:user_id>/export", methods=["GET"])
+def export_orders_for_user(user_id: int):
+    """
+    Historique complet d'un utilisateur, par id croissant, en streaming.
+
+    Paramètres optionnels :
+    - format=ndjson (une commande JSON par ligne, défaut) ou csv (une ligne par article)
+    - since=DATE   : seulement les commandes passées à partir de cette date (ISO 8601, UTC par défaut)
+    """
+    return _export(user_id)
+
+
+@app.route("/orders/export", methods=["GET"])
+def export_all_orders():
+    """
+    Toutes les commandes (tous utilisateurs), mêmes paramètres que l'export par utilisateur.
+    Désactivé tant que ORDERS_ADMIN_TOKEN n'est pas défini.
+    """
+    denied = _check_admin()
+    if denied:
+        return denied
+    return _export()
+
+
+def _check_admin():
+    """
+    None si la requête porte le jeton d'administration, sinon la réponse d'erreur.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Opération d'administration désactivée (ORDERS_ADMIN_TOKEN non défini)."}), 403
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        return jsonify({"error": "Jeton d'administration invalide."}), 401
+    return None
+
+
+@app.route("/orders/<int:user_id>/summary", methods=["GET"])
+def order_summary(user_id: int):
+    """
+    Résumé du compte, lu dans les agrégats tenus à jour à chaque commande
+    (pas de parcours de l'historique) :
+    { "user_id", "order_count", "total_spent", "last_order_at", "top_articles": [{id, titre, qty}] }
+    Paramètre optionnel : top=N articles les plus commandés (défaut 5, max 50).
+    """
+    top = request.args.get("top", type=_positive_int)
+    if "top" in request.args and top is None:
+        return jsonify({"error": "Paramètre top invalide."}), 400
+    return jsonify(STORE.summary(user_id, top=min(top or 5, 50))), 200
+
+
+@app.route("/orders/summary/rebuild", methods=["POST"])
+def rebuild_order_summaries():
+    """
+    Recalcule tous les agrégats depuis les commandes enregistrées (administration).
     """
-    user_orders = [
-        {
-            "id": o["id"],
-            "transaction_id": o["transaction_id"],
-            "datetime": o["datetime"],
-            "total": o["total"],
-            "items": o["items"],
-        }
-        for o in ORDERS
-        if o.get("user_id") == user_id
-    ]
-    return jsonify(user_orders), 200
+    denied = _check_admin()
+    if denied:
+        return denied
+    STORE.rebuild_aggregates()
+    return jsonify({"status": "ok"}), 200
+
+
+def _reservation_items(items):
+    """
+    Lignes [{"id", "qty"}] -> {article_id: qty} (quantités cumulées), ou None si invalide.
+    """
+    if not isinstance(items, list) or not items:
+        return None
+    wanted = {}
+    for it in items:
+        if not isinstance(it, dict):
+            return None
+        article_id, qty = it.get("id"), it.get("qty", 1)
+        if type(article_id) is not int or type(qty) is not int or qty < 1:
+            return None
+        wanted[article_id] = wanted.get(article_id, 0) + qty
+    return wanted
+
+
+@app.route("/inventory/reservations", methods=["POST"])
+def reserve_stock():
+    """
+    Réserve le stock d'un panier entier, ou rien.
+    Corps : { "reservation_id": "pay-...", "items": [{"id": 3, "qty": 2}, ...], "ttl": 120 }
+    (ttl optionnel, en secondes). Les articles sans stock suivi ne sont pas limités.
+
+    201 : { "reservation_id", "status": "held", "expires_at" } ; renvoyer le même
+    reservation_id rend la réservation existante.
+    409 : { "error", "shortages": [{"id", "requested", "available"}] }
+    Sans confirmation avant expiration, le stock est rendu.
+    """
+    data = request.get_json(silent=True) or {}
+    reservation_id = data.get("reservation_id")
+    if not isinstance(reservation_id, str) or not 0 < len(reservation_id) <= 255:
+        return jsonify({"error": "reservation_id invalide."}), 400
+    wanted = _reservation_items(data.get("items"))
+    if wanted is None:
+        return jsonify({"error": "Champ items invalide."}), 400
+    ttl = data.get("ttl", RESERVATION_TTL)
+    if not isinstance(ttl, (int, float)) or ttl <= 0:
+        return jsonify({"error": "Champ ttl invalide."}), 400
+
+    try:
+        with span("inventory reserve", lines=len(wanted)):
+            reservation = INVENTORY.reserve(reservation_id, wanted, min(ttl, MAX_RESERVATION_TTL))
+    except OutOfStock as exc:
+        return jsonify({"error": "Stock insuffisant.", "shortages": exc.shortages}), 409
+    return jsonify(reservation), 201
+
+
+@app.route("/inventory/reservations/<reservation_id>/commit", methods=["POST"])
+def commit_reservation(reservation_id: str):
+    """
+    Confirme une réservation après paiement (idempotent). Une réservation déjà
+    expirée est confirmée quand même ; "oversold" liste alors les articles en survente.
+    """
+    try:
+        return jsonify(INVENTORY.commit(reservation_id)), 200
+    except UnknownReservation:
+        return jsonify({"error": "Réservation inconnue."}), 404
+
+
+@app.route("/inventory/reservations/<reservation_id>/release", methods=["POST"])
+def release_reservation(reservation_id: str):
+    """
+    Rend le stock d'une réservation (paiement refusé). Sans effet si elle est déjà confirmée.
+    """
+    try:
+        return jsonify(INVENTORY.release(reservation_id)), 200
+    except UnknownReservation:
+        return jsonify({"error": "Réservation inconnue."}), 404
+
+
+@app.route("/inventory/<int:article_id>", methods=["GET"])
+def get_stock(article_id: int):
+    """
+    { "article_id", "on_hand", "reserved", "available" } ; 404 si le stock de l'article n'est pas suivi.
+    """
+    stock = INVENTORY.get(article_id)
+    if stock is None:
+        return jsonify({"error": "Stock non suivi pour cet article."}), 404
+    return jsonify(stock), 200
+
+
+@app.route("/inventory/<int:article_id>", methods=["PUT"])
+def set_stock(article_id: int):
+    """
+    Fixe le stock physique d'un article (administration). Corps : { "on_hand": 10 }
+    """
+    denied = _check_admin()
+    if denied:
+        return denied
+    on_hand = (request.get_json(silent=True) or {}).get("on_hand")
+    if type(on_hand) is not int or on_hand < 0:
+        return jsonify({"error": "Champ on_hand invalide."}), 400
+    return jsonify(INVENTORY.set_stock(article_id, on_hand)), 200
 
 
 @app.route("/health", methods=["GET"])
@@ -74,6 +520,9 @@ def health():
     return jsonify({"status": "ok", "service": "orders_service"}), 200
 
 
+seed_inventory(INVENTORY_SEED_PATH)
+
+
 if __name__ == "__main__":
     # Lance le service des commandes sur le port 5003
     app.run(host="127.0.0.1", port=5003, debug=True)
\ No newline at end of file
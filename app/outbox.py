@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',   -- 'pending' | 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_order_outbox_due ON order_outbox(status, next_attempt_at);
+"""
+
+
+class OrderOutbox:
+    """
+    File d'attente durable des commandes payées, à transmettre au Orders Service.
+
+    - `enqueue` écrit la commande dans SQLite (synchronous=FULL) : une fois
+      le paiement accepté, la commande ne peut plus être perdue.
+    - Un thread de fond envoie les commandes par lots (POST /orders/batch) et relance les échecs
+      avec un backoff exponentiel. Le Orders Service déduplique sur
+      `transaction_id`, un renvoi ne crée donc jamais de doublon.
+    - Les lignes sont « louées » avant l'envoi (next_attempt_at repoussé) :
+      plusieurs processus front peuvent partager la même file.
+    """
+
+    def __init__(self, path: str, orders_client, batch_size: int = 50, poll_interval: float = 1.0,
+                 lease_seconds: float = 30.0, max_backoff: float = 60.0):
+        self.path = path
+        self.orders_client = orders_client
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_backoff = max_backoff
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._worker_pid = None
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            if not self._schema_ready:
+                conn.executescript(SCHEMA)
+                self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    # ---------- Producteur ----------
+
+    def enqueue(self, order: dict):
+        """
+        Enregistre une commande à transmettre (ignorée si son transaction_id est déjà en file).
+        """
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR IGNORE INTO order_outbox (transaction_id, payload, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (order["transaction_id"], json.dumps(order), now, now),
+        )
+        self.ensure_started()
+        self._wake.set()
+
+    # ---------- Worker ----------
+
+    def ensure_started(self):
+        """
+        Démarre le worker dans le processus courant s'il ne tourne pas déjà
+        (les threads ne survivent pas à un fork de serveur WSGI).
+        """
+        if self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker_pid == os.getpid():
+                return
+            if self._worker_pid is not None:
+                # Processus issu d'un fork : on n'utilise pas les connexions du parent
+                self._local = threading.local()
+            thread = threading.Thread(target=self._run, name="order-outbox", daemon=True)
+            thread.start()
+            self._worker_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._claim_batch()
+                if batch:
+                    self._deliver(batch)
+                    continue
+            except Exception:
+                # Le worker ne doit jamais mourir : les lignes louées seront reprises plus tard
+                logger.exception("Outbox : erreur pendant le traitement de la file")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _claim_batch(self) -> list:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, transaction_id, payload, attempts FROM order_outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE order_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self.lease_seconds, r["id"]) for r in rows],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _deliver(self, rows: list):
+        """
+        Envoie le lot en un seul appel à POST /orders/batch et traite le résultat ligne par ligne.
+        """
+        try:
+            resp = self.orders_client.create_orders_batch([self._order(r) for r in rows])
+        except requests.RequestException as exc:
+            for row in rows:
+                self._retry_later(row, repr(exc))
+            return
+
+        if resp.status_code != 200:
+            for row in rows:
+                self._retry_later(row, f"HTTP {resp.status_code}")
+            return
+
+        results = resp.json().get("results", [])
+        for row, result in zip(rows, results):
+            status = result.get("status")
+            if status in (200, 201):
+                self._done(row)
+            elif status is not None and 400 <= status < 500:
+                # Commande refusée par le service : inutile de réessayer
+                logger.error("Outbox : commande %s rejetée (%s)", row["transaction_id"], result.get("error"))
+                self._fail(row, f"HTTP {status}: {result.get('error')}")
+            else:
+                self._retry_later(row, f"HTTP {status}")
+
+    @staticmethod
+    def _order(row) -> dict:
+        order = json.loads(row["payload"])
+        # Lignes mises en file avec le user_id du token (chaîne) : le Orders Service attend un entier
+        if isinstance(order.get("user_id"), str) and order["user_id"].isdigit():
+            order["user_id"] = int(order["user_id"])
+        return order
+
+    def _done(self, row):
+        self._connect().execute("DELETE FROM order_outbox WHERE id = ?", (row["id"],))
+
+    def _fail(self, row, error: str):
+        self._connect().execute(
+            "UPDATE order_outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+            (error, row["id"]),
+        )
+
+    def _retry_later(self, row, error: str):
+        delay = min(self.max_backoff, self.poll_interval * (2 ** row["attempts"]))
+        delay = random.uniform(delay / 2, delay)
+        logger.warning("Outbox : envoi de %s reporté de %.1fs (%s)", row["transaction_id"], delay, error)
+        self._connect().execute(
+            "UPDATE order_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (time.time() + delay, error, row["id"]),
+        )
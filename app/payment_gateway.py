@@ -0,0 +1,227 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pybreaker
+
+logger = logging.getLogger(__name__)
+
+class PaymentGatewayBusy(Exception):
+    """Trop de paiements en cours ou en attente : la demande est refusée immédiatement."""
+
+
+class PaymentDeadlineExceeded(TimeoutError):
+    """Le délai accordé au paiement est écoulé."""
+
+
+class PaymentGateway(ABC):
+    """
+    Passerelle de paiement. `timeout` est le temps restant avant l'échéance
+    de la requête : une vraie passerelle l'utilise comme timeout réseau.
+    """
+
+    @abstractmethod
+    def charge(self, payload: dict, timeout: float) -> dict:
+        ...
+
+
+class SimulatedBankGateway(PaymentGateway):
+    """
+    Banque simulée : même profil que l'ancien _simulate_bank_charge
+    (latence 50–300 ms, 45 % d'échec pour forcer des cas breaker).
+    """
+
+    def __init__(self, failure_rate: float = 0.45, min_latency: float = 0.05, max_latency: float = 0.3):
+        self.failure_rate = failure_rate
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+
+    def charge(self, payload, timeout):
+        latency = random.uniform(self.min_latency, self.max_latency)
+        if latency > timeout:
+            # La banque ne répondrait pas avant l'échéance : on abandonne sans débiter
+            time.sleep(max(timeout, 0))
+            raise PaymentDeadlineExceeded("La banque n'a pas répondu dans le délai imparti (simulé)")
+        time.sleep(latency)
+        if random.random() < self.failure_rate:
+            raise TimeoutError("La banque ne répond pas (simulé)")
+        # uuid : deux paiements dans la même seconde ne partagent pas le même identifiant
+        return {"status": "ok", "transaction_id": f"tx-{uuid.uuid4().hex}"}
+
+
+class _OpenedAtListener(pybreaker.CircuitBreakerListener):
+    """Mémorise l'instant d'ouverture du breaker (pour le contrôle avant admission)."""
+
+    def __init__(self):
+        self.opened_at = None
+
+    def state_change(self, cb, old_state, new_state):
+        self.opened_at = time.monotonic() if new_state.name == pybreaker.STATE_OPEN else None
+
+
+class PaymentProcessor:
+    """
+    Exécute les paiements sur un pool de threads borné.
+
+    - Au plus `max_concurrency` appels simultanés à la passerelle et
+      `max_queue` demandes en attente ; au-delà, PaymentGatewayBusy est
+      levée immédiatement au lieu de bloquer un thread de requête.
+    - L'échéance (deadline) est propagée jusqu'à la passerelle ; une demande
+      restée en file au-delà de son échéance n'est jamais envoyée à la banque.
+    - Un breaker ouvert (pybreaker.CircuitBreaker ou SlidingWindowBreaker)
+      rejette la demande avant qu'elle ne prenne une place.
+    - Avec une clé d'idempotence, un paiement en cours ou réussi depuis moins
+      de `idempotency_ttl` secondes n'est pas relancé : la nouvelle demande
+      attend ou reçoit le même résultat. Les clés sont tenues dans `ledger`
+      (PaymentLedger, partagé entre les processus front) ; sans ledger,
+      seuls les paiements en cours dans ce processus sont dédupliqués.
+      Un échec n'est pas gardé : la demande suivante retente le paiement.
+    """
+
+    def __init__(self, gateway: PaymentGateway, breaker,
+                 max_concurrency: int = 8, max_queue: int = 16, default_timeout: float = 2.0,
+                 idempotency_ttl: float = 600, ledger=None, lease_seconds: float = 60.0,
+                 poll_interval: float = 0.05):
+        self.gateway = gateway
+        self.breaker = breaker
+        self.default_timeout = default_timeout
+        self.idempotency_ttl = idempotency_ttl
+        self.ledger = ledger
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="payment")
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queue)
+        self._opened = _OpenedAtListener()
+        breaker.add_listener(self._opened)
+        self._inflight = {}               # clé -> future des paiements en cours dans ce processus
+        self._inflight_lock = threading.Lock()
+
+    def _check_breaker(self):
+        opened_at = self._opened.opened_at
+        if (
+            opened_at is not None
+            and self.breaker.current_state == pybreaker.STATE_OPEN
+            and time.monotonic() - opened_at < self.breaker.reset_timeout
+        ):
+            raise pybreaker.CircuitBreakerError("Circuit ouvert : paiement refusé sans appel à la banque")
+
+    def _submit(self, payload: dict, deadline: float):
+        self._check_breaker()
+        if not self._slots.acquire(blocking=False):
+            raise PaymentGatewayBusy("Trop de paiements en cours")
+        try:
+            future = self._executor.submit(self._run, payload, deadline)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _claim(self, key: str, payload: dict, deadline: float):
+        """
+        Retourne (future, None) pour un paiement en cours dans ce processus
+        (lancé ou rejoint), (None, résultat) pour un paiement déjà réussi,
+        (None, None) s'il est en cours dans un autre processus.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, None
+            if self.ledger is not None:
+                status, result = self.ledger.claim(key, self.lease_seconds)
+                if status == "succeeded":
+                    return None, result
+                if status == "pending":
+                    return None, None
+            try:
+                future = self._submit(dict(payload, idempotency_key=key), deadline)
+            except Exception:
+                if self.ledger is not None:
+                    self.ledger.release(key)
+                raise
+            self._inflight[key] = future
+        future.add_done_callback(lambda done: self._settle(key, done))
+        return future, None
+
+    def _settle(self, key: str, future):
+        """Résultat d'un paiement avec clé : gardé s'il a réussi, clé libérée sinon."""
+        try:
+            if self.ledger is not None:
+                if future.cancelled() or future.exception() is not None:
+                    self.ledger.release(key)
+                else:
+                    self.ledger.succeed(key, future.result(), self.idempotency_ttl)
+        finally:
+            with self._inflight_lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def _await_other_process(self, key: str, deadline: float):
+        """Attend le paiement qu'un autre processus fait pour `key` ; None s'il a échoué."""
+        while time.monotonic() < deadline:
+            status, result = self.ledger.get(key)
+            if status == "succeeded":
+                return result
+            if status is None:
+                return None
+            time.sleep(self.poll_interval)
+        raise PaymentDeadlineExceeded("Délai de paiement dépassé")
+
+    def charge(self, payload: dict, deadline: float = None, idempotency_key: str = None,
+               on_late_result=None) -> dict:
+        """
+        Débite via la passerelle ; `deadline` est une échéance time.monotonic().
+        `idempotency_key` : identifiant de la demande de paiement (transmis à la
+        passerelle) ; une relance avec la même clé ne débite pas deux fois.
+        `on_late_result(résultat)` : appelé (thread du pool) si le paiement avec
+        clé réussit après PaymentDeadlineExceeded, pour ne pas perdre un débit.
+        Lève CircuitBreakerError, PaymentGatewayBusy, PaymentDeadlineExceeded
+        ou l'erreur de la passerelle.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.default_timeout
+        if not idempotency_key:
+            future = self._submit(payload, deadline)
+        else:
+            while True:
+                future, result = self._claim(idempotency_key, payload, deadline)
+                if future is not None:
+                    break
+                if result is not None:
+                    return result
+                result = self._await_other_process(idempotency_key, deadline)
+                if result is not None:
+                    return result
+                # Échec dans l'autre processus : la clé est libre, on retente
+
+        # Petite marge : la passerelle lève elle-même son erreur d'échéance.
+        # (wait plutôt que result(timeout) : le TimeoutError de la banque ne doit
+        # pas être confondu avec l'expiration de l'attente)
+        done, _ = wait([future], timeout=max(deadline - time.monotonic(), 0) + 0.05)
+        if not done:
+            # (sans clé d'idempotence, un paiement encore en file n'est plus utile)
+            if not idempotency_key:
+                future.cancel()
+            elif on_late_result is not None:
+                future.add_done_callback(lambda late: self._late_result(late, on_late_result))
+            raise PaymentDeadlineExceeded("Délai de paiement dépassé")
+        return future.result()
+
+    @staticmethod
+    def _late_result(future, callback):
+        if future.cancelled() or future.exception() is not None:
+            return
+        try:
+            callback(future.result())
+        except Exception:
+            logger.exception("Paiement réussi après l'échéance : traitement impossible")
+
+    def _run(self, payload, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise PaymentDeadlineExceeded("Délai dépassé avant l'appel à la banque")
+        return self.breaker.call(self.gateway.charge, payload, remaining)
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    idempotency_key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,          -- 'pending' | 'succeeded'
+    result TEXT,
+    expires_at REAL NOT NULL       -- pending : fin du bail ; succeeded : fin de l'idempotence
+);
+CREATE INDEX IF NOT EXISTS idx_payments_expires_at ON payments(expires_at);
+"""
+
+
+class PaymentLedger:
+    """
+    Paiements par clé d'idempotence, partagés entre les processus front (SQLite, WAL).
+
+    - `claim` réserve la clé pour un paiement (bail de `lease` secondes) :
+      un seul processus débite pour une clé donnée.
+    - Un paiement réussi garde son résultat `ttl` secondes : une relance
+      reçoit ce résultat, quel que soit le worker qui la traite.
+    - Un échec libère la clé : la relance suivante retente le paiement.
+    - Un bail échu (processus mort pendant le paiement) peut être repris ;
+      la passerelle reçoit la même clé d'idempotence.
+    """
+
+    def __init__(self, path: str, purge_interval: float = 60.0):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key: str, lease: float) -> tuple:
+        """
+        Retourne ("claimed", None) si la clé est réservée pour ce paiement,
+        ("succeeded", résultat) s'il a déjà réussi, ("pending", None) s'il
+        est en cours dans un autre processus.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if now - self._last_purge >= self.purge_interval:
+                self._last_purge = now
+                conn.execute("DELETE FROM payments WHERE expires_at < ?", (now,))
+            row = conn.execute(
+                "SELECT status, result, expires_at FROM payments WHERE idempotency_key = ?", (key,)
+            ).fetchone()
+            if row is not None and row["expires_at"] > now:
+                conn.execute("COMMIT")
+                if row["status"] == "succeeded":
+                    return "succeeded", json.loads(row["result"])
+                return "pending", None
+            conn.execute(
+                "INSERT OR REPLACE INTO payments (idempotency_key, status, result, expires_at) "
+                "VALUES (?, 'pending', NULL, ?)",
+                (key, now + lease),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return "claimed", None
+
+    def get(self, key: str) -> tuple:
+        """(statut, résultat) de la clé, ou (None, None) si elle est libre."""
+        row = self._connect().execute(
+            "SELECT status, result FROM payments WHERE idempotency_key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row["status"], json.loads(row["result"]) if row["result"] is not None else None
+
+    def succeed(self, key: str, result: dict, ttl: float):
+        self._connect().execute(
+            "UPDATE payments SET status = 'succeeded', result = ?, expires_at = ? WHERE idempotency_key = ?",
+            (json.dumps(result), time.time() + ttl, key),
+        )
+
+    def release(self, key: str):
+        self._connect().execute(
+            "DELETE FROM payments WHERE idempotency_key = ? AND status = 'pending'", (key,)
+        )
@@ -0,0 +1,203 @@
+import threading
+import time
+
+import pybreaker
+
+
+class BulkheadFull(Exception):
+    """Trop d'appels simultanés vers la dépendance : l'appel est refusé sans être tenté."""
+
+
+class Bulkhead:
+    """
+    Cloison : au plus `max_concurrent` appels simultanés vers une dépendance
+    (par processus). Au-delà, l'appel attend au plus `max_wait` secondes puis
+    est refusé (BulkheadFull) : une dépendance lente n'occupe jamais plus que
+    sa part des threads du front.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float = 0.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.on_reject = None
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def __enter__(self):
+        acquired = self._slots.acquire(timeout=self.max_wait) if self.max_wait > 0 else self._slots.acquire(blocking=False)
+        if not acquired:
+            if self.on_reject is not None:
+                self.on_reject(self)
+            raise BulkheadFull(f"{self.name} : {self.max_concurrent} appels déjà en cours")
+        with self._lock:
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+        return False
+
+
+class _State:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+_CLOSED = _State(pybreaker.STATE_CLOSED)
+_OPEN = _State(pybreaker.STATE_OPEN)
+_HALF_OPEN = _State(pybreaker.STATE_HALF_OPEN)
+
+
+class SlidingWindowBreaker:
+    """
+    Circuit breaker sur taux d'erreur et taux d'appels lents, mesurés sur les
+    `window_seconds` dernières secondes (buckets tournants).
+
+    - Fermé : s'ouvre quand, sur au moins `min_calls` appels de la fenêtre,
+      la part d'échecs atteint `failure_rate` ou la part d'appels plus longs
+      que `slow_call_seconds` atteint `slow_call_rate`.
+    - Ouvert : refuse les appels (pybreaker.CircuitBreakerError) pendant `reset_timeout` s.
+    - Semi-ouvert : laisse passer `half_open_calls` appels d'essai ; s'ils
+      réussissent tous (sans lenteur) le circuit se referme, sinon il se rouvre.
+
+    Même interface que pybreaker.CircuitBreaker pour ce qu'en utilise l'application
+    (call, name, current_state, reset_timeout, add_listener) : les listeners
+    pybreaker (métriques, PaymentProcessor) fonctionnent sans changement.
+    Ils sont appelés hors du verrou : un listener lent ou qui relit
+    `current_state` ne bloque pas les autres appels.
+    """
+
+    def __init__(self, name: str, window_seconds: float = 10.0, buckets: int = 10, min_calls: int = 20,
+                 failure_rate: float = 0.5, slow_call_rate: float = 0.8, slow_call_seconds: float = 1.0,
+                 reset_timeout: float = 15.0, half_open_calls: int = 3):
+        self.name = name
+        self.bucket_seconds = window_seconds / buckets
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        # Bucket i : [index de la tranche de temps, appels, échecs, appels lents]
+        self._buckets = [[-1, 0, 0, 0] for _ in range(buckets)]
+        self._state = _CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def current_state(self) -> str:
+        return self._state.name
+
+    def add_listener(self, listener: pybreaker.CircuitBreakerListener):
+        self._listeners.append(listener)
+
+    def _set_state(self, state: _State, transitions: list):
+        """
+        Change d'état (appelé sous self._lock) ; la transition est ajoutée à
+        `transitions`, notifiée aux listeners par `_notify` une fois le verrou relâché.
+        """
+        transitions.append((self._state, state))
+        self._state = state
+        if state is _OPEN:
+            self._opened_at = time.monotonic()
+        self._probes = self._probe_successes = 0
+        if state is _CLOSED:
+            for bucket in self._buckets:
+                bucket[:] = [-1, 0, 0, 0]
+
+    def _notify(self, transitions: list, failure: Exception = None, outcome: bool = False):
+        """Appelle les listeners (hors verrou) : résultat de l'appel puis changements d'état."""
+        for listener in self._listeners:
+            if outcome:
+                if failure is not None:
+                    listener.failure(self, failure)
+                else:
+                    listener.success(self)
+            for old, new in transitions:
+                listener.state_change(self, old, new)
+
+    def before_call(self) -> bool:
+        """
+        Admet ou refuse un appel ; retourne True si c'est un appel d'essai
+        (à passer à `record`). Lève pybreaker.CircuitBreakerError si refusé.
+        """
+        transitions = []
+        try:
+            with self._lock:
+                if self._state is _OPEN:
+                    if time.monotonic() - self._opened_at < self.reset_timeout:
+                        raise pybreaker.CircuitBreakerError(f"Circuit {self.name} ouvert")
+                    self._set_state(_HALF_OPEN, transitions)
+                if self._state is _HALF_OPEN:
+                    if self._probes >= self.half_open_calls:
+                        raise pybreaker.CircuitBreakerError(f"Circuit {self.name} en test")
+                    self._probes += 1
+                    return True
+                return False
+        finally:
+            self._notify(transitions)
+
+    def record(self, duration: float, failure: Exception = None, probe: bool = False):
+        """Résultat d'un appel admis par `before_call`."""
+        slow = duration >= self.slow_call_seconds
+        transitions = []
+        with self._lock:
+            self._update(slow, failure, probe, transitions)
+        self._notify(transitions, failure, outcome=True)
+
+    def _update(self, slow: bool, failure: Exception, probe: bool, transitions: list):
+        """Compte l'appel et change d'état si besoin (appelé sous self._lock)."""
+        if probe:
+            if self._state is not _HALF_OPEN:
+                return
+            if failure is not None or slow:
+                self._set_state(_OPEN, transitions)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._set_state(_CLOSED, transitions)
+            return
+
+        tick = int(time.monotonic() // self.bucket_seconds)
+        bucket = self._buckets[tick % len(self._buckets)]
+        if bucket[0] != tick:
+            bucket[:] = [tick, 0, 0, 0]
+        bucket[1] += 1
+        bucket[2] += failure is not None
+        bucket[3] += slow
+        if self._state is not _CLOSED:
+            return
+
+        oldest = tick - len(self._buckets) + 1
+        calls = failures = slow_calls = 0
+        for index, n, f, s in self._buckets:
+            if index >= oldest:
+                calls, failures, slow_calls = calls + n, failures + f, slow_calls + s
+        if calls >= self.min_calls and (
+            failures >= self.failure_rate * calls or slow_calls >= self.slow_call_rate * calls
+        ):
+            self._set_state(_OPEN, transitions)
+
+    def call(self, func, *args, **kwargs):
+        probe = self.before_call()
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            self.record(time.perf_counter() - started, exc, probe)
+            raise
+        self.record(time.perf_counter() - started, None, probe)
+        return result
@@ -0,0 +1,323 @@
+import os
+import random
+import threading
+import time
+
+import pybreaker
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.metrics import observe_upstream
+from common.tracing import propagation_headers, span
+
+from .resilience import BulkheadFull
+
+
+class UpstreamRejected(requests.RequestException):
+    """Appel refusé sans être tenté : cloison pleine ou circuit ouvert pour ce service."""
+
+
+class _Endpoint:
+    __slots__ = ("url", "outstanding", "failures", "healthy")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+
+
+class EndpointPool:
+    """
+    Instances d'un même service, réparties côté client.
+
+    - Choix « power of two choices » : deux instances saines tirées au hasard,
+      la moins chargée (requêtes en cours dans ce processus) est retenue.
+    - Une instance est écartée après `eject_after` erreurs réseau consécutives
+      ou un /health en échec ; elle revient dès que son /health répond 200.
+    - Avec plusieurs instances, un thread par processus sonde /health toutes
+      les `probe_interval` secondes.
+    - Si toutes les instances sont écartées, elles sont toutes essayées quand
+      même plutôt que de refuser l'appel.
+    """
+
+    def __init__(self, urls: list, probe_interval: float = 2.0, probe_timeout: float = 0.5, eject_after: int = 3):
+        self.endpoints = [_Endpoint(url.strip().rstrip("/")) for url in urls if url.strip()]
+        if not self.endpoints:
+            raise ValueError("Aucune URL d'instance")
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.eject_after = eject_after
+        self._lock = threading.Lock()
+        self._prober_pid = None
+
+    def acquire(self, exclude: _Endpoint = None) -> _Endpoint:
+        """Choisit une instance (autre que `exclude` si possible) et compte la requête en cours."""
+        if len(self.endpoints) == 1:
+            endpoint = self.endpoints[0]
+            with self._lock:
+                endpoint.outstanding += 1
+            return endpoint
+
+        self._ensure_prober()
+        with self._lock:
+            others = [e for e in self.endpoints if e is not exclude]
+            candidates = [e for e in others if e.healthy] or others
+            if len(candidates) == 1:
+                endpoint = candidates[0]
+            else:
+                a, b = random.sample(candidates, 2)
+                endpoint = a if a.outstanding <= b.outstanding else b
+            endpoint.outstanding += 1
+        return endpoint
+
+    def release(self, endpoint: _Endpoint, reachable: bool):
+        """Fin de la requête ; `reachable` est faux sur erreur réseau (timeout, connexion)."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if reachable:
+                endpoint.failures = 0
+            else:
+                endpoint.failures += 1
+                if endpoint.failures >= self.eject_after:
+                    endpoint.healthy = False
+
+    def _ensure_prober(self):
+        """
+        Démarre la sonde dans le processus courant (le thread ne survit pas à un fork).
+        """
+        if self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober_pid == os.getpid():
+                return
+            threading.Thread(target=self._probe_loop, name="endpoint-prober", daemon=True).start()
+            self._prober_pid = os.getpid()
+
+    def _probe_loop(self):
+        session = requests.Session()
+        while True:
+            time.sleep(self.probe_interval)
+            for endpoint in self.endpoints:
+                try:
+                    healthy = session.get(f"{endpoint.url}/health", timeout=self.probe_timeout).status_code == 200
+                except requests.RequestException:
+                    healthy = False
+                with self._lock:
+                    endpoint.healthy = healthy
+                    if healthy:
+                        endpoint.failures = 0
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [
+                {"url": e.url, "healthy": e.healthy, "outstanding": e.outstanding, "failures": e.failures}
+                for e in self.endpoints
+            ]
+
+
+class ServiceClient:
+    """
+    Client HTTP partagé vers un microservice (une ou plusieurs instances).
+
+    - Une seule `requests.Session` par service : les connexions TCP sont
+      réutilisées (keep-alive) au lieu d'être rouvertes à chaque appel.
+    - `pool_size` borne le nombre de connexions ouvertes vers chaque instance.
+    - Chaque appel va à une instance choisie par l'EndpointPool ; une relance
+      part vers une autre instance quand il y en a plusieurs.
+    - Chaque endpoint a son propre budget de timeout (connexion, lecture).
+    - Les appels idempotents sont relancés sur erreur réseau ou 502/503/504,
+      avec un backoff exponentiel « full jitter ».
+    - Chaque tentative est un span de la trace courante et transmet le request id.
+    - `bulkhead` (optionnel) borne les appels simultanés vers le service et
+      `breaker` (optionnel) coupe les appels quand il échoue ou ralentit :
+      le refus est immédiat (UpstreamRejected, une requests.RequestException).
+    """
+
+    # Nom du service appelé (label des métriques) et budgets (connect, read) en secondes
+    SERVICE = "service"
+    TIMEOUTS = {}
+    DEFAULT_TIMEOUT = (0.5, 2.0)
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_urls, pool_size: int = 20, retries: int = 2,
+                 backoff: float = 0.05, timeouts: dict = None, probe_interval: float = 2.0,
+                 bulkhead=None, breaker=None):
+        if isinstance(base_urls, str):
+            base_urls = base_urls.split(",")
+        self.endpoints = EndpointPool(base_urls, probe_interval=probe_interval)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeouts = dict(self.TIMEOUTS, **(timeouts or {}))
+        self.bulkhead = bulkhead
+        self.breaker = breaker
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints.endpoints), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method: str, path: str, endpoint: str, idempotent: bool = False, **kwargs) -> requests.Response:
+        """
+        Effectue l'appel ; lève requests.RequestException si toutes les tentatives échouent.
+        """
+        if self.bulkhead is None:
+            return self._attempts(method, path, endpoint, idempotent, **kwargs)
+        try:
+            with self.bulkhead:
+                return self._attempts(method, path, endpoint, idempotent, **kwargs)
+        except BulkheadFull as exc:
+            observe_upstream(self.SERVICE, endpoint, time.perf_counter(), "bulkhead_full")
+            raise UpstreamRejected(str(exc)) from exc
+
+    def _attempts(self, method: str, path: str, endpoint: str, idempotent: bool, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeouts.get(endpoint, self.DEFAULT_TIMEOUT))
+        attempts = 1 + (self.retries if idempotent else 0)
+        headers = kwargs.pop("headers", None) or {}
+        instance = None
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            probe = self._admit(endpoint)
+            instance = self.endpoints.acquire(exclude=instance)
+            reachable = False
+            failure = None
+            started = time.perf_counter()
+            with span(f"{self.SERVICE} {endpoint}", attempt=attempt, instance=instance.url) as current:
+                try:
+                    resp = self.session.request(
+                        method, f"{instance.url}{path}", headers=dict(headers, **propagation_headers()), **kwargs
+                    )
+                except requests.Timeout as exc:
+                    failure = exc
+                    observe_upstream(self.SERVICE, endpoint, started, "timeout")
+                    current["attrs"]["outcome"] = "timeout"
+                    if last:
+                        raise
+                except requests.ConnectionError as exc:
+                    failure = exc
+                    observe_upstream(self.SERVICE, endpoint, started, "connection")
+                    current["attrs"]["outcome"] = "connection"
+                    if last:
+                        raise
+                except requests.RequestException as exc:
+                    # Réponse illisible, redirections en boucle... : échec pour le breaker comme les autres
+                    failure = exc
+                    observe_upstream(self.SERVICE, endpoint, started, "error")
+                    current["attrs"]["outcome"] = "error"
+                    if last:
+                        raise
+                else:
+                    reachable = True
+                    if resp.status_code >= 500:
+                        failure = requests.HTTPError(f"Statut {resp.status_code}", response=resp)
+                    observe_upstream(self.SERVICE, endpoint, started, "http_5xx" if failure else "ok")
+                    current["attrs"]["status"] = resp.status_code
+                    if last or resp.status_code not in self.RETRY_STATUSES:
+                        return resp
+                finally:
+                    self.endpoints.release(instance, reachable)
+                    if self.breaker is not None:
+                        self.breaker.record(time.perf_counter() - started, failure, probe)
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _admit(self, endpoint: str) -> bool:
+        """Passage par le breaker ; retourne True pour un appel d'essai (circuit semi-ouvert)."""
+        if self.breaker is None:
+            return False
+        try:
+            return self.breaker.before_call()
+        except pybreaker.CircuitBreakerError as exc:
+            observe_upstream(self.SERVICE, endpoint, time.perf_counter(), "circuit_open")
+            raise UpstreamRejected(str(exc)) from exc
+
+    def close(self):
+        self.session.close()
+
+
+class AuthClient(ServiceClient):
+    """
+    Appels vers l'Auth Service.
+    """
+
+    SERVICE = "auth_service"
+
+    TIMEOUTS = {
+        "login": (0.5, 2.0),
+        "verify": (0.3, 1.0),
+        "refresh": (0.5, 2.0),
+        "logout": (0.5, 2.0),
+        "revocations": (0.3, 1.0),
+    }
+
+    def __init__(self, base_urls, service_token: str = "", **kwargs):
+        super().__init__(base_urls, **kwargs)
+        # Jeton partagé avec l'Auth Service pour les endpoints réservés au front
+        self.service_token = service_token
+
+    def login(self, username: str, password: str, client_ip: str = None) -> requests.Response:
+        # L'IP du navigateur sert à la limitation des tentatives côté Auth Service
+        headers = {"X-Forwarded-For": client_ip} if client_ip else None
+        return self._request("POST", "/login", "login", headers=headers,
+                             json={"username": username, "password": password})
+
+    def verify(self, token: str) -> requests.Response:
+        # /verify ne modifie rien : on peut relancer sans risque
+        return self._request("POST", "/verify", "verify", idempotent=True, json={"token": token})
+
+    def refresh(self, refresh_token: str) -> requests.Response:
+        # Rotation : un même refresh token représenté dans les secondes qui suivent
+        # renvoie le même successeur, on peut donc relancer sans risque
+        return self._request("POST", "/refresh", "refresh", idempotent=True, json={"refresh_token": refresh_token})
+
+    def logout(self, refresh_token: str = None, access_token: str = None) -> requests.Response:
+        return self._request("POST", "/logout", "logout", idempotent=True,
+                             json={"refresh_token": refresh_token, "access_token": access_token})
+
+    def revocations(self, since: int) -> requests.Response:
+        return self._request("GET", "/revocations", "revocations", idempotent=True, params={"since": since},
+                             headers={"Authorization": f"Bearer {self.service_token}"})
+
+
+class OrdersClient(ServiceClient):
+    """
+    Appels vers le Orders Service.
+    """
+
+    SERVICE = "orders_service"
+
+    TIMEOUTS = {
+        "create_order": (0.5, 2.0),
+        "create_orders_batch": (0.5, 5.0),
+        "list_orders": (0.5, 2.0),
+        "reserve_stock": (0.5, 2.0),
+        "commit_reservation": (0.5, 2.0),
+        "release_reservation": (0.5, 2.0),
+    }
+
+    def create_order(self, order: dict, idempotency_key: str = None) -> requests.Response:
+        # Relances seulement avec une clé d'idempotence (sinon les renvois passent par l'outbox)
+        if idempotency_key:
+            return self._request("POST", "/orders", "create_order", idempotent=True,
+                                 headers={"Idempotency-Key": idempotency_key}, json=order)
+        return self._request("POST", "/orders", "create_order", json=order)
+
+    def create_orders_batch(self, orders: list) -> requests.Response:
+        return self._request("POST", "/orders/batch", "create_orders_batch", json=orders)
+
+    def list_orders(self, user_id, **params) -> requests.Response:
+        return self._request("GET", f"/orders/{user_id}", "list_orders", idempotent=True, params=params)
+
+    # Réservation de stock : les trois appels sont idempotents pour un même reservation_id
+    def reserve_stock(self, reservation_id: str, items: list) -> requests.Response:
+        lines = [{"id": it["id"], "qty": it["qty"]} for it in items]
+        return self._request("POST", "/inventory/reservations", "reserve_stock", idempotent=True,
+                             json={"reservation_id": reservation_id, "items": lines})
+
+    def commit_reservation(self, reservation_id: str) -> requests.Response:
+        return self._request("POST", f"/inventory/reservations/{reservation_id}/commit", "commit_reservation",
+                             idempotent=True)
+
+    def release_reservation(self, reservation_id: str) -> requests.Response:
+        return self._request("POST", f"/inventory/reservations/{reservation_id}/release", "release_reservation",
+                             idempotent=True)
@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+
+class TokenExpired(Exception):
+    """Le token est correctement signé mais expiré."""
+
+
+class TokenInvalid(Exception):
+    """Signature, format ou type de token invalide."""
+
+
+class VerifierUnavailable(Exception):
+    """Impossible de récupérer les clés publiques (Auth Service injoignable)."""
+
+
+class Principal:
+    """
+    Utilisateur authentifié de la requête en cours, posé sur flask.g par
+    login_required : les vues n'ont pas à revérifier le token.
+    `user_id` est le `sub` du token (chaîne), `expires_at` son expiration (epoch),
+    `jti` et `family` ses identifiants de révocation (token et famille de session).
+    """
+
+    __slots__ = ("user_id", "username", "expires_at", "jti", "family")
+
+    def __init__(self, user_id: str, username: str, expires_at: float = None, jti: str = None, family: str = None):
+        self.user_id = user_id
+        self.username = username
+        self.expires_at = expires_at
+        self.jti = jti
+        self.family = family
+
+    @classmethod
+    def from_claims(cls, claims: dict):
+        return cls(claims.get("sub"), claims.get("username"), claims.get("exp"), claims.get("jti"), claims.get("fam"))
+
+    def __repr__(self):
+        return f"Principal(user_id={self.user_id!r}, username={self.username!r})"
+
+
+class RevocationFeed:
+    """
+    Copie en mémoire des révocations de l'Auth Service (GET /revocations?since=<seq>) :
+    un token révoqué au logout est refusé par la vérification locale.
+
+    - `fetch(since)` retourne la réponse HTTP de /revocations ; seules les
+      révocations écrites depuis la dernière lecture sont transférées.
+    - Relecture au plus toutes les `sync_interval` s, par le thread de requête
+      qui la déclenche ; les autres continuent avec la liste courante.
+    - Sans lecture réussie depuis `max_staleness` s, `is_revoked` lève
+      VerifierUnavailable : le front se replie sur /verify plutôt que
+      d'accepter un token peut-être révoqué.
+    """
+
+    def __init__(self, fetch, sync_interval: float = 1.0, max_staleness: float = 10.0,
+                 purge_interval: float = 60.0):
+        self._fetch = fetch
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.purge_interval = purge_interval
+        self._revoked = {}          # jti ou famille -> expiration (epoch)
+        self._last_seq = 0
+        self._last_attempt = 0.0
+        self._last_sync = None
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _sync(self):
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_attempt = time.monotonic()
+            more = True
+            while more:
+                resp = self._fetch(self._last_seq)
+                resp.raise_for_status()
+                page = resp.json()
+                with self._lock:
+                    for entry in page["revocations"]:
+                        if entry["exp"] > self._revoked.get(entry["id"], 0):
+                            self._revoked[entry["id"]] = entry["exp"]
+                    self._last_seq = max(self._last_seq, page["last_seq"])
+                more = page.get("more", False)
+            self._last_sync = time.monotonic()
+        except Exception as exc:
+            logger.warning("Révocations : lecture impossible (%s)", exc)
+        finally:
+            self._sync_lock.release()
+
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            now = time.time()
+            with self._lock:
+                self._revoked = {token_id: exp for token_id, exp in self._revoked.items() if exp > now}
+
+    def is_revoked(self, *token_ids) -> bool:
+        """Vrai si l'un des identifiants (jti, famille) est révoqué. Les None sont ignorés."""
+        if time.monotonic() - self._last_attempt >= self.sync_interval:
+            self._sync()
+        if self._last_sync is None or time.monotonic() - self._last_sync > self.max_staleness:
+            raise VerifierUnavailable("Liste des révocations périmée")
+        now = time.time()
+        with self._lock:
+            return any(
+                token_id is not None and self._revoked.get(token_id, 0) > now
+                for token_id in token_ids
+            )
+
+
+class TokenVerifier:
+    """
+    Vérification locale des access tokens (RS256) avec les clés publiées
+    par l'Auth Service sur /.well-known/jwks.json.
+
+    - Les clés sont téléchargées une fois puis mises en cache ; un `kid`
+      inconnu (rotation) déclenche un rechargement du JWKS.
+    - Un LRU borné garde les tokens déjà vérifiés : les requêtes suivantes
+      avec le même token ne refont pas la vérification cryptographique.
+    - Avec `revocations`, chaque vérification (y compris depuis le LRU)
+      consulte la liste des révocations ; un token révoqué sort du cache.
+    """
+
+    def __init__(self, jwks_url: str, cache_size: int = 1024, jwks_lifespan: float = 300, timeout: float = 2,
+                 revocations: RevocationFeed = None):
+        self._jwk_client = jwt.PyJWKClient(jwks_url, lifespan=jwks_lifespan, timeout=timeout)
+        self._revocations = revocations
+        self._cache_size = cache_size
+        self._cache = OrderedDict()   # token -> (user_info, exp)
+        self._lock = threading.Lock()
+
+    def _cache_get(self, token: str):
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is None:
+                return None
+            user_info, exp = entry
+            if exp <= time.time():
+                del self._cache[token]
+                raise TokenExpired()
+            self._cache.move_to_end(token)
+            return user_info
+
+    def _cache_put(self, token: str, user_info: dict, exp: float):
+        with self._lock:
+            self._cache[token] = (user_info, exp)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, token: str):
+        with self._lock:
+            self._cache.pop(token, None)
+
+    def verify(self, token: str) -> dict:
+        """
+        Retourne {"sub", "username", "exp", "jti", "fam"} si le token est un
+        access token valide et non révoqué. Lève TokenExpired, TokenInvalid ou VerifierUnavailable.
+        """
+        user_info = self._cache_get(token)
+        if user_info is None:
+            user_info = self._decode(token)
+        if self._revocations is not None and self._revocations.is_revoked(user_info["jti"], user_info["fam"]):
+            self._cache_drop(token)
+            raise TokenInvalid("Token révoqué")
+        return user_info
+
+    def _decode(self, token: str) -> dict:
+        """Vérification cryptographique ; le résultat est mis dans le LRU."""
+        try:
+            signing_key = self._jwk_client.get_signing_key_from_jwt(token)
+        except jwt.PyJWKClientConnectionError as exc:
+            raise VerifierUnavailable(str(exc)) from exc
+        except (jwt.PyJWKClientError, jwt.InvalidTokenError) as exc:
+            raise TokenInvalid(str(exc)) from exc
+
+        try:
+            decoded = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=["RS256"],
+                options={"require": ["exp"]}
+            )
+        except jwt.ExpiredSignatureError as exc:
+            raise TokenExpired() from exc
+        except jwt.InvalidTokenError as exc:
+            raise TokenInvalid(str(exc)) from exc
+
+        if decoded.get("type") != "access":
+            raise TokenInvalid("Mauvais type de token")
+
+        user_info = {
+            "sub": decoded.get("sub"),
+            "username": decoded.get("username"),
+            "exp": decoded["exp"],
+            "jti": decoded.get("jti"),
+            "fam": decoded.get("fam"),
+        }
+        self._cache_put(token, user_info, decoded["exp"])
+        return user_info
@@ -1,51 +1,165 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, abort
+from flask import Blueprint, Response, g, jsonify, render_template, request, redirect, url_for, session, abort, make_response
+from markupsafe import Markup
 from functools import wraps
-import random
+import hashlib
+import os
 import time
+import uuid
 import logging
-from collections import Counter
 from datetime import datetime
 import requests
 
 # Circuit breaker
 import pybreaker
 
+from common.metrics import watch_breaker, watch_bulkhead
+from common.tracing import span
+
+from .cart_store import create_cart_store
+from .catalog import Catalog
+from .fragment_cache import FragmentCache
+from .outbox import OrderOutbox
+from .payment_gateway import PaymentDeadlineExceeded, PaymentProcessor, PaymentGatewayBusy, SimulatedBankGateway
+from .payment_ledger import PaymentLedger
+from .resilience import Bulkhead, SlidingWindowBreaker
+from .service_clients import AuthClient, OrdersClient
+from .token_verifier import Principal, RevocationFeed, TokenVerifier, TokenExpired, TokenInvalid, VerifierUnavailable
+
 bp = Blueprint("main", __name__)
 
 # ================== URLs des microservices ==================
-AUTH_SERVICE_URL = "http://localhost:5001"
-USER_SERVICE_URL = "http://localhost:5002"
-ORDERS_SERVICE_URL = "http://localhost:5003"
-
-# ================== Données “catalogue” en mémoire ==================
-ARTICLES = [
-    {"id": 1,  "titre": "Clavier mécanique",          "prix": 79.90},
-    {"id": 2,  "titre": "Souris sans fil",            "prix": 39.90},
-    {"id": 3,  "titre": "Écran 27\"",                 "prix": 229.00},
-    {"id": 4,  "titre": "Casque audio fermé",         "prix": 99.00},
-    {"id": 5,  "titre": "Casque audio ouvert",        "prix": 129.00},
-    {"id": 6,  "titre": "Micro USB cardioïde",        "prix": 59.90},
-    {"id": 7,  "titre": "Webcam 1080p 60fps",         "prix": 89.90},
-    {"id": 8,  "titre": "Hub USB-C 8-en-1",           "prix": 49.90},
-    {"id": 9,  "titre": "SSD NVMe 1To",               "prix": 99.90},
-    {"id": 10, "titre": "Clé USB 128Go",              "prix": 19.90},
-    {"id": 11, "titre": "Tapis de souris XL",         "prix": 24.90},
-    {"id": 12, "titre": "Support écran aluminium",    "prix": 34.90},
-    {"id": 13, "titre": "Station d’accueil USB-C",    "prix": 149.00},
-    {"id": 14, "titre": "Chargeur GaN 65W",           "prix": 39.90},
-    {"id": 15, "titre": "Câble USB-C 2m 100W",        "prix": 12.90},
-]
-ARTICLES_BY_ID = {a["id"]: a for a in ARTICLES}
+# Une ou plusieurs instances par service, séparées par des virgules (répartition côté client)
+AUTH_SERVICE_URLS = os.environ.get("AUTH_SERVICE_URLS", "http://localhost:5001").split(",")
+ORDERS_SERVICE_URLS = os.environ.get("ORDERS_SERVICE_URLS", "http://localhost:5003").split(",")
+
+# ================== Isolation des dépendances ==================
+# Chaque dépendance (auth, orders, banque) a sa cloison (appels simultanés bornés,
+# refus immédiat au-delà) et son breaker sur taux d'erreur / d'appels lents :
+# une dépendance en panne ou lente n'immobilise pas tous les threads du front.
+def dependency_breaker(name: str, slow_call_seconds: float, failure_rate: float = 0.5,
+                       min_calls: int = 10) -> SlidingWindowBreaker:
+    breaker = SlidingWindowBreaker(
+        name, window_seconds=30, min_calls=min_calls, failure_rate=failure_rate,
+        slow_call_rate=0.8, slow_call_seconds=slow_call_seconds, reset_timeout=15,
+    )
+    watch_breaker(breaker)
+    return breaker
+
+def dependency_bulkhead(name: str, max_concurrent: int) -> Bulkhead:
+    bulkhead = Bulkhead(name, max_concurrent)
+    watch_bulkhead(bulkhead)
+    return bulkhead
+
+# Clients HTTP partagés (connexions réutilisées, timeouts par endpoint, sonde /health des instances)
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+HEALTH_PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", 2.0))
+auth_client = AuthClient(
+    AUTH_SERVICE_URLS, service_token=os.environ.get("INTERNAL_SERVICE_TOKEN", ""),
+    pool_size=HTTP_POOL_SIZE, probe_interval=HEALTH_PROBE_INTERVAL,
+    # Le login (hachage du mot de passe) dure normalement plusieurs centaines de ms
+    bulkhead=dependency_bulkhead("auth", int(os.environ.get("AUTH_MAX_CONCURRENCY", 16))),
+    breaker=dependency_breaker("auth_breaker", slow_call_seconds=1.5),
+)
+orders_client = OrdersClient(
+    ORDERS_SERVICE_URLS, pool_size=HTTP_POOL_SIZE, probe_interval=HEALTH_PROBE_INTERVAL,
+    bulkhead=dependency_bulkhead("orders", int(os.environ.get("ORDERS_MAX_CONCURRENCY", 16))),
+    breaker=dependency_breaker("orders_breaker", slow_call_seconds=1.0),
+)
+
+# Commandes payées en attente d'envoi au Orders Service (file SQLite locale)
+OUTBOX_DB_PATH = os.environ.get(
+    "OUTBOX_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "outbox.db")
+)
+order_outbox = OrderOutbox(OUTBOX_DB_PATH, orders_client)
+
+# Paniers côté serveur : "memory" (un seul processus) ou "sqlite" (plusieurs workers)
+cart_store = create_cart_store(
+    os.environ.get("CART_BACKEND", "memory"),
+    path=os.environ.get(
+        "CART_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "carts.db")
+    ),
+    ttl_seconds=float(os.environ.get("CART_TTL_SECONDS", 24 * 3600)),
+)
+
+# Nombre de commandes par page dans l'historique (les suivantes sont chargées à la demande)
+HISTORY_PAGE_SIZE = 20
+
+# ================== Vérification des tokens ==================
+# "local"  : signature vérifiée dans le front avec les clés publiées par l'Auth Service,
+#            révocations (logout) recopiées depuis /revocations toutes les TOKEN_REVOCATION_SYNC_INTERVAL s
+#            (repli sur /verify si les clés ou les révocations sont indisponibles)
+# "remote" : appel systématique à /verify
+TOKEN_VERIFY_MODE = os.environ.get("TOKEN_VERIFY_MODE", "local")
+# Toutes les instances de l'Auth Service partagent le même trousseau : la première publie les clés
+token_verifier = TokenVerifier(
+    f"{AUTH_SERVICE_URLS[0].strip().rstrip('/')}/.well-known/jwks.json",
+    cache_size=int(os.environ.get("TOKEN_CACHE_SIZE", 1024)),
+    revocations=RevocationFeed(
+        auth_client.revocations,
+        sync_interval=float(os.environ.get("TOKEN_REVOCATION_SYNC_INTERVAL", 1.0)),
+        max_staleness=float(os.environ.get("TOKEN_REVOCATION_MAX_STALENESS", 10.0)),
+    ),
+)
+
+# ================== Catalogue ==================
+# Chargé une fois au démarrage depuis un fichier JSON ou une base SQLite (table articles)
+CATALOG_PATH = os.environ.get(
+    "CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "articles.json")
+)
+catalog = Catalog.load(CATALOG_PATH)
+ARTICLES_PER_PAGE = 20
+# Listes d'articles déjà rendues, invalidées quand catalog.version change
+catalog_fragments = FragmentCache(max_entries=int(os.environ.get("CATALOG_FRAGMENT_CACHE_SIZE", 512)))
 
 
 # ================== Circuit Breaker ==================
 
 logger = logging.getLogger(__name__)
-breaker = pybreaker.CircuitBreaker(fail_max=3, reset_timeout=15, name="bank_api_breaker")
+# La banque simulée échoue normalement à 45 % (BANK_FAILURE_RATE) : avec le seuil
+# des autres dépendances (50 % sur 10 appels), le breaker s'ouvrirait sur une
+# simple série malchanceuse. Il ne s'ouvre qu'à 80 % d'échecs sur au moins 20 appels,
+# signe d'une vraie panne.
+breaker = dependency_breaker(
+    "bank_api_breaker", slow_call_seconds=1.0,
+    failure_rate=float(os.environ.get("BANK_BREAKER_FAILURE_RATE", 0.8)),
+    min_calls=int(os.environ.get("BANK_BREAKER_MIN_CALLS", 20)),
+)
+
+# Paiements exécutés sur un pool borné (file d'attente limitée, échéance propagée) :
+# c'est la cloison de la banque
+payment_processor = PaymentProcessor(
+    # BANK_FAILURE_RATE : taux d'échec de la banque simulée (0 pour un benchmark sans pannes)
+    SimulatedBankGateway(failure_rate=float(os.environ.get("BANK_FAILURE_RATE", 0.45))),
+    breaker,
+    max_concurrency=int(os.environ.get("PAYMENT_MAX_CONCURRENCY", 8)),
+    max_queue=int(os.environ.get("PAYMENT_MAX_QUEUE", 16)),
+    default_timeout=float(os.environ.get("PAYMENT_TIMEOUT", 2.0)),
+    idempotency_ttl=float(os.environ.get("PAYMENT_IDEMPOTENCY_TTL", 600)),
+    # Clés d'idempotence partagées par les workers front : une relance traitée
+    # par un autre processus reçoit le même résultat au lieu de débiter à nouveau
+    ledger=PaymentLedger(os.environ.get(
+        "PAYMENT_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "payments.db")
+    )),
+)
 
 # ================== Helpers session/panier ==================
 
+def _set_principal(principal: Principal):
+    """
+    Utilisateur vérifié de la requête : g.principal pour les vues, et la
+    session est réalignée sur le token (user_id ne dérive pas).
+    """
+    g.principal = principal
+    session["user_id"] = principal.user_id
+    if principal.username:
+        session["username"] = principal.username
+
+
 def login_required(view_func):
+    """
+    Vérifie le token de la session (localement, sinon via /verify, avec refresh si expiré)
+    et attache l'utilisateur vérifié à flask.g.principal avant d'appeler la vue.
+    """
     @wraps(view_func)
     def wrapper(*args, **kwargs):
         access_token = session.get("access_token")
@@ -54,39 +168,43 @@ def login_required(view_func):
         if not access_token:
             return redirect(url_for("main.login"))
 
-        # Première tentative de vérification de l'access token
-        try:
-            resp = requests.post(
-                f"{AUTH_SERVICE_URL}/verify",
-                json={"token": access_token},
-                timeout=2,
-            )
-        except requests.RequestException:
-            # Si le service d'auth est down, on force une reconnexion
-            session.clear()
-            return redirect(url_for("main.login"))
+        # Première tentative : vérification locale de la signature (sans appel réseau)
+        data = None
+        if TOKEN_VERIFY_MODE == "local":
+            try:
+                data = {"valid": True, "user": token_verifier.verify(access_token)}
+            except TokenExpired:
+                data = {"valid": False, "error": "Token expiré"}
+            except TokenInvalid:
+                data = {"valid": False, "error": "Token invalide"}
+            except VerifierUnavailable:
+                logger.warning("Clés publiques ou révocations indisponibles, repli sur /verify")
+
+        # Repli : vérification par l'Auth Service
+        if data is None:
+            try:
+                resp = auth_client.verify(access_token)
+            except requests.RequestException:
+                # Si le service d'auth est down, on force une reconnexion
+                session.clear()
+                return redirect(url_for("main.login"))
 
-        data = resp.json() if resp.content else {}
+            data = resp.json() if resp.content else {}
+            if resp.status_code != 200:
+                data["valid"] = False
 
-        if resp.status_code == 200 and data.get("valid"):
-            # Token encore valide : on met à jour les infos utilisateur et on passe
-            user_info = data.get("user", {})
-            session["user_id"] = user_info.get("sub")
-            if user_info.get("username"):
-                session["username"] = user_info.get("username")
+        if data.get("valid"):
+            # Token encore valide : l'utilisateur vérifié est attaché à la requête
+            _set_principal(Principal.from_claims(data.get("user", {})))
             return view_func(*args, **kwargs)
 
-        # Ici : soit status != 200, soit valid == False
+        # Ici : token refusé (vérification locale ou /verify)
         error = data.get("error")
 
         # Si le token est expiré et qu'on a un refresh token, on tente un refresh
         if error == "Token expiré" and refresh_token:
             try:
-                r = requests.post(
-                    f"{AUTH_SERVICE_URL}/refresh",
-                    json={"refresh_token": refresh_token},
-                    timeout=2,
-                )
+                r = auth_client.refresh(refresh_token)
             except requests.RequestException:
                 session.clear()
                 return redirect(url_for("main.login"))
@@ -97,8 +215,14 @@ def login_required(view_func):
                 if new_access:
                     # On met à jour le token d'accès et les infos utilisateur
                     session["access_token"] = new_access
-                    session["user_id"] = new_data.get("user_id")
-                    session["username"] = new_data.get("username")
+                    # Rotation : l'ancien refresh token est consommé
+                    if new_data.get("refresh_token"):
+                        session["refresh_token"] = new_data["refresh_token"]
+                    expires_in = new_data.get("expires_in")
+                    _set_principal(Principal(
+                        str(new_data.get("user_id")), new_data.get("username"),
+                        time.time() + expires_in if expires_in else None,
+                    ))
                     # On laisse passer la requête protégée
                     return view_func(*args, **kwargs)
 
@@ -108,16 +232,31 @@ def login_required(view_func):
 
     return wrapper
 
-def get_cart_counter() -> Counter:
-    ids = session.get("cart", [])
-    return Counter(ids)
+def get_cart_id(create: bool = False):
+    """
+    Identifiant du panier côté serveur ; seul lui est stocké dans le cookie de session.
+    """
+    cart_id = session.get("cart_id")
+    if cart_id is None and create:
+        cart_id = uuid.uuid4().hex
+        session["cart_id"] = cart_id
+    return cart_id
+
+def get_cart_counter() -> dict:
+    cart_id = get_cart_id()
+    return cart_store.get(cart_id) if cart_id else {}
+
+def clear_cart():
+    cart_id = session.pop("cart_id", None)
+    if cart_id:
+        cart_store.clear(cart_id)
 
 def get_cart_items_and_total():
     cnt = get_cart_counter()
     items = []
     total = 0.0
     for aid, qty in cnt.items():
-        art = ARTICLES_BY_ID.get(aid)
+        art = catalog.get(aid)
         if not art:
             continue
         subtotal = art["prix"] * qty
@@ -132,24 +271,105 @@ def get_cart_items_and_total():
     return items, round(total, 2)
 
 def cart_count() -> int:
-    return len(session.get("cart", []))
+    cart_id = get_cart_id()
+    return cart_store.count(cart_id) if cart_id else 0
 
 # ================== Paiement simulé ==================
 
-def _simulate_bank_charge(payload):
-    # 45% d'échec pour forcer des cas breaker
-    latency = random.uniform(0.05, 0.3)
-    time.sleep(latency)
-    if random.random() < 0.45:
-        raise TimeoutError("La banque ne répond pas (simulé)")
-    return {"status": "ok", "transaction_id": f"tx-{int(time.time())}"}
+def payment_idempotency_key(items) -> str:
+    """
+    Clé d'idempotence d'un paiement de panier : même panier, même contenu,
+    même clé (double clic, renvoi du GET). Après paiement le panier est vidé
+    et change d'identifiant : l'achat suivant a une nouvelle clé.
+    """
+    content = ",".join(f"{it['id']}x{it['qty']}" for it in sorted(items, key=lambda it: it["id"]))
+    digest = hashlib.sha256(f"{get_cart_id()}|{content}".encode("utf-8")).hexdigest()
+    return f"pay-{digest[:32]}"
+
+def reserve_cart_stock(reservation_id, items) -> str:
+    """
+    Réserve le stock de tout le panier auprès du Orders Service avant le paiement.
+    Retourne le message d'erreur à afficher, ou None si la réservation est faite.
+    """
+    unavailable = "Le stock ne peut pas être vérifié actuellement. Réessayez dans quelques instants."
+    try:
+        resp = orders_client.reserve_stock(reservation_id, items)
+    except requests.RequestException as exc:
+        logger.warning("Réservation du stock impossible : %s", exc)
+        return unavailable
+    if resp.status_code == 409:
+        titles = {it["id"]: it["titre"] for it in items}
+        missing = ", ".join(
+            f"{titles.get(s['id'], s['id'])} (reste {s['available']})" for s in resp.json().get("shortages", [])
+        )
+        return f"Stock insuffisant : {missing}. Modifiez votre panier."
+    if resp.status_code != 201:
+        logger.error("Orders Service /inventory/reservations a retourné le statut %s", resp.status_code)
+        return unavailable
+    return None
+
+def release_cart_stock(reservation_id):
+    # Sans réponse, la réservation expire d'elle-même côté Orders Service
+    try:
+        orders_client.release_reservation(reservation_id)
+    except requests.RequestException as exc:
+        logger.warning("Libération de la réservation %s impossible : %s", reservation_id, exc)
+
+def commit_cart_stock(reservation_id):
+    # Sans réponse, la commande transmise par l'outbox confirme la réservation
+    try:
+        orders_client.commit_reservation(reservation_id)
+    except requests.RequestException as exc:
+        logger.warning("Confirmation de la réservation %s reportée : %s", reservation_id, exc)
+
+def process_payment_with_breaker(payload, idempotency_key=None, on_late_result=None):
+    # Le breaker est appliqué par le PaymentProcessor (voir payment_gateway.py)
+    with span("bank charge"):
+        return payment_processor.charge(payload, idempotency_key=idempotency_key, on_late_result=on_late_result)
+
+def cart_order(user_id, items, total, payment, reservation_id) -> dict:
+    return {
+        # `sub` du token (chaîne) : le Orders Service attend un entier
+        "user_id": int(user_id),
+        "items": items,
+        "total": total,
+        "transaction_id": payment.get("transaction_id"),
+        "datetime": datetime.utcnow().isoformat() + "Z",
+        "reservation_id": reservation_id,
+    }
+
+def record_cart_order(order):
+    # Le client a été débité : la commande est d'abord écrite dans l'outbox locale,
+    # puis transmise au Orders Service en arrière-plan (avec relances)
+    order_outbox.enqueue(order)
+    commit_cart_stock(order["reservation_id"])
 
-@breaker
-def process_payment_with_breaker(payload):
-    return _simulate_bank_charge(payload)
+def late_cart_payment(user_id, items, total, reservation_id, cart_id):
+    """
+    Paiement réussi après que la requête a abandonné (échéance dépassée) :
+    la commande est quand même enregistrée et le panier, s'il n'a pas changé, vidé.
+    """
+    def on_result(payment):
+        logger.warning("Paiement %s confirmé après l'échéance : commande enregistrée", reservation_id)
+        record_cart_order(cart_order(user_id, items, total, payment, reservation_id))
+        if cart_id and cart_store.get(cart_id) == {it["id"]: it["qty"] for it in items}:
+            cart_store.clear(cart_id)
+    return on_result
 
 # ================== Routes ==================
 
+@bp.before_app_request
+def start_background_workers():
+    # Relance l'envoi des commandes restées en file (redémarrage, fork d'un worker WSGI)
+    order_outbox.ensure_started()
+
+@bp.route("/health")
+def health():
+    """
+    Endpoint de santé (run.py attend sa réponse avant d'ouvrir le trafic).
+    """
+    return jsonify({"status": "ok", "service": "front"}), 200
+
 @bp.route("/", methods=["GET", "POST"])
 def login():
     """
@@ -165,11 +385,7 @@ def login():
             return render_template("login.html", error="Veuillez saisir un nom d’utilisateur et un mot de passe.")
 
         try:
-            resp = requests.post(
-                f"{AUTH_SERVICE_URL}/login",
-                json={"username": username, "password": password},
-                timeout=2,
-            )
+            resp = auth_client.login(username, password, request.remote_addr)
         except requests.RequestException:
             return render_template("login.html", error="Service d’authentification indisponible. Réessayez plus tard.")
 
@@ -183,6 +399,13 @@ def login():
         if not access_token:
             return render_template("login.html", error="Réponse invalide du service d’authentification.")
 
+        # Changement d'utilisateur : la session précédente est révoquée (au mieux)
+        if session.get("refresh_token") or session.get("access_token"):
+            try:
+                auth_client.logout(session.get("refresh_token"), session.get("access_token"))
+            except requests.RequestException:
+                logger.warning("Révocation de la session précédente impossible")
+
         # Stockage des tokens en session
         session["access_token"] = access_token
         refresh_token = data.get("refresh_token")
@@ -192,7 +415,7 @@ def login():
         # On garde username saisi pour l’affichage, en attendant de récupérer celui du token
         session["username"] = data.get("username", username)
         session["user_id"] = data.get("user_id")
-        session.pop("cart", None)
+        clear_cart()
         return redirect(url_for("main.articles"))
 
     return render_template("login.html")
@@ -201,8 +424,55 @@ def login():
 @bp.route("/articles")
 @login_required
 def articles():
+    """
+    Catalogue paginé, trié par prix : /articles?q=&min=&max=&page=&tri=desc
+
+    La liste d'articles ne dépend que du catalogue et des filtres : elle est
+    rendue une fois puis servie depuis le cache de fragments. L'ETag est
+    calculé à partir des entrées de la page (sans la rendre), ce qui permet
+    de répondre 304 directement quand le navigateur a déjà la bonne version.
+    """
     username = session.get("username")
-    return render_template("articles.html", username=username, articles=ARTICLES, cart_count=cart_count())
+    q = (request.args.get("q") or "").strip()
+    min_price = request.args.get("min", type=float)
+    max_price = request.args.get("max", type=float)
+    page = max(request.args.get("page", 1, type=int), 1)
+    descending = request.args.get("tri") == "desc"
+    count = cart_count()
+
+    fragment_key = (q, min_price, max_price, page, descending)
+    etag = hashlib.sha1(
+        repr((catalog.version, fragment_key, username, count, session.get("access_token"))).encode("utf-8")
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        listing = catalog_fragments.get_or_render(
+            catalog.version, fragment_key, lambda: render_catalog_listing(q, min_price, max_price, page, descending)
+        )
+        resp = make_response(render_template(
+            "articles.html", username=username, cart_count=count, listing=Markup(listing),
+        ))
+    resp.set_etag(etag)
+    # Page propre à l'utilisateur : cache navigateur uniquement, revalidé à chaque affichage
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp
+
+def render_catalog_listing(q, min_price, max_price, page, descending) -> str:
+    page_articles, total = catalog.search(
+        q, min_price, max_price, page=page, per_page=ARTICLES_PER_PAGE, descending=descending
+    )
+    pages = max((total + ARTICLES_PER_PAGE - 1) // ARTICLES_PER_PAGE, 1)
+    filters = {
+        k: v for k, v in (("q", q), ("min", min_price), ("max", max_price), ("tri", "desc" if descending else None))
+        if v not in (None, "")
+    }
+    return render_template(
+        "articles_list.html", articles=page_articles,
+        q=q, min_price=min_price, max_price=max_price, descending=descending,
+        page=page, pages=pages, total=total, filters=filters,
+    )
 
 
 # ----- Sélection des articles (pas d’achat direct) -----
@@ -210,21 +480,17 @@ def articles():
 @bp.route("/acheter/<int:article_id>")
 @login_required
 def acheter(article_id: int):
-    if article_id not in ARTICLES_BY_ID:
+    if article_id not in catalog:
         abort(404)
-    cart = session.get("cart", [])
-    cart.append(article_id)
-    session["cart"] = cart
+    cart_store.add(get_cart_id(create=True), article_id)
     return redirect(url_for("main.panier"))
 
 @bp.route("/panier/ajouter/<int:article_id>")
 @login_required
 def panier_ajouter(article_id: int):
-    if article_id not in ARTICLES_BY_ID:
+    if article_id not in catalog:
         abort(404)
-    cart = session.get("cart", [])
-    cart.append(article_id)
-    session["cart"] = cart
+    cart_store.add(get_cart_id(create=True), article_id)
     return redirect(url_for("main.articles"))
 
 @bp.route("/panier")
@@ -237,73 +503,63 @@ def panier():
 @bp.route("/panier/supprimer/<int:article_id>")
 @login_required
 def panier_supprimer(article_id: int):
-    cart = session.get("cart", [])
-    try:
-        cart.remove(article_id)
-    except ValueError:
-        pass
-    session["cart"] = cart
+    cart_id = get_cart_id()
+    if cart_id:
+        cart_store.remove(cart_id, article_id)
     return redirect(url_for("main.panier"))
 
 @bp.route("/panier/vider")
 @login_required
 def panier_vider():
-    session.pop("cart", None)
+    clear_cart()
     return redirect(url_for("main.panier"))
 
 @bp.route("/panier/payer", methods=["GET", "POST"])
 @login_required
 def panier_payer():
-    username = session.get("username")
-    user_id = session.get("user_id")
+    username = g.principal.username
+    user_id = g.principal.user_id
     items, total = get_cart_items_and_total()
     if not items:
         return redirect(url_for("main.panier"))
 
+    # Le stock du panier est mis de côté avant de débiter le client (même clé que le paiement)
+    idempotency_key = payment_idempotency_key(items)
+    error = reserve_cart_stock(idempotency_key, items)
+    if error:
+        return render_template("cart.html", username=username, items=items, total=total, error=error, cart_count=cart_count())
+
+    held = False
     try:
-        res = process_payment_with_breaker({"type": "cart", "total": total, "count": len(items)})
+        res = process_payment_with_breaker(
+            {"type": "cart", "total": total, "count": len(items)}, idempotency_key,
+            on_late_result=late_cart_payment(user_id, items, total, idempotency_key, get_cart_id()),
+        )
     except pybreaker.CircuitBreakerError:
         error = "Le service bancaire ne répond pas actuellement. Réessayez dans quelques instants."
-        return render_template("cart.html", username=username, items=items, total=total, error=error, cart_count=cart_count())
+    except PaymentGatewayBusy:
+        error = "Trop de paiements sont en cours. Réessayez dans quelques instants."
+    except PaymentDeadlineExceeded:
+        # Le débit est peut-être encore en cours à la banque : le stock reste réservé
+        # (libéré à l'expiration de la réservation), un nouvel essai avec la même
+        # clé reprend ce paiement au lieu d'en lancer un second, et s'il réussit
+        # sans nouvel essai, late_cart_payment enregistre la commande
+        held = True
+        error = ("Le paiement n'a pas été confirmé à temps. S'il aboutit, la commande sera enregistrée "
+                 "automatiquement ; sinon réessayez : vous ne serez pas débité deux fois.")
     except Exception as exc:
         logger.exception("Échec du paiement du panier : %s", exc)
         error = "Échec lors de la tentative de paiement (erreur réseau). Réessayez."
+    if error:
+        if not held:
+            release_cart_stock(idempotency_key)
         return render_template("cart.html", username=username, items=items, total=total, error=error, cart_count=cart_count())
 
-    dt_iso = datetime.utcnow().isoformat() + "Z"
-    txid = res.get("transaction_id")
-
-    # Envoi de la commande au Orders Service
-    if not user_id:
-        # Si pour une raison quelconque on n’a pas user_id en session, on tente de le récupérer via /verify
-        token = session.get("access_token")
-        if token:
-            try:
-                verify_resp = requests.post(f"{AUTH_SERVICE_URL}/verify", json={"token": token}, timeout=2)
-                if verify_resp.status_code == 200 and verify_resp.json().get("valid"):
-                    session["user_id"] = verify_resp.json().get("user", {}).get("sub")
-                    user_id = session["user_id"]
-            except requests.RequestException:
-                logger.exception("Impossible de récupérer user_id via Auth Service")
-
-    order_payload = {
-        "user_id": user_id,
-        "items": items,
-        "total": total,
-        "transaction_id": txid,
-        "datetime": dt_iso,
-    }
-
-    try:
-        order_resp = requests.post(f"{ORDERS_SERVICE_URL}/orders", json=order_payload, timeout=2)
-        if order_resp.status_code != 201:
-            logger.error("Orders Service a retourné un statut inattendu: %s", order_resp.status_code)
-    except requests.RequestException as exc:
-        logger.exception("Erreur lors de l’appel au Orders Service: %s", exc)
+    record_cart_order(cart_order(user_id, items, total, res, idempotency_key))
 
     # pour confirmation
     session["last_order"] = {"items": items, "total": total}
-    session.pop("cart", None)
+    clear_cart()
     return redirect(url_for("main.confirmation_panier"))
 
 @bp.route("/confirmation-panier")
@@ -317,43 +573,55 @@ def confirmation_panier():
 
 # ----- Historique -----
 
+def fetch_orders_page(user_id, cursor=None):
+    """
+    Récupère une page de l'historique (plus récentes d'abord) auprès du Orders Service.
+    Retourne (commandes, curseur de la page suivante ou None).
+    """
+    params = {"limit": HISTORY_PAGE_SIZE, "order": "desc"}
+    if cursor:
+        params["cursor"] = cursor
+    try:
+        resp = orders_client.list_orders(user_id, **params)
+        if resp.status_code == 200:
+            return resp.json(), resp.headers.get("X-Next-Cursor")
+        logger.error("Orders Service /orders/%s a retourné le statut %s", user_id, resp.status_code)
+    except requests.RequestException as exc:
+        logger.exception("Erreur lors de l’appel au Orders Service: %s", exc)
+    return [], None
+
 @bp.route("/historique")
 @login_required
 def historique():
-    username = session.get("username")
-    user_id = session.get("user_id")
-    orders = []
-
-    if not user_id:
-        # On tente de récupérer user_id via Auth Service
-        token = session.get("access_token")
-        if token:
-            try:
-                verify_resp = requests.post(f"{AUTH_SERVICE_URL}/verify", json={"token": token}, timeout=2)
-                if verify_resp.status_code == 200 and verify_resp.json().get("valid"):
-                    session["user_id"] = verify_resp.json().get("user", {}).get("sub")
-                    user_id = session["user_id"]
-            except requests.RequestException:
-                logger.exception("Impossible de récupérer user_id via Auth Service")
+    username = g.principal.username
+    orders, next_cursor = [], None
+    if g.principal.user_id:
+        orders, next_cursor = fetch_orders_page(g.principal.user_id)
 
-    if user_id:
-        try:
-            resp = requests.get(f"{ORDERS_SERVICE_URL}/orders/{user_id}", timeout=2)
-            if resp.status_code == 200:
-                orders = resp.json()
-            else:
-                logger.error("Orders Service /orders/%s a retourné le statut %s", user_id, resp.status_code)
-        except requests.RequestException as exc:
-            logger.exception("Erreur lors de l’appel au Orders Service: %s", exc)
+    return render_template("history.html", username=username, orders=orders, next_cursor=next_cursor)
 
-    return render_template("history.html", username=username, orders=orders)
+@bp.route("/historique/page")
+@login_required
+def historique_page():
+    """
+    Page suivante de l'historique (fragment HTML chargé à la demande par history.html).
+    """
+    user_id = g.principal.user_id
+    cursor = request.args.get("cursor", type=int)
+    if not user_id or not cursor:
+        abort(400)
+    orders, next_cursor = fetch_orders_page(user_id, cursor)
+    resp = make_response(render_template("history_orders.html", orders=orders))
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = str(next_cursor)
+    return resp
 
 # (Page héritée de l’ancien flow — optionnel)
 @bp.route("/confirmation/<int:article_id>")
 @login_required
 def confirmation(article_id: int):
     username = session.get("username")
-    article = ARTICLES_BY_ID.get(article_id)
+    article = catalog.get(article_id)
     if not article:
         abort(404)
     return render_template("confirmation.html", username=username, article=article)
\ No newline at end of file
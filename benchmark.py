@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BASE_DIR, "benchmarks")
+
+# Étapes d'un parcours utilisateur, dans l'ordre
+STEPS = ("login", "browse", "add", "pay", "history")
+SEARCH_TERMS = ("clavier", "souris", "ecran", "casque", "usb", "")
+
+
+# ---------- Clients ----------
+
+class HttpDriver:
+    """
+    Navigateur minimal sur un front lancé sous gunicorn (cookies de session conservés).
+    """
+
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method: str, path: str, data: dict = None) -> tuple:
+        resp = self.session.request(method, self.base_url + path, data=data, allow_redirects=False, timeout=30)
+        return resp.status_code, resp.headers.get("Location", "")
+
+
+class TestClientDriver:
+    """
+    Même interface sur le client de test Flask : front exécuté dans ce processus.
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, data: dict = None) -> tuple:
+        resp = self.client.open(path, method=method, data=data)
+        return resp.status_code, resp.headers.get("Location", "")
+
+
+# ---------- Parcours ----------
+
+def classify(step: str, status: int, location: str) -> str:
+    """
+    "ok", "rejected" (refus applicatif : paiement refusé, trop de tentatives...)
+    ou "error" (5xx, session perdue).
+    """
+    if status >= 500:
+        return "error"
+    target = urlsplit(location).path if location else ""
+    if step == "login":
+        return "ok" if status == 302 and target == "/articles" else "rejected"
+    if step == "pay":
+        if status == 302 and target == "/confirmation-panier":
+            return "ok"
+        return "error" if target == "/" else "rejected"
+    if status == 302 and target == "/":
+        # Renvoyé vers le login : la session n'a pas tenu
+        return "error"
+    return "ok" if status in (200, 302, 304) else "error"
+
+
+class Journey:
+    """
+    Un utilisateur virtuel : login, puis `iterations` fois
+    catalogue -> ajout au panier -> paiement -> historique.
+    Les mesures restent dans l'objet (pas de verrou) et sont fusionnées à la fin.
+    """
+
+    def __init__(self, driver, username: str, password: str, article_ids: list, iterations: int,
+                 think_time: float, seed: int):
+        self.driver = driver
+        self.username = username
+        self.password = password
+        self.article_ids = article_ids
+        self.iterations = iterations
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.samples = {step: [] for step in STEPS}     # étape -> [(durée en s, résultat)]
+
+    def _step(self, step: str, method: str, path: str, data: dict = None) -> str:
+        started = time.perf_counter()
+        try:
+            status, location = self.driver.request(method, path, data)
+            outcome = classify(step, status, location)
+        except Exception:
+            outcome = "error"
+        self.samples[step].append((time.perf_counter() - started, outcome))
+        if self.think_time:
+            time.sleep(self.rng.uniform(0, self.think_time))
+        return outcome
+
+    def run(self):
+        if self._step("login", "POST", "/", {"username": self.username, "password": self.password}) != "ok":
+            return
+        for _ in range(self.iterations):
+            term = self.rng.choice(SEARCH_TERMS)
+            self._step("browse", "GET", f"/articles?q={term}" if term else "/articles")
+            for article_id in self.rng.sample(self.article_ids, k=min(len(self.article_ids), self.rng.randint(1, 3))):
+                self._step("add", "GET", f"/panier/ajouter/{article_id}")
+            self._step("pay", "GET", "/panier/payer")
+            self._step("history", "GET", "/historique")
+
+
+# ---------- Statistiques ----------
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Percentile au rang le plus proche (valeurs déjà triées)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples: list, duration: float) -> dict:
+    latencies = sorted(elapsed for elapsed, _ in samples)
+    outcomes = [outcome for _, outcome in samples]
+    count = len(samples)
+    return {
+        "count": count,
+        "ok": outcomes.count("ok"),
+        "rejected": outcomes.count("rejected"),
+        "errors": outcomes.count("error"),
+        "error_rate": round(outcomes.count("error") / count, 4) if count else 0.0,
+        "throughput_rps": round(count / duration, 2) if duration else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def report(journeys: list, duration: float, config: dict) -> dict:
+    steps = {}
+    everything = []
+    for step in STEPS:
+        samples = [s for j in journeys for s in j.samples[step]]
+        everything.extend(samples)
+        steps[step] = summarize(samples, duration)
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "config": config,
+        "duration_s": round(duration, 2),
+        "steps": steps,
+        "total": summarize(everything, duration),
+    }
+
+
+def print_report(result: dict, baseline: dict = None):
+    header = f"{'étape':<10}{'n':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'refus':>8}{'erreurs':>9}"
+    if baseline:
+        header += f"{'Δ p95':>9}{'Δ req/s':>9}"
+    print(header)
+    for step, stats in list(result["steps"].items()) + [("total", result["total"])]:
+        line = (f"{step:<10}{stats['count']:>7}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}"
+                f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['rejected']:>8}{stats['errors']:>9}")
+        before = None
+        if baseline:
+            before = baseline["total"] if step == "total" else baseline["steps"].get(step)
+        if before:
+            line += f"{_delta(stats['p95_ms'], before['p95_ms']):>9}{_delta(stats['throughput_rps'], before['throughput_rps']):>9}"
+        print(line)
+
+
+def _delta(value: float, reference: float) -> str:
+    if not reference:
+        return "-"
+    return f"{(value - reference) / reference * 100:+.0f}%"
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Étapes dont le p95 ou le taux d'erreur s'est dégradé au-delà de `tolerance`.
+    """
+    found = []
+    for step, stats in result["steps"].items():
+        before = baseline["steps"].get(step)
+        if not before or not stats["count"]:
+            continue
+        if before["p95_ms"] and stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(f"{step} : p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+        if stats["error_rate"] > before["error_rate"] + tolerance / 10:
+            found.append(f"{step} : erreurs {before['error_rate']:.2%} -> {stats['error_rate']:.2%}")
+    return found
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ---------- Environnement ----------
+
+def prepare_environment(workdir: str, users: int, password: str, args) -> None:
+    """
+    Copie de la base dans `workdir`, comptes bench0..benchN, et variables
+    d'environnement des services : aucune donnée de app/data n'est modifiée.
+    """
+    db_path = os.path.join(workdir, "database.db")
+    shutil.copy(os.path.join(BASE_DIR, "app", "data", "database.db"), db_path)
+
+    sys.path.insert(0, os.path.join(BASE_DIR, "app", "auth_service"))
+    from user_store import UserStore
+    from werkzeug.security import generate_password_hash
+
+    store = UserStore(db_path)
+    password_hash = generate_password_hash(password)
+    for i in range(users):
+        store.set_password(f"bench{i}", password_hash)
+
+    os.environ.update({
+        "LOG_DIR": os.path.join(workdir, "logs"),
+        "AUTH_DB_PATH": db_path,
+        "AUTH_TOKENS_DB_PATH": os.path.join(workdir, "auth_tokens.db"),
+        "AUTH_KEYS_PATH": os.path.join(workdir, "jwt_keys.json"),
+        "INTERNAL_SERVICE_TOKEN": secrets.token_urlsafe(32),
+        # Tous les utilisateurs virtuels viennent de 127.0.0.1
+        "AUTH_LOGIN_IP_BURST": str(users * 2 + 20),
+        "ORDERS_DB_PATH": db_path,
+        "ORDERS_SHARD_DIR": os.path.join(workdir, "orders_shards"),
+        "INVENTORY_DB_PATH": os.path.join(workdir, "inventory.db"),
+        # Pas de stock initial : les commandes du scénario ne tombent jamais en rupture
+        "INVENTORY_SEED_PATH": "",
+        "OUTBOX_DB_PATH": os.path.join(workdir, "outbox.db"),
+        "PAYMENT_DB_PATH": os.path.join(workdir, "payments.db"),
+        "CART_DB_PATH": os.path.join(workdir, "carts.db"),
+        "BANK_FAILURE_RATE": str(args.bank_failure_rate),
+    })
+
+
+def port_in_use(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def boot_services(names: tuple, workers: int, threads: int, replicas: int = 1):
+    """
+    Lance les services sous gunicorn via le superviseur de run.py
+    (`replicas` instances d'auth et d'orders).
+    """
+    import run
+
+    supervisor = run.Supervisor(
+        workers={name: workers for name in run.SERVICES},
+        threads={name: threads for name in run.SERVICES},
+        replicas={"auth": replicas, "orders": replicas},
+    )
+    instances = [(name, i) for name in names for i in range(supervisor.replicas[name])]
+    busy = [run.instance_name(*inst) for inst in instances if port_in_use(run.replica_port(*inst))]
+    if busy:
+        raise SystemExit(f"Ports déjà utilisés par : {', '.join(busy)} (arrêtez run.py avant le benchmark)")
+
+    # Front lancé dans ce processus (--in-process) : il lit la liste des instances à l'import
+    os.environ.update({k: v for k, v in supervisor.env("front").items() if k.endswith("_SERVICE_URLS")})
+    for name, replica in instances:
+        if not supervisor.start(name, replica):
+            supervisor.stop()
+            instance = run.instance_name(name, replica)
+            raise SystemExit(f"{instance} n'a pas démarré (voir {os.environ['LOG_DIR']}/{instance}.log)")
+    return supervisor
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark des parcours login -> catalogue -> panier -> paiement -> historique.",
+    )
+    parser.add_argument("--users", type=int, default=10, help="Utilisateurs virtuels simultanés (défaut : 10).")
+    parser.add_argument("--iterations", type=int, default=5, help="Achats par utilisateur (défaut : 5).")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pause aléatoire max entre deux étapes (s).")
+    parser.add_argument("--workers", type=int, default=2, help="Processus gunicorn par service (défaut : 2).")
+    parser.add_argument("--threads", type=int, default=4, help="Threads par processus (défaut : 4).")
+    parser.add_argument("--replicas", type=int, default=1,
+                        help="Instances d'auth et d'orders, réparties par le front (défaut : 1).")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Front exécuté dans ce processus via le client de test Flask (auth et orders restent sous gunicorn).")
+    parser.add_argument("--bank-failure-rate", type=float, default=0.0,
+                        help="Taux d'échec de la banque simulée (défaut : 0, mesures sans pannes).")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Fichier JSON du résultat (défaut : benchmarks/<commit>.json).")
+    parser.add_argument("--compare", help="Résultat JSON de référence à comparer.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Dégradation de p95 tolérée avant de signaler une régression (défaut : 0.2 = 20 %%).")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    password = os.urandom(8).hex()
+    prepare_environment(workdir, args.users, password, args)
+    supervisor = boot_services(("auth", "orders") if args.in_process else ("auth", "orders", "front"),
+                               args.workers, args.threads, args.replicas)
+    try:
+        if args.in_process:
+            sys.path.insert(0, BASE_DIR)
+            from app import app
+            from app.views import catalog
+            make_driver = lambda: TestClientDriver(app)
+            article_ids = list(catalog.ids)
+        else:
+            import run
+            front_url = f"http://127.0.0.1:{run.SERVICES['front']['port']}"
+            make_driver = lambda: HttpDriver(front_url)
+            sys.path.insert(0, os.path.join(BASE_DIR, "app"))
+            from catalog import Catalog
+            article_ids = list(Catalog.load(os.path.join(BASE_DIR, "app", "data", "articles.json")).ids)
+
+        journeys = [
+            Journey(make_driver(), f"bench{i}", password, article_ids, args.iterations, args.think_time, args.seed + i)
+            for i in range(args.users)
+        ]
+        threads = [threading.Thread(target=j.run, name=f"bench{i}") for i, j in enumerate(journeys)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duration = time.perf_counter() - started
+    finally:
+        supervisor.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {
+        "users": args.users, "iterations": args.iterations, "think_time": args.think_time,
+        "workers": args.workers, "threads": args.threads, "replicas": args.replicas, "in_process": args.in_process,
+        "bank_failure_rate": args.bank_failure_rate, "orders_shards": int(os.environ.get("ORDERS_SHARDS", 1)),
+    }
+    result = report(journeys, duration, config)
+    print_report(result, baseline)
+
+    output = args.output or os.path.join(BASELINE_DIR, f"{result['git_commit'] or 'resultat'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultat enregistré dans {output}")
+
+    if baseline:
+        found = regressions(result, baseline, args.tolerance)
+        for line in found:
+            print(f"RÉGRESSION {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
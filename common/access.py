@@ -0,0 +1,22 @@
+import functools
+import hmac
+
+from flask import jsonify, request
+
+
+def require_token(view, token: str):
+    """
+    Réserve `view` aux requêtes portant "Authorization: Bearer <token>"
+    (jeton vide : endpoint désactivé).
+    """
+
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if not token:
+            return jsonify({"error": "Endpoint désactivé (jeton d'exploitation non défini)."}), 403
+        auth = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth.encode(), f"Bearer {token}".encode()):
+            return jsonify({"error": "Jeton d'exploitation invalide."}), 401
+        return view(*args, **kwargs)
+
+    return guarded
@@ -0,0 +1,179 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+from common.tracing import current_request_id
+
+# Jetons à ne jamais écrire : JWT, en-têtes Bearer, champs token/password dans un texte JSON ou clé=valeur
+_REDACTIONS = (
+    (re.compile(r"eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*"), "<jwt>"),
+    (re.compile(r"(?i)(bearer\s+)[A-Za-z0-9._~+/=-]+"), r"\1<redacted>"),
+    (re.compile(r"(?i)([\"']?(?:access_token|refresh_token|token|password|secret)[\"']?\s*[:=]\s*[\"']?)[^\"'\s,}&]+"),
+     r"\1<redacted>"),
+)
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Une ligne JSON par message : ts, level, service, logger, message, request_id,
+    exception éventuelle ; jetons et mots de passe masqués.
+    """
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for field in ("suppressed", "dropped"):
+            if getattr(record, field, 0):
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Le thread appelant ne fait que fusionner le message et le mettre en file ;
+    la trace d'une exception est mise en forme par le thread d'écriture.
+    File pleine (écriture trop lente) : le message est abandonné et compté,
+    jamais d'attente.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = current_request_id()
+        record.msg = record.getMessage()
+        record.args = None
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Les messages DEBUG ne sont gardés qu'avec une probabilité `debug_sample_rate`.
+    DEBUG, WARNING et ERROR sont de plus limités, par message (même logger, même
+    gabarit), à `per_second` occurrences par seconde en rafale de `burst` : une
+    panne qui répète la même erreur à chaque requête ne noie pas le journal.
+    Le message suivant qui passe indique combien ont été supprimés.
+    INFO (journal d'accès) et CRITICAL passent toujours.
+    """
+
+    def __init__(self, per_second: float = 10.0, burst: int = 20, debug_sample_rate: float = 0.01,
+                 max_keys: int = 1024):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self.debug_sample_rate = debug_sample_rate
+        self.max_keys = max_keys
+        self._buckets = {}     # (logger, gabarit) -> [jetons, dernier remplissage, supprimés]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.CRITICAL or record.levelno == logging.INFO:
+            return True
+        if record.levelno <= logging.DEBUG and random.random() >= self.debug_sample_rate:
+            return False
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+
+_configured = {}
+_configure_lock = threading.Lock()
+
+
+def _install(service: str):
+    level = os.environ.get(f"{service.upper()}_LOG_LEVEL", os.environ.get("LOG_LEVEL", "INFO")).upper()
+    log_queue = queue.Queue(maxsize=int(os.environ.get("LOG_QUEUE_SIZE", 10000)))
+    handler = _AsyncQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(
+        per_second=float(os.environ.get("LOG_RATE_PER_SECOND", 10)),
+        burst=int(os.environ.get("LOG_RATE_BURST", 20)),
+        debug_sample_rate=float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", 0.01)),
+    ))
+
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JsonFormatter(service))
+    listener = logging.handlers.QueueListener(log_queue, writer)
+    listener.start()
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, _AsyncQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _configured["listener"] = listener
+
+
+def configure_logging(service: str):
+    """
+    Journalisation du processus : les appels `logger.*` ne font que mettre le
+    message en file (QueueHandler) ; un thread d'arrière-plan le formate en
+    JSON, masque les jetons et l'écrit sur stderr (logs/<service>.log sous run.py).
+
+    Niveau : <SERVICE>_LOG_LEVEL (ex. AUTH_SERVICE_LOG_LEVEL), sinon LOG_LEVEL (INFO).
+    Débit : LOG_DEBUG_SAMPLE_RATE (0.01) des messages DEBUG, puis au plus
+    LOG_RATE_PER_SECOND (10) par message en rafale de LOG_RATE_BURST (20) ;
+    file de LOG_QUEUE_SIZE messages (10000), au-delà ils sont abandonnés.
+    Le thread d'écriture est recréé dans les processus issus d'un fork.
+    """
+    with _configure_lock:
+        if _configured.get("service") == service:
+            return
+        _configured["service"] = service
+        _install(service)
+        if not _configured.get("hooks"):
+            _configured["hooks"] = True
+            os.register_at_fork(after_in_child=lambda: _install(_configured["service"]))
+            # Vide la file à l'arrêt du processus
+            atexit.register(lambda: _configured["listener"].stop())
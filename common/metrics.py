@@ -0,0 +1,321 @@
+import threading
+import time
+import weakref
+
+import pybreaker
+from flask import Response, g, request, before_render_template, template_rendered
+
+from common.access import require_token
+
+# Bornes des histogrammes de latence (secondes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    __slots__ = ("data", "__weakref__")
+
+    def __init__(self):
+        self.data = {}
+
+
+class _ThreadShards:
+    """
+    Valeurs d'une métrique réparties par thread.
+
+    Chaque thread écrit dans son propre dict, sans verrou ; la lecture
+    (/metrics, peu fréquente) additionne les dicts de tous les threads.
+    Quand un thread se termine, sa part est versée dans `_retired`.
+    """
+
+    def __init__(self, merge):
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live = weakref.WeakSet()
+        self._retired = {}
+
+    def local(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            self._local.shard = shard
+            with self._lock:
+                self._live.add(shard)
+            weakref.finalize(shard, self._retire, shard.data)
+        return shard.data
+
+    def _retire(self, data: dict):
+        with self._lock:
+            self._merge(self._retired, data)
+
+    def snapshot(self) -> dict:
+        total = {}
+        with self._lock:
+            self._merge(total, self._retired)
+            for shard in list(self._live):
+                self._merge(total, shard.data.copy())
+        return total
+
+
+def _merge_counts(into: dict, other: dict):
+    for key, value in other.items():
+        into[key] = into.get(key, 0) + value
+
+
+def _merge_histograms(into: dict, other: dict):
+    for key, (buckets, total, count) in other.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = [list(buckets), total, count]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += total
+            current[2] += count
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._shards = _ThreadShards(_merge_counts)
+
+    def inc(self, *labels, amount: float = 1):
+        data = self._shards.local()
+        data[labels] = data.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._shards.snapshot().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._shards = _ThreadShards(_merge_histograms)
+
+    def observe(self, value: float, *labels):
+        data = self._shards.local()
+        entry = data.get(labels)
+        if entry is None:
+            entry = [[0] * len(self.buckets), 0.0, 0]
+            data[labels] = entry
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (buckets, total, count) in sorted(self._shards.snapshot().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class GaugeFunc:
+    """
+    Jauge calculée à la lecture : `fn()` retourne {tuple de labels: valeur}.
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple, fn):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.fn = fn
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets)
+
+    def gauge_func(self, name, help_text, labelnames, fn) -> GaugeFunc:
+        return self._get_or_create(GaugeFunc, name, help_text, labelnames, fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Registre du processus (un par service / worker)
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Durée de traitement des requêtes HTTP entrantes.",
+    ("service", "method", "route", "status"),
+)
+HTTP_ERRORS = REGISTRY.counter(
+    "http_request_errors_total", "Requêtes entrantes terminées en erreur 5xx ou par une exception.",
+    ("service", "route"),
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "upstream_request_duration_seconds", "Durée des appels vers les autres services.",
+    ("upstream", "endpoint", "outcome"),
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "upstream_errors_total", "Appels sortants en échec (réseau ou statut 5xx).",
+    ("upstream", "endpoint", "kind"),
+)
+TEMPLATE_LATENCY = REGISTRY.histogram(
+    "template_render_duration_seconds", "Durée du rendu des templates Jinja.", ("template",),
+)
+BREAKER_TRANSITIONS = REGISTRY.counter(
+    "circuit_breaker_transitions_total", "Changements d'état des circuit breakers.",
+    ("breaker", "from_state", "to_state"),
+)
+BREAKER_FAILURES = REGISTRY.counter(
+    "circuit_breaker_failures_total", "Échecs comptés par les circuit breakers.", ("breaker",),
+)
+
+BULKHEAD_REJECTIONS = REGISTRY.counter(
+    "bulkhead_rejections_total", "Appels refusés faute de place dans la cloison de la dépendance.", ("bulkhead",),
+)
+
+_BREAKERS = []
+_BREAKER_STATE_VALUES = {"closed": 0, "half-open": 1, "open": 2}
+REGISTRY.gauge_func(
+    "circuit_breaker_state", "État des circuit breakers (0 = fermé, 1 = semi-ouvert, 2 = ouvert).", ("breaker",),
+    lambda: {(b.name,): _BREAKER_STATE_VALUES.get(b.current_state, -1) for b in _BREAKERS},
+)
+
+
+def observe_upstream(upstream: str, endpoint: str, started: float, outcome: str):
+    """
+    Enregistre un appel sortant ; `started` vient de time.perf_counter().
+    `outcome` : "ok", "http_5xx", "timeout", "connection"...
+    """
+    UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream, endpoint, outcome)
+    if outcome != "ok":
+        UPSTREAM_ERRORS.inc(upstream, endpoint, outcome)
+
+
+def watch_breaker(breaker):
+    """
+    Publie l'état, les transitions et les échecs d'un pybreaker.CircuitBreaker
+    (ou d'un breaker de même interface).
+    """
+
+    class _MetricsListener(pybreaker.CircuitBreakerListener):
+        def state_change(self, cb, old_state, new_state):
+            BREAKER_TRANSITIONS.inc(cb.name, old_state.name if old_state else "none", new_state.name)
+
+        def failure(self, cb, exc):
+            BREAKER_FAILURES.inc(cb.name)
+
+    breaker.add_listener(_MetricsListener())
+    _BREAKERS.append(breaker)
+
+
+_BULKHEADS = []
+REGISTRY.gauge_func(
+    "bulkhead_in_flight", "Appels en cours par cloison (dépendance).", ("bulkhead",),
+    lambda: {(b.name,): b.in_flight for b in _BULKHEADS},
+)
+
+
+def watch_bulkhead(bulkhead):
+    """
+    Publie les appels en cours et les refus d'une cloison (app.resilience.Bulkhead).
+    """
+    bulkhead.on_reject = lambda b: BULKHEAD_REJECTIONS.inc(b.name)
+    _BULKHEADS.append(bulkhead)
+
+
+def instrument_app(app, service: str, token: str = None):
+    """
+    Mesure chaque requête de `app` (latence par route, erreurs), le rendu des
+    templates, et expose le registre sur GET /metrics (format Prometheus).
+    Avec `token` (service exposé publiquement), /metrics exige
+    "Authorization: Bearer <token>" ; un jeton vide le désactive.
+    """
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_record(exc):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        status = g.pop("_metrics_status", 500 if exc is not None else 0)
+        route = request.url_rule.rule if request.url_rule is not None else "<inconnue>"
+        HTTP_LATENCY.observe(time.perf_counter() - started, service, request.method, route, str(status))
+        if exc is not None or status >= 500:
+            HTTP_ERRORS.inc(service, route)
+
+    render_starts = threading.local()
+
+    def _template_start(sender, template, context, **extra):
+        render_starts.started = time.perf_counter()
+
+    def _template_done(sender, template, context, **extra):
+        started = getattr(render_starts, "started", None)
+        if started is not None:
+            TEMPLATE_LATENCY.observe(time.perf_counter() - started, template.name or "<inline>")
+            render_starts.started = None
+
+    before_render_template.connect(_template_start, app, weak=False)
+    template_rendered.connect(_template_done, app, weak=False)
+
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    if token is not None:
+        metrics = require_token(metrics, token)
+    app.add_url_rule("/metrics", "metrics", metrics, methods=["GET"])
@@ -0,0 +1,231 @@
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, jsonify, request, before_render_template, template_rendered
+
+from common.access import require_token
+
+# En-têtes propagés d'un service à l'autre
+REQUEST_ID_HEADER = "X-Request-ID"
+PARENT_HEADER = "X-Trace-Parent"
+SAMPLED_HEADER = "X-Trace-Sampled"
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+# Trace de la requête en cours dans ce thread (None hors requête)
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class _Trace:
+    __slots__ = ("request_id", "parent_id", "sampled", "spans", "stack")
+
+    def __init__(self, request_id: str, parent_id: str, sampled: bool):
+        self.request_id = request_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.spans = []
+        self.stack = []
+
+
+class Tracer:
+    """
+    Spans d'une requête et des appels qu'elle fait, regroupés par request id.
+
+    - Le request id est repris de l'en-tête X-Request-ID (sinon généré) et
+      renvoyé à chaque appel sortant, avec le span parent et la décision
+      d'échantillonnage : un même id relie les spans des trois services.
+    - Les spans sont collectés pour toutes les requêtes (quelques dicts) ;
+      à la fin, la trace est gardée si elle est échantillonnée (`sample_rate`,
+      ou décision transmise par le service appelant) ou plus lente que `slow_ms`.
+    - Traces gardées : les `buffer_size` dernières en mémoire (GET /debug/traces)
+      et, si `sink_path` est défini, une ligne JSON par span dans ce fichier.
+    """
+
+    def __init__(self, service: str, sample_rate: float = 0.01, slow_ms: float = 1000.0,
+                 sink_path: str = None, buffer_size: int = 200):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.sink_path = sink_path
+        self._recent = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def start(self, request_id: str = None, parent_id: str = None, sampled: str = None):
+        """Ouvre la trace de la requête courante ; retourne le jeton à passer à `finish`."""
+        if not request_id or not _VALID_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+            parent_id = None
+        if parent_id and not _VALID_ID.match(parent_id):
+            parent_id = None
+        if sampled in ("0", "1"):
+            keep = sampled == "1"
+        else:
+            keep = random.random() < self.sample_rate
+        return _current.set(_Trace(request_id, parent_id, keep))
+
+    def finish(self, token):
+        trace = _current.get()
+        _current.reset(token)
+        if trace is None or not trace.spans:
+            return
+        duration_ms = max(s["duration_ms"] for s in trace.spans)
+        if not trace.sampled and duration_ms < self.slow_ms:
+            return
+        for s in trace.spans:
+            s["trace_id"] = trace.request_id
+            s["service"] = self.service
+        self._recent.append({
+            "request_id": trace.request_id, "service": self.service,
+            "duration_ms": duration_ms, "sampled": trace.sampled, "spans": trace.spans,
+        })
+        if self.sink_path:
+            self._write(trace.spans)
+
+    def _write(self, spans: list):
+        data = "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in spans).encode("utf-8")
+        # Un seul write() en O_APPEND : les lignes de plusieurs processus ne s'entremêlent pas
+        with self._lock:
+            fd = os.open(self.sink_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def recent(self, request_id: str = None, min_ms: float = 0.0, limit: int = 50) -> list:
+        """Dernières traces gardées par ce processus, les plus récentes d'abord."""
+        traces = [
+            t for t in reversed(self._recent)
+            if (request_id is None or t["request_id"] == request_id) and t["duration_ms"] >= min_ms
+        ]
+        return traces[:limit]
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Mesure un bloc dans la trace de la requête courante (sans effet hors requête).
+    Le dict retourné peut recevoir des attributs : `s["attrs"]["status"] = 200`.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield {"attrs": {}}
+        return
+    record = {
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": trace.stack[-1] if trace.stack else trace.parent_id,
+        "name": name,
+        "start": time.time(),
+        "attrs": attrs,
+    }
+    trace.stack.append(record["span_id"])
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        trace.stack.pop()
+        trace.spans.append(record)
+
+
+def current_request_id() -> str:
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+
+def propagation_headers() -> dict:
+    """En-têtes à ajouter à un appel sortant fait pendant la requête courante."""
+    trace = _current.get()
+    if trace is None:
+        return {}
+    headers = {REQUEST_ID_HEADER: trace.request_id, SAMPLED_HEADER: "1" if trace.sampled else "0"}
+    parent = trace.stack[-1] if trace.stack else trace.parent_id
+    if parent:
+        headers[PARENT_HEADER] = parent
+    return headers
+
+
+def _float_arg(name: str, default: float) -> float:
+    try:
+        return float(request.args.get(name, default))
+    except ValueError:
+        return default
+
+
+def instrument_tracing(app, service: str, token: str = None) -> Tracer:
+    """
+    Ouvre une trace par requête de `app` (span racine + rendu des templates),
+    renvoie X-Request-ID dans la réponse et expose GET /debug/traces
+    (?request_id=, ?min_ms=, ?limit=). Avec `token`, /debug/traces exige
+    "Authorization: Bearer <token>" ; un jeton vide le désactive.
+
+    Configuration : TRACE_SAMPLE_RATE (0.01), TRACE_SLOW_MS (1000),
+    TRACE_SINK_PATH (fichier JSONL, désactivé par défaut), TRACE_BUFFER_SIZE (200).
+    """
+    tracer = Tracer(
+        service,
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", 0.01)),
+        slow_ms=float(os.environ.get("TRACE_SLOW_MS", 1000)),
+        sink_path=os.environ.get("TRACE_SINK_PATH") or None,
+        buffer_size=int(os.environ.get("TRACE_BUFFER_SIZE", 200)),
+    )
+
+    @app.before_request
+    def _trace_start():
+        g._trace_token = tracer.start(
+            request.headers.get(REQUEST_ID_HEADER),
+            request.headers.get(PARENT_HEADER),
+            request.headers.get(SAMPLED_HEADER),
+        )
+        route = request.url_rule.rule if request.url_rule is not None else "<inconnue>"
+        g._trace_root_cm = span(f"{request.method} {route}")
+        g._trace_root = g._trace_root_cm.__enter__()
+
+    @app.after_request
+    def _trace_header(response):
+        request_id = current_request_id()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        g._trace_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _trace_finish(exc):
+        root_cm = g.pop("_trace_root_cm", None)
+        token = g.pop("_trace_token", None)
+        if root_cm is None or token is None:
+            return
+        g._trace_root["attrs"]["status"] = g.pop("_trace_status", 500 if exc is not None else 0)
+        root_cm.__exit__(None, None, None)
+        tracer.finish(token)
+
+    render_spans = threading.local()
+
+    def _template_start(sender, template, context, **extra):
+        render_spans.current = span("render", template=template.name or "<inline>")
+        render_spans.current.__enter__()
+
+    def _template_done(sender, template, context, **extra):
+        current = getattr(render_spans, "current", None)
+        if current is not None:
+            current.__exit__(None, None, None)
+            render_spans.current = None
+
+    before_render_template.connect(_template_start, app, weak=False)
+    template_rendered.connect(_template_done, app, weak=False)
+
+    def debug_traces():
+        limit = int(min(max(_float_arg("limit", 50), 1), 500))
+        return jsonify(tracer.recent(request.args.get("request_id"), _float_arg("min_ms", 0.0), limit))
+
+    if token is not None:
+        debug_traces = require_token(debug_traces, token)
+    app.add_url_rule("/debug/traces", "debug_traces", debug_traces, methods=["GET"])
+    return tracer
@@ -1,21 +1,213 @@
+import argparse
+import os
+import secrets
+import signal
 import subprocess
 import sys
-import os
-from app import app
+import time
+import urllib.request
 
-if __name__ == "__main__":
-    # Paths to microservices
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    auth_path = os.path.join(base_dir, "app", "auth_service", "auth_service.py")
-    orders_path = os.path.join(base_dir, "app", "orders_service", "orders_service.py")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.environ.get("LOG_DIR", os.path.join(BASE_DIR, "logs"))
+
+# Les trois services : module WSGI, dossier d'import, port
+SERVICES = {
+    "auth": {"chdir": os.path.join(BASE_DIR, "app", "auth_service"), "module": "auth_service:create_app()", "port": 5001},
+    "orders": {"chdir": os.path.join(BASE_DIR, "app", "orders_service"), "module": "orders_service:app", "port": 5003},
+    "front": {"chdir": BASE_DIR, "module": "app:app", "port": 5050},
+}
+# Instances supplémentaires d'un service : port de base + 100, + 200...
+REPLICA_PORT_STEP = 100
+
+
+def open_log(name: str):
+    """
+    Fichier de log d'un service : la sortie des processus enfants y est écrite
+    directement (pas de PIPE qu'il faudrait vider).
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    return open(os.path.join(LOG_DIR, f"{name}.log"), "ab", buffering=0)
+
+
+def wait_until_healthy(name: str, port: int, proc: subprocess.Popen, timeout: float = 30) -> bool:
+    """
+    Attend que GET /health réponde 200 (ou que le processus meure).
+    """
+    url = f"http://127.0.0.1:{port}/health"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    print(f"[run] {name} n'est pas prêt après {timeout:.0f}s", file=sys.stderr)
+    return False
+
+
+def replica_port(name: str, replica: int) -> int:
+    return SERVICES[name]["port"] + replica * REPLICA_PORT_STEP
+
+
+def instance_name(name: str, replica: int) -> str:
+    return name if replica == 0 else f"{name}-{replica}"
+
+
+class Supervisor:
+    """
+    Lance chaque service sous gunicorn (N processus x T threads), attend que
+    son /health réponde avant de démarrer le suivant, et relance un service
+    dont le processus maître s'arrête. Gunicorn relance lui-même ses workers.
+
+    Auth et Orders peuvent tourner en plusieurs instances (`replicas`), sur
+    des ports distincts ; le front reçoit la liste et répartit lui-même les appels.
+    """
 
-    # Launch Auth Service
-    subprocess.Popen([sys.executable, auth_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def __init__(self, workers: dict, threads: dict, replicas: dict = None):
+        self.workers = workers
+        self.threads = threads
+        self.replicas = {name: max((replicas or {}).get(name, 1), 1) for name in SERVICES}
+        self.procs = {}
+        self.instances = {}
+        self.restarts = {}
+        self.stopping = False
+
+    def command(self, name: str, replica: int = 0) -> list:
+        spec = SERVICES[name]
+        return [
+            sys.executable, "-m", "gunicorn",
+            "--bind", f"127.0.0.1:{replica_port(name, replica)}",
+            "--workers", str(self.workers[name]),
+            "--threads", str(self.threads[name]),
+            "--chdir", spec["chdir"],
+            "--access-logfile", "-",
+            "--error-logfile", "-",
+            "--graceful-timeout", "10",
+            spec["module"],
+        ]
+
+    def env(self, name: str) -> dict:
+        env = dict(os.environ)
+        if name == "front":
+            # Plusieurs processus front : les paniers doivent être partagés
+            env.setdefault("CART_BACKEND", "sqlite")
+            for upstream in ("auth", "orders"):
+                urls = [f"http://127.0.0.1:{replica_port(upstream, i)}" for i in range(self.replicas[upstream])]
+                env.setdefault(f"{upstream.upper()}_SERVICE_URLS", ",".join(urls))
+        return env
+
+    def start(self, name: str, replica: int = 0) -> bool:
+        instance = instance_name(name, replica)
+        log = open_log(instance)
+        proc = subprocess.Popen(
+            self.command(name, replica), stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+            env=self.env(name),
+        )
+        log.close()
+        self.procs[instance] = proc
+        self.instances[instance] = (name, replica)
+        ready = wait_until_healthy(instance, replica_port(name, replica), proc)
+        status = "prêt" if ready else "arrêté" if self.stopping else "ÉCHEC du démarrage"
+        print(f"[run] {instance} (pid {proc.pid}) {status}", file=sys.stderr)
+        return ready
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            # Le front en dernier : il ne reçoit du trafic qu'une fois ses dépendances prêtes
+            for name in ("auth", "orders", "front"):
+                for replica in range(self.replicas[name]):
+                    # Ctrl-C ou SIGTERM pendant le démarrage : on n'en lance pas d'autre
+                    if self.stopping:
+                        return
+                    if not self.start(name, replica):
+                        if self.stopping:
+                            return
+                        sys.exit(1)
+            print(f"[run] Application disponible sur http://127.0.0.1:{SERVICES['front']['port']}/", file=sys.stderr)
+
+            while not self.stopping:
+                time.sleep(1)
+                for instance, proc in list(self.procs.items()):
+                    if self.stopping or proc.poll() is None:
+                        continue
+                    self.restarts[instance] = self.restarts.get(instance, 0) + 1
+                    delay = min(2 ** self.restarts[instance], 30)
+                    print(f"[run] {instance} arrêté (code {proc.returncode}), relance dans {delay}s", file=sys.stderr)
+                    time.sleep(delay)
+                    if not self.stopping and self.start(*self.instances[instance]):
+                        self.restarts[instance] = 0
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Arrête toutes les instances lancées. Peut être rappelé (signal puis
+        `finally` de run) : un processus enregistré entre-temps est arrêté aussi.
+        """
+        self.stopping = True
+        procs = list(self.procs.values())
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run_dev():
+    """
+    Mode développement : serveurs Flask intégrés, front en debug avec rechargement.
+    """
+    from app import app
+
+    # Avec le reloader, ce script est exécuté deux fois : seul le processus parent lance les services
+    if os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        for name in ("auth", "orders"):
+            spec = SERVICES[name]
+            script = os.path.join(spec["chdir"], f"{spec['module'].split(':')[0]}.py")
+            log = open_log(name)
+            subprocess.Popen([sys.executable, script], stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+            log.close()
 
-    # Launch Orders Service
-    subprocess.Popen([sys.executable, orders_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     app.run(
         host="127.0.0.1",
-        port=5050,
+        port=SERVICES["front"]["port"],
         debug=True
-    )
\ No newline at end of file
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lance les trois services de l'application.")
+    parser.add_argument("--prod", action="store_true",
+                        help="Superviseur : gunicorn multi-processus, /health avant trafic, relance automatique.")
+    for name in SERVICES:
+        parser.add_argument(f"--{name}-workers", type=int, default=int(os.environ.get(f"{name.upper()}_WORKERS", os.cpu_count() or 2)),
+                            help=f"Nombre de processus pour {name} (défaut : nombre de cœurs).")
+        parser.add_argument(f"--{name}-threads", type=int, default=int(os.environ.get(f"{name.upper()}_THREADS", 4)),
+                            help=f"Threads par processus pour {name} (défaut : 4).")
+    for name in ("auth", "orders"):
+        parser.add_argument(f"--{name}-replicas", type=int, default=int(os.environ.get(f"{name.upper()}_REPLICAS", 1)),
+                            help=f"Instances de {name} (ports {SERVICES[name]['port']}, +{REPLICA_PORT_STEP}...), "
+                                 "réparties par le front (défaut : 1).")
+    args = parser.parse_args()
+
+    # Jeton partagé entre le front et l'Auth Service (/revocations), hérité par les processus lancés
+    os.environ.setdefault("INTERNAL_SERVICE_TOKEN", secrets.token_urlsafe(32))
+
+    if args.prod:
+        Supervisor(
+            workers={name: getattr(args, f"{name}_workers") for name in SERVICES},
+            threads={name: getattr(args, f"{name}_threads") for name in SERVICES},
+            replicas={name: getattr(args, f"{name}_replicas") for name in ("auth", "orders")},
+        ).run()
+    else:
+        run_dev()